@@ -0,0 +1,172 @@
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager, ExitStack
+from printing import print_verbose
+
+# Number of hex digits of the input hash kept in artifact names
+ARTIFACT_KEY_LENGTH = 12
+
+# Directory, next to the artifacts, holding their lock files
+ARTIFACT_LOCK_DIR = ".locks"
+
+# Temporary files of artifacts being built are hidden next to them as .<name>.<random><ARTIFACT_TEMP_SUFFIX><extension>
+ARTIFACT_TEMP_SUFFIX = ".tmp"
+
+# Permissions of the files written by atomic_write, those open() would give. mkstemp creates its files readable by
+# their owner only. The umask can only be read by setting it, which is done once here, before any thread could be
+# creating files
+process_umask = os.umask(0)
+os.umask(process_umask)
+ATOMIC_WRITE_MODE = 0o666 & ~process_umask
+
+# Size of the blocks input files are hashed in
+DIGEST_BLOCK_SIZE = 1024 * 1024
+
+# Digests of the input files hashed so far, keyed by (path, size, mtime)
+file_digests = {}
+
+def file_digest(file_path):
+    """SHA-256 of the content of a file, cached until the file changes"""
+    stat = os.stat(file_path)
+    cache_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if cache_key not in file_digests:
+        hasher = hashlib.sha256()
+        with open(file_path, "rb") as infile:
+            for block in iter(lambda: infile.read(DIGEST_BLOCK_SIZE), b""):
+                hasher.update(block)
+        file_digests[cache_key] = hasher.hexdigest()
+
+    return file_digests[cache_key]
+
+def artifact_key(kind, **inputs):
+    """
+    Hash of everything an artifact is built from, to put in its name so artifacts built from different inputs never
+    share a file and the same inputs always find the artifact built before. Input files are given by their file_digest.
+    """
+    description = json.dumps({"kind": kind, "inputs": inputs}, sort_keys=True, default=str)
+    return hashlib.sha256(description.encode()).hexdigest()[:ARTIFACT_KEY_LENGTH]
+
+def artifact_lock_path(artifact_path):
+    directory, name = os.path.split(os.path.abspath(artifact_path))
+    return os.path.join(directory, ARTIFACT_LOCK_DIR, name + ".lock")
+
+@contextmanager
+def artifact_lock(artifact_path):
+    """
+    Hold the lock of an artifact, shared by every process of the machine. Waits for whoever holds it, typically a worker
+    building the artifact. The lock is released if its holder dies, so a crashed build never blocks the others.
+    """
+    lock_path = artifact_lock_path(artifact_path)
+    os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+
+    with open(lock_path, "a") as lock_file:
+        start_time = time.time()
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        wait_time = (time.time() - start_time) * 1000
+        if wait_time > 100:
+            print_verbose(f"Waited {wait_time:0.2f} ms for the lock of {artifact_path}")
+
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+@contextmanager
+def artifact_locks(artifact_paths):
+    """Hold the locks of several artifacts, taken in sorted order so two workers locking overlapping sets can't deadlock"""
+    with ExitStack() as stack:
+        for artifact_path in sorted(set(os.path.abspath(path) for path in artifact_paths)):
+            stack.enter_context(artifact_lock(artifact_path))
+        yield
+
+def remove_stale_temp_files(artifact_path):
+    """Remove the temporary files left by builds of an artifact that died, only safe while holding its lock"""
+    directory, name = os.path.split(os.path.abspath(artifact_path))
+    for temp_path in glob.glob(os.path.join(glob.escape(directory), "." + glob.escape(name) + ".*" + ARTIFACT_TEMP_SUFFIX + "*")):
+        print_verbose(f"Removing {temp_path}, left by a build of {artifact_path} that didn't finish")
+        os.unlink(temp_path)
+
+@contextmanager
+def atomic_write(path, suffix=None):
+    """
+    Write a file atomically: yields the path of a temporary file next to path, hidden as .<name>.<random>.tmp<suffix>,
+    that is renamed to path once the block finishes, so readers never see a partial file. The temporary file is removed
+    if the block raises (or exits). suffix defaults to the extension of path, so the temporary file of a compressed file
+    is compressed the same way.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    if suffix is None:
+        suffix = os.path.splitext(name)[1]
+
+    temp_fd, temp_path = tempfile.mkstemp(prefix="." + name + ".", suffix=ARTIFACT_TEMP_SUFFIX + suffix, dir=directory)
+    os.fchmod(temp_fd, ATOMIC_WRITE_MODE)
+    os.close(temp_fd)
+
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+
+def load_versioned_json(path, version, description):
+    """
+    Content of a JSON file written by save_versioned_json, or None if there is none yet. Files of another version are
+    ignored with a warning, so a layout change never reads an old file wrongly.
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as infile:
+        content = json.load(infile)
+    if content.get("version") != version:
+        print(f"WARNING: Ignoring {description} {path} of version {content.get('version')}, expected {version}")
+        return None
+    return content
+
+def save_versioned_json(path, version, content):
+    """Write the dict content with its version to a JSON file, atomically (see atomic_write) so it's never left partial"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with atomic_write(path) as temp_path, open(temp_path, "w") as outfile:
+        json.dump({"version": version, **content}, outfile, indent=2, sort_keys=True)
+
+def build_artifact(artifact_path, build, exists=os.path.exists, in_place=False):
+    '''
+    Build the artifact at artifact_path once, however many workers ask for it at the same time.
+
+    If exists(artifact_path) is false, the artifact's lock is taken and exists checked again, so the workers that were
+    waiting on the one building it find it built instead of building it again. build(path) then writes the artifact to
+    a temporary file next to it (keeping its extension) that is renamed to artifact_path once complete, so readers
+    never see a partial artifact. Builders that already write their output atomically are given artifact_path
+    directly with in_place.
+
+    Returns True if this call built the artifact.
+    '''
+    if exists(artifact_path):
+        return False
+
+    os.makedirs(os.path.dirname(os.path.abspath(artifact_path)), exist_ok=True)
+
+    with artifact_lock(artifact_path):
+        if exists(artifact_path):
+            print_verbose(f"{artifact_path} was built by another worker")
+            return False
+
+        remove_stale_temp_files(artifact_path)
+
+        if in_place:
+            build(artifact_path)
+            return True
+
+        with atomic_write(artifact_path) as temp_path:
+            build(temp_path)
+            if os.path.getsize(temp_path) == 0:
+                print(f"ERROR: Building {artifact_path} produced an empty file.")
+                exit(1)
+
+    return True
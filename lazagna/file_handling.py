@@ -27,6 +27,25 @@ def generate_empty_results(original_dir, result_path, result_file_name, benchmar
         writer.writerow(csv_headers)  # Write headers
         writer.writerow(csv_results)  # Write data
 
+def read_total_run_time(result_file_path):
+    """
+    TotalRunTime of the run a results CSV holds, None if it has none: the file or column is missing, or the results
+    are the empty ones of generate_empty_results.
+    """
+    if not os.path.exists(result_file_path):
+        return None
+
+    with open(result_file_path, mode='r', newline='') as file:
+        for row in csv.DictReader(file):
+            try:
+                total_run_time = float(row.get("TotalRunTime"))
+            except (TypeError, ValueError):
+                continue
+            if total_run_time > 0:
+                return total_run_time
+
+    return None
+
 def get_files_with_extension(directory, extension):
     """
     Recursively finds all files with the '.blif' extension in the given directory.
@@ -1,10 +1,19 @@
 # Main scripting file to run LaZagna
 
-from run_interface import run_interface, ITD_paper_top_modules, ITD_subset_top_modules, ITD_quick_top_modules, VTR_benchmarks_top_modules
-from file_handling import get_files_with_extension
+from run_interface import check_run_params, setup_run, benchmark_run_args, run_one_benchmark, ITD_paper_top_modules, ITD_subset_top_modules, ITD_quick_top_modules, VTR_benchmarks_top_modules
+from file_handling import get_files_with_extension, extract_file_name
 from yaml_file_processing import get_run_params_from_yaml
+from run_flow import get_finished_base_rrgs, collect_3d_rrg_profiles
+from sweep_plan import plan_sweep, run_sweep, SweepTask
+from rrg_compression import compress_rrg_in_background, wait_for_background_compression
+from memory_admission import MemoryHistory, MEMORY_HISTORY_FILE, OOM_GROWTH_FACTOR, default_memory_budget, run_counters, share_run_counters
+from runtime_history import RuntimeHistory, RUNTIME_HISTORY_FILE, benchmark_runtime_args
 import os
+import shutil
+import tempfile
+from collections import Counter
 from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import psutil
 import printing
 import time
@@ -16,20 +25,57 @@ parser = argparse.ArgumentParser(description="Run 3DFADE tests in parallel using
 
 parser.add_argument("-f", "--yaml_file", type=str, required=True, help="Path to the yaml file containing the test parameters.")
 parser.add_argument("-v", "--verbose", action="store_true", help="Enable verbose output.")
-parser.add_argument("-j", "--num_workers", type=int, default=1, help="Number of parallel workers to use. Default is 1. Total number of cores = <num_workers> * <num_task_workers>")
-parser.add_argument("-n", "--num_task_workers", type=int, default=1, help="Number of parallel workers to use per task. Default is 1. Total number of cores = <num_workers> * <num_task_workers>")
+parser.add_argument("-j", "--num_workers", type=int, default=1, help="Number of parallel workers to use. Default is 1. The workers share all the (config, benchmark) runs of the sweep, each takes the next one as soon as it is free.")
+parser.add_argument("-n", "--num_task_workers", type=int, default=None, help="Deprecated, the workers are no longer split per config. Given, <num_workers> * <num_task_workers> workers are used.")
+parser.add_argument("--memory_budget", type=float, default=None, help="Memory in GB the runs may take together. A run only starts if the peak memory projected for it, from past runs of the same benchmark kept in results/memory_history.json, fits with the runs already going. Default is 90%% of the memory of the machine.")
+parser.add_argument("--memory_estimate", type=float, default=2, help="Memory in GB projected for a benchmark never run before. Default is 2.")
+parser.add_argument("--oom_retries", type=int, default=2, help="Number of times a run killed for lack of memory is run again (with a larger projected memory) before its results are recorded empty. Default is 2.")
 # the directory of this file
 original_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-def run_job(param):
+def lower_priority():
     # Lower the priority of the current process
     process = psutil.Process(os.getpid())
-    process.nice(11)
-    
+    if process.nice() < 11:
+        process.nice(11)
+
+def setup_job(param, temp_dir):
+    """
+    Set up the task template of a config in a new directory of temp_dir, that its benchmark_jobs copy.
+
+    Returns:
+        tuple: (template directory, task run folder, output identifier), or None if the config is missing parameters
+    """
+    lower_priority()
+
     param_copy = param.copy()
     param_copy['original_dir'] = original_dir
-    param_copy['num_task_workers'] = param.get('num_task_workers', 1)
-    return run_interface(params=param_copy)
+    if not check_run_params(param_copy):
+        return None
+
+    template_dir = tempfile.mkdtemp(prefix="config_", dir=temp_dir)
+    return (template_dir,) + setup_run(param_copy, template_dir)
+
+def benchmark_job(param, i, setup, requeue_on_oom=False):
+    """
+    Run benchmark i of a config set up by setup_job.
+
+    Returns:
+        dict: The status of the run (see run_flow), None if the config couldn't be set up
+    """
+    if setup is None:
+        return None
+
+    lower_priority()
+
+    param_copy = param.copy()
+    param_copy['original_dir'] = original_dir
+    template_dir, task_run_folder, output_identifier = setup
+    return run_one_benchmark(i, requeue_on_oom=requeue_on_oom, **benchmark_run_args(param_copy, i, task_run_folder, output_identifier, template_dir))
+
+def benchmark_memory_args(param, i):
+    """Arguments of MemoryHistory.estimate and MemoryHistory.record for benchmark i of a config"""
+    return extract_file_name(param['verilog_files'][i]), int(param['width']), int(param['height']), int(param['channel_width'])
 
 def setup_benchmark_files(run_params):
     for param in run_params:
@@ -85,13 +131,97 @@ def main():
     # Determine the number of CPUs to use (leave one free for system responsiveness)
     # num_workers = max(1, psutil.cpu_count(logical=True) - 1)
     num_workers = args.num_workers
+    if args.num_task_workers is not None:
+        print(f"WARNING: -n/--num_task_workers is deprecated, all workers now share the benchmarks of every config. Using {args.num_workers * args.num_task_workers} workers.")
+        num_workers = args.num_workers * args.num_task_workers
+
+    # The task templates of the configs, each removed once all of its benchmarks are done
+    sweep_temp_dir = tempfile.mkdtemp(prefix="lazagna_sweep_")
+
+    # Build each modified arch, base RRG and group of 3D RRGs the sweep needs once, and run every (config, benchmark) as
+    # soon as the artifacts of its config exist, all on the same workers
+    tasks, rrg_groups = plan_sweep(original_dir, run_params, partial(setup_job, temp_dir=sweep_temp_dir), partial(benchmark_job, requeue_on_oom=args.oom_retries > 0))
+
+    # Runs only start while their projected peak memory fits the budget, and runs killed for lack of memory are run
+    # again instead of recording empty results
+    memory_history = MemoryHistory(original_dir + MEMORY_HISTORY_FILE, default_estimate=int(args.memory_estimate * 1024 ** 3))
+    memory_budget = default_memory_budget() if args.memory_budget is None else int(args.memory_budget * 1024 ** 3)
+    oom_attempts = Counter()
+
+    def estimate_memory(name):
+        if name[0] != "benchmark":
+            return 0
+        index, i = name[1]
+        return memory_history.estimate(*benchmark_memory_args(run_params[index], i))
+
+    # The longest runs start first, by their TotalRunTime in past sweeps or the size of their benchmark, so no huge
+    # benchmark is left to run alone at the end of the sweep
+    runtime_history = RuntimeHistory(original_dir + RUNTIME_HISTORY_FILE)
+    runtime_args = {name: benchmark_runtime_args(original_dir, run_params[name[1][0]], name[1][1]) for name in tasks if name[0] == "benchmark"}
+    runtime_estimates = {name: runtime_history.estimate(*args) for name, args in runtime_args.items()}
+    for name, estimate in list(runtime_estimates.items()):
+        setup_task = ("setup", name[1][0])
+        runtime_estimates[setup_task] = max(runtime_estimates.get(setup_task, 0), estimate)
+
+    def estimate_runtime(name):
+        return runtime_estimates.get(name, 0)
+
+    task_counts = Counter(name[0] for name in tasks)
+    print(f"Running {task_counts['benchmark']} benchmarks of {len(run_params)} configs in parallel using {num_workers} workers, after building {task_counts['arch']} archs, {task_counts['base_rrg']} base RRGs and the 3D RRGs of {task_counts['rrg_3d']} base RRGs")
+
+    rrg_groups_left = Counter(group['rrg_path'] for group in rrg_groups)
+    benchmarks_left = Counter(name[1][0] for name in tasks if name[0] == "benchmark")
+    template_dirs = {}
+
+    def on_task_done(name, result):
+        if name[0] == "setup" and result is not None:
+            template_dirs[name[1]] = result[0]
+
+        if name[0] == "benchmark" and result is not None:
+            index, i = name[1]
+            memory_args = benchmark_memory_args(run_params[index], i)
+            memory_history.record(*memory_args, result["peak_rss_bytes"] * (OOM_GROWTH_FACTOR if result["out_of_memory"] else 1))
+            memory_history.save()
+            runtime_history.record(*runtime_args[name], result["total_run_time"])
+            runtime_history.save()
+
+            if result["requeue"]:
+                oom_attempts[name] += 1
+                print(f"WARNING: Requeuing benchmark {memory_args[0]} of config {index} (attempt {oom_attempts[name] + 1}) with {memory_history.estimate(*memory_args) / 1024 ** 3:0.2f} GB projected")
+                return SweepTask(name, partial(benchmark_job, run_params[index], i, requeue_on_oom=oom_attempts[name] < args.oom_retries), [("setup", index)], [("setup", index)])
+
+        if name[0] == "benchmark":
+            benchmarks_left[name[1][0]] -= 1
+
+        if name[0] in ("setup", "benchmark"):
+            index = name[1] if name[0] == "setup" else name[1][0]
+            if benchmarks_left[index] == 0 and index in template_dirs:
+                shutil.rmtree(template_dirs.pop(index), ignore_errors=True)
+
+        if name[0] != "rrg_3d":
+            return
+
+        group = rrg_groups[name[1]]
+        rrg_groups_left[group['rrg_path']] -= 1
+
+        # The jobs only read the 3D RRGs, compress the base RRGs they were made from while the jobs run
+        if rrg_groups_left[group['rrg_path']] == 0:
+            base_rrg_groups = [other for other in rrg_groups if other['rrg_path'] == group['rrg_path']]
+            for rrg_path, compression in get_finished_base_rrgs(original_dir, base_rrg_groups, run_params):
+                compress_rrg_in_background(rrg_path, compression)
+
+        if sum(rrg_groups_left.values()) == 0:
+            collect_3d_rrg_profiles(original_dir, rrg_groups)
 
-    print(f"Running {len(run_params)} jobs in parallel using {num_workers} workers")
-        
-    
     # Run jobs in parallel using ProcessPoolExecutor
-    with ProcessPoolExecutor(max_workers=num_workers) as executor:
-        results = list(executor.map(run_job, run_params))
+    try:
+        # The workers share their run counters, so a run can tell an OOM kill in the cgroup was its own
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=share_run_counters, initargs=(run_counters,)) as executor:
+            run_sweep(tasks, executor, num_workers, on_done=on_task_done, memory_estimate=estimate_memory, memory_budget=memory_budget, runtime_estimate=estimate_runtime)
+    finally:
+        shutil.rmtree(sweep_temp_dir, ignore_errors=True)
+
+    wait_for_background_compression()
 
     end_time = time.time()
 
@@ -0,0 +1,218 @@
+import glob
+import multiprocessing
+import os
+import re
+import signal
+import subprocess
+import psutil
+from printing import print_verbose
+from artifact_store import load_versioned_json, save_versioned_json
+
+# Peak RSS of past benchmark runs, relative to the LaZagna root directory
+MEMORY_HISTORY_FILE = "/results/memory_history.json"
+
+# Version of the memory history layout, histories of another version are ignored. Histories before version 2 may hold
+# peaks raised for OOM kills of other runs
+MEMORY_HISTORY_VERSION = 2
+
+# Seconds between two measures of the RSS of a running task
+RSS_POLL_INTERVAL_S = 1.0
+
+# Share of the memory of the machine given to the runs when no budget is given
+DEFAULT_MEMORY_BUDGET_FRACTION = 0.9
+
+# Estimate of a benchmark never run before on any device, in bytes
+DEFAULT_MEMORY_ESTIMATE = 2 * 1024 ** 3
+
+# A run killed for lack of memory needed more than its peak when it was killed, its estimate is raised by this factor
+OOM_GROWTH_FACTOR = 1.5
+
+# Output of a run that failed to allocate memory
+OUT_OF_MEMORY_PATTERN = re.compile(r"std::bad_alloc|MemoryError|Cannot allocate memory")
+
+# Log of a process killed with SIGKILL, as the shell or the Python script running it reports it
+KILLED_PATTERN = re.compile(r"\bKilled\b|SIGKILL|(?:returncode|return code|exit code|exit status)\D{0,3}(?:-9|137)\b")
+
+# Bytes read from the end of each log of a task, where a process that died leaves its last output
+TASK_LOG_TAIL_BYTES = 64 * 1024
+
+# Runs going and runs started so far by run_measuring_memory. The worker processes of a sweep share the counters of the
+# process that created them (see share_run_counters), so a run can tell whether it was the only one going
+run_counters = multiprocessing.Array("q", 2)
+
+def share_run_counters(counters):
+    """Initializer of the worker processes of a sweep, makes them count their runs in counters"""
+    global run_counters
+    run_counters = counters
+
+def memory_key(benchmark_name, width, height, channel_width):
+    return f"{benchmark_name}|{width}x{height}|{channel_width}"
+
+class MemoryHistory:
+    """
+    Peak RSS of the runs of each (benchmark, device size, channel width), kept across sweeps in a JSON file so the
+    scheduler can tell how much memory a run will take before starting it.
+    """
+
+    def __init__(self, path, default_estimate=DEFAULT_MEMORY_ESTIMATE):
+        self.path = path
+        self.default_estimate = default_estimate
+        self.peaks = {}
+
+        history = load_versioned_json(path, MEMORY_HISTORY_VERSION, "memory history")
+        if history is not None:
+            self.peaks = history["peak_rss_bytes"]
+
+    def estimate(self, benchmark_name, width, height, channel_width):
+        """
+        Projected peak RSS of a run. Runs never seen on this device size and channel width are scaled from the runs of
+        the same benchmark on other ones by the size of their RRG (width * height * channel width), taking the largest.
+        """
+        key = memory_key(benchmark_name, width, height, channel_width)
+        if key in self.peaks:
+            return self.peaks[key]
+
+        scaled = []
+        for other_key, peak in self.peaks.items():
+            other_name, other_size, other_channel_width = other_key.split("|")
+            if other_name != benchmark_name:
+                continue
+            other_width, other_height = (int(x) for x in other_size.split("x"))
+            scaled.append(peak * (width * height * channel_width) / (other_width * other_height * int(other_channel_width)))
+
+        if len(scaled) > 0:
+            return max(scaled)
+        return self.default_estimate
+
+    def record(self, benchmark_name, width, height, channel_width, peak_rss_bytes):
+        """Keep the largest peak seen for a run"""
+        key = memory_key(benchmark_name, width, height, channel_width)
+        self.peaks[key] = max(self.peaks.get(key, 0), int(peak_rss_bytes))
+
+    def save(self):
+        save_versioned_json(self.path, MEMORY_HISTORY_VERSION, {"peak_rss_bytes": self.peaks})
+
+def default_memory_budget():
+    return int(psutil.virtual_memory().total * DEFAULT_MEMORY_BUDGET_FRACTION)
+
+def process_tree_rss(process):
+    """Sum of the RSS of a process and all of its descendants, in bytes"""
+    total = 0
+    try:
+        processes = [process] + process.children(recursive=True)
+    except psutil.NoSuchProcess:
+        return 0
+
+    for child in processes:
+        try:
+            total += child.memory_info().rss
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+def oom_kill_count():
+    """
+    Number of processes of the cgroup of this process killed by the OOM killer so far, from the memory.events (cgroup
+    v2) or memory.oom_control (cgroup v1) of the cgroup. None if neither can be read.
+    """
+    try:
+        with open("/proc/self/cgroup", "r") as infile:
+            cgroups = [line.strip().split(":", 2) for line in infile]
+    except OSError:
+        return None
+
+    # Inside a container the cgroup is mounted at the root of the hierarchy rather than at its path, and hybrid hosts
+    # mount cgroup v2 under unified/
+    candidates = []
+    for hierarchy, controllers, path in cgroups:
+        if hierarchy == "0" and controllers == "":
+            for mount in ("/sys/fs/cgroup", "/sys/fs/cgroup/unified"):
+                candidates += [mount + path.rstrip("/") + "/memory.events", mount + "/memory.events"]
+        elif "memory" in controllers.split(","):
+            candidates += ["/sys/fs/cgroup/memory" + path.rstrip("/") + "/memory.oom_control", "/sys/fs/cgroup/memory/memory.oom_control"]
+
+    for events_path in candidates:
+        try:
+            with open(events_path, "r") as infile:
+                for line in infile:
+                    name, value = line.split()
+                    if name == "oom_kill":
+                        return int(value)
+        except (OSError, ValueError):
+            continue
+
+    return None
+
+def task_logs_out_of_memory(run_dir):
+    '''
+    Whether the logs of an OpenFPGA task run (run001/**/*.log) show one of its jobs ran out of memory: a failed
+    allocation (OUT_OF_MEMORY_PATTERN) or a process killed with SIGKILL (KILLED_PATTERN). The OOM killer kills the
+    tool a job runs (VPR), not run_fpga_task.py, and the tool's output goes to these logs, so run_measuring_memory can't
+    see it.
+    '''
+    for log_path in sorted(glob.glob(os.path.join(glob.escape(run_dir), "**", "*.log"), recursive=True)):
+        try:
+            with open(log_path, "rb") as infile:
+                infile.seek(max(0, os.path.getsize(log_path) - TASK_LOG_TAIL_BYTES))
+                tail = infile.read().decode(errors="replace")
+        except OSError:
+            continue
+
+        if OUT_OF_MEMORY_PATTERN.search(tail) or KILLED_PATTERN.search(tail):
+            print_verbose(f"{log_path} shows a process of {run_dir} ran out of memory")
+            return True
+
+    return False
+
+def run_measuring_memory(command, cwd):
+    """
+    Run command in cwd, measuring the RSS of its process tree every RSS_POLL_INTERVAL_S.
+
+    The OOM killer counts its kills per cgroup, not per process tree, so a kill while other runs were going may have
+    been any of theirs. A run only looks killed for lack of memory from its own process tree: the command was killed
+    with SIGKILL or its output says an allocation failed. A kill counted in the cgroup only counts when the run was
+    the only one going from its start to its end. Commands that run their tools with their output in logs are checked
+    by their caller too (see task_logs_out_of_memory).
+
+    Returns:
+        tuple: (return code, stdout, stderr, peak RSS in bytes, whether it looks killed for lack of memory)
+    """
+    with run_counters.get_lock():
+        run_counters[0] += 1
+        run_counters[1] += 1
+        alone = run_counters[0] == 1
+        runs_started = run_counters[1]
+
+    oom_kills_before = oom_kill_count()
+
+    try:
+        process = subprocess.Popen(command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        ps_process = psutil.Process(process.pid)
+        peak_rss = 0
+
+        while True:
+            peak_rss = max(peak_rss, process_tree_rss(ps_process))
+            try:
+                stdout, stderr = process.communicate(timeout=RSS_POLL_INTERVAL_S)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+
+        oom_kills_after = oom_kill_count()
+    finally:
+        with run_counters.get_lock():
+            run_counters[0] -= 1
+            alone = alone and run_counters[1] == runs_started
+
+    out_of_memory = process.returncode == -signal.SIGKILL or process.returncode == 128 + signal.SIGKILL
+    if OUT_OF_MEMORY_PATTERN.search(stdout or "") or OUT_OF_MEMORY_PATTERN.search(stderr or ""):
+        out_of_memory = True
+
+    if oom_kills_before is not None and oom_kills_after is not None and oom_kills_after > oom_kills_before:
+        if alone:
+            print_verbose(f"The OOM killer killed {oom_kills_after - oom_kills_before} processes while running {' '.join(command)} alone")
+            out_of_memory = True
+        else:
+            print_verbose(f"The OOM killer killed {oom_kills_after - oom_kills_before} processes while running {' '.join(command)} along with other runs, not counting it against this run")
+
+    return process.returncode, stdout, stderr, peak_rss, out_of_memory
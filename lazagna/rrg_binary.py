@@ -0,0 +1,441 @@
+from lxml import etree
+import glob
+import os
+import sys
+import time
+from printing import print_verbose
+from artifact_store import ARTIFACT_KEY_LENGTH, artifact_key, atomic_write, build_artifact, file_digest
+from rrg_compression import open_rrg, rrg_compression, uncompressed_rrg_path
+
+try:
+    import capnp
+except ImportError:
+    capnp = None
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+LAZAGNA_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+
+# Where VPR keeps the Cap'n Proto schema of its binary RR graph (generated from rr_graph.xsd), depending on the VTR version
+RRG_SCHEMA_CANDIDATES = [
+    "/OpenFPGA/vtr-verilog-to-routing/libs/librrgraph/src/io/gen/rr_graph_uxsdcxx.capnp",
+    "/OpenFPGA/vtr-verilog-to-routing/vpr/src/route/gen/rr_graph_uxsdcxx.capnp",
+    "/OpenFPGA/vtr-verilog-to-routing/libs/libvtrcapnproto/gen/rr_graph_uxsdcxx.capnp",
+]
+
+RRG_BINARY_EXTENSION = ".bin"
+
+# Size of the chunks the base RRG is read in when counting its nodes and edges
+COUNT_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Approximate size of a new node and of a new edge in a binary RR graph, used to project the memory a write takes
+RRG_BINARY_NODE_BYTES = 104
+RRG_BINARY_EDGE_BYTES = 24
+
+# Words a binary base RRG is allowed to hold when it's read back, Cap'n Proto's default stops at 64 MB
+RRG_TRAVERSAL_LIMIT_WORDS = 2 ** 62
+
+# Loaded schemas keyed by path, and field lookup tables of the schema structs keyed by the struct schema id
+loaded_schemas = {}
+struct_field_cache = {}
+
+def is_binary_rrg_path(file_path):
+    """VPR reads and writes the binary (Cap'n Proto) RR graph format for files ending in .bin (.bin.gz, .bin.zst compressed)"""
+    return os.path.splitext(uncompressed_rrg_path(file_path))[1] == RRG_BINARY_EXTENSION
+
+def find_rrg_schema():
+    """Return the path of the RR graph Cap'n Proto schema of the VTR build in the LaZagna directory, or "" if not found"""
+    for candidate in RRG_SCHEMA_CANDIDATES:
+        if os.path.exists(LAZAGNA_ROOT + candidate):
+            return LAZAGNA_ROOT + candidate
+    return ""
+
+def load_rrg_schema(schema_path=""):
+    '''
+    Load the RR graph Cap'n Proto schema. It has to be the schema of the VPR that reads the graph, so by default the
+    one in the VTR tree of the LaZagna directory is used.
+    '''
+    if capnp is None:
+        print("ERROR: Writing binary RR graphs requires pycapnp (pip install pycapnp).")
+        exit(1)
+
+    if schema_path == "":
+        schema_path = find_rrg_schema()
+        if schema_path == "":
+            print(f"ERROR: Could not find the RR graph Cap'n Proto schema (rr_graph_uxsdcxx.capnp) under {LAZAGNA_ROOT}/OpenFPGA, pass its path with --rrg_schema.")
+            exit(1)
+
+    if schema_path not in loaded_schemas:
+        # The schema imports /capnp/c++.capnp, which pycapnp ships in its package directory
+        imports = [os.path.dirname(os.path.dirname(capnp.__file__)), os.path.dirname(schema_path)] + sys.path
+        print_verbose(f"Loading RR graph schema {schema_path}")
+        loaded_schemas[schema_path] = capnp.load(schema_path, imports=imports)
+
+    return loaded_schemas[schema_path]
+
+def normalize_name(name):
+    """XML names are snake_case and schema fields camelCase, compare them without case and underscores"""
+    return name.replace("_", "").lower()
+
+def enum_name(value):
+    """Name of the schema enumerant for an XML enumeration value, e.g. INC_DIR -> incDir"""
+    parts = value.lower().split("_")
+    return parts[0] + "".join(part.capitalize() for part in parts[1:])
+
+def type_name(field):
+    which = field.proto.slot.type.which
+    if callable(which):
+        which = which()
+    return str(which)
+
+def struct_fields(builder):
+    '''
+    Return the (normalized name -> (field name, type name)) table of the struct being built, used to map XML attributes
+    and child elements to schema fields
+    '''
+    schema = builder.schema
+    key = schema.node.id
+    if key not in struct_field_cache:
+        struct_field_cache[key] = {normalize_name(name): (name, type_name(field)) for name, field in schema.fields.items()}
+    return struct_field_cache[key]
+
+def convert_value(value, field_type):
+    if field_type in ("int8", "int16", "int32", "int64", "uint8", "uint16", "uint32", "uint64"):
+        return int(value)
+    if field_type in ("float32", "float64"):
+        return float(value)
+    if field_type == "bool":
+        return value.lower() in ("true", "1")
+    if field_type == "enum":
+        return enum_name(value)
+    return value
+
+def child_field(fields, tag):
+    """Find the schema field of a child element, a single struct named after it or a list named after its plural"""
+    name = normalize_name(tag)
+    for candidate in (name, name + "s", name + "es", name[:-1] + "ies"):
+        if candidate in fields:
+            return fields[candidate]
+    return None
+
+def fill_struct(builder, elem):
+    '''
+    Copy an XML element into a schema struct: attributes become fields, text content the `value` field, and child
+    elements nested structs (or lists of structs for repeated children)
+    '''
+    fields = struct_fields(builder)
+
+    for attr, value in elem.attrib.items():
+        field = fields.get(normalize_name(attr))
+        if field is None:
+            print(f"ERROR: Attribute {attr} of <{elem.tag}> is not in the RR graph schema.")
+            exit(1)
+        setattr(builder, field[0], convert_value(value, field[1]))
+
+    if elem.text is not None and elem.text.strip() != "" and "value" in fields:
+        setattr(builder, fields["value"][0], convert_value(elem.text.strip(), fields["value"][1]))
+
+    children = {}
+    for child in elem:
+        if isinstance(child.tag, str):
+            children.setdefault(child.tag, []).append(child)
+
+    for tag, elems in children.items():
+        field = child_field(fields, tag)
+        if field is None:
+            print(f"ERROR: Element <{tag}> in <{elem.tag}> is not in the RR graph schema.")
+            exit(1)
+
+        if field[1] == "list":
+            list_builder = builder.init(field[0], len(elems))
+            for i, child in enumerate(elems):
+                fill_struct(list_builder[i], child)
+        else:
+            fill_struct(builder.init(field[0]), elems[0])
+
+def count_in_file(file_path, needle, start, end):
+    """Count the occurrences of needle in the byte range [start, end) of the file (of the uncompressed RRG if compressed)"""
+    count = 0
+    tail = b""
+    with open_rrg(file_path, "rb") as infile:
+        infile.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = infile.read(min(COUNT_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            data = tail + chunk
+            count += data.count(needle)
+            # Keep enough of the end to find a needle split between two chunks, too short to hold a whole one
+            tail = data[-(len(needle) - 1):]
+    return count
+
+def init_list(rr_graph, graph_fields, section_tag, item_tag, size):
+    """Initialize the list of a section of the RR graph (e.g. the nodes of rr_nodes) with the given size"""
+    section = rr_graph.init(child_field(graph_fields, section_tag)[0])
+    return section.init(child_field(struct_fields(section), item_tag)[0], size)
+
+def binary_rrg_cache_path(input_file_path, schema_path):
+    """
+    Path of the binary copy of a base RRG, next to it and named after the content of the RRG and of the schema it was
+    converted with, so a changed base RRG or VPR build never reads a stale copy
+    """
+    key = artifact_key("rrg_binary", rrg=file_digest(input_file_path), schema=file_digest(schema_path))
+    return uncompressed_rrg_path(input_file_path) + "." + key + RRG_BINARY_EXTENSION
+
+def remove_stale_binary_rrgs(input_file_path, cache_path):
+    """Remove the binary copies of older versions of a base RRG, only safe while holding the lock of cache_path"""
+    pattern = glob.escape(uncompressed_rrg_path(input_file_path)) + ".*" + RRG_BINARY_EXTENSION
+    for stale_path in glob.glob(pattern):
+        if stale_path != cache_path and len(os.path.basename(stale_path).split(".")[-2]) == ARTIFACT_KEY_LENGTH:
+            print_verbose(f"Removing {stale_path}, the binary copy of an older {input_file_path}")
+            os.unlink(stale_path)
+
+def convert_rrg_to_binary(input_file_path, output_file_path, insertion_offsets, schema):
+    '''
+    Convert an XML RRG to a binary (Cap'n Proto) one. The RRG is streamed, only one node or edge element is parsed at a
+    time, but every element is filled in by the interpreter, so this is slow on large RRGs and done once per base RRG
+    (see write_rrg_binary).
+    '''
+    start_time = time.time()
+
+    # Lists have a fixed size in Cap'n Proto, count the nodes and edges first
+    nodes_insert_offset, edges_insert_offset = insertion_offsets
+    num_nodes_total = count_in_file(input_file_path, b"<node ", 0, nodes_insert_offset)
+    num_edges_total = count_in_file(input_file_path, b"<edge ", nodes_insert_offset, edges_insert_offset)
+    print_verbose(f"Converting {input_file_path} ({num_nodes_total} nodes and {num_edges_total} edges) to a binary RR graph")
+
+    rr_graph = schema.RrGraph.new_message()
+    graph_fields = struct_fields(rr_graph)
+
+    depth = 0
+    node_list = None
+    edge_list = None
+    num_nodes = 0
+    num_edges = 0
+    with open_rrg(input_file_path, "rb") as infile:
+        parser = etree.iterparse(infile, events=("start", "end"), huge_tree=True, remove_blank_text=True, remove_comments=True)
+        for event, elem in parser:
+            if event == "start":
+                depth += 1
+                if depth == 1:
+                    for attr, value in elem.attrib.items():
+                        field = graph_fields.get(normalize_name(attr))
+                        if field is not None:
+                            setattr(rr_graph, field[0], convert_value(value, field[1]))
+                elif depth == 2 and elem.tag == "rr_nodes":
+                    node_list = init_list(rr_graph, graph_fields, "rr_nodes", "node", num_nodes_total)
+                elif depth == 2 and elem.tag == "rr_edges":
+                    edge_list = init_list(rr_graph, graph_fields, "rr_edges", "edge", num_edges_total)
+                continue
+
+            depth -= 1
+            if depth == 2 and elem.tag == "node":
+                fill_struct(node_list[num_nodes], elem)
+                num_nodes += 1
+            elif depth == 2 and elem.tag == "edge":
+                fill_struct(edge_list[num_edges], elem)
+                num_edges += 1
+            elif depth == 1 and elem.tag not in ("rr_nodes", "rr_edges"):
+                field = child_field(graph_fields, elem.tag)
+                if field is None:
+                    print(f"ERROR: Element <{elem.tag}> is not in the RR graph schema.")
+                    exit(1)
+                fill_struct(rr_graph.init(field[0]), elem)
+
+            if depth == 1 or (depth == 2 and elem.tag in ("node", "edge")):
+                # Free the parsed elements once they are in the message
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+    if num_nodes != num_nodes_total or num_edges != num_edges_total:
+        print(f"ERROR: Converted {num_nodes} nodes and {num_edges} edges of {input_file_path} but expected {num_nodes_total} nodes and {num_edges_total} edges")
+        exit(1)
+
+    with open(output_file_path, "wb") as outfile:
+        rr_graph.write(outfile)
+
+    end_time = time.time()
+    print_verbose(f"Converting {input_file_path} to a binary RR graph took {((end_time - start_time) * 1000):0.2f} ms")
+
+def copy_fields(builder, reader, skip=()):
+    """Copy every field of a struct that is set in reader, but the ones in skip, nested structs and lists are copied whole"""
+    for name, field in builder.schema.fields.items():
+        if name in skip:
+            continue
+        field_type = type_name(field)
+        if field_type in ("struct", "list", "text", "data", "anyPointer"):
+            if reader._has(name):
+                setattr(builder, name, getattr(reader, name))
+        elif field_type == "enum":
+            setattr(builder, name, str(getattr(reader, name)))
+        else:
+            setattr(builder, name, getattr(reader, name))
+
+def copy_list(builder, reader, list_field, size):
+    '''
+    Copy a section of the RR graph (e.g. rr_nodes) with its list field grown to size, returns the new list. Cap'n Proto
+    lists can't grow, so the items are copied one by one, about 1 us per node and 0.6 us per edge.
+    '''
+    copy_fields(builder, reader, skip=(list_field,))
+    new_list = builder.init(list_field, size)
+    for i, item in enumerate(getattr(reader, list_field)):
+        new_list[i] = item
+    return new_list
+
+def attribute_fields(builder, attributes):
+    """Schema fields (field name, type name) of the given XML attributes of a struct, in order"""
+    fields = struct_fields(builder)
+    attribute_fields = []
+    for attr in attributes:
+        field = fields.get(normalize_name(attr))
+        if field is None:
+            print(f"ERROR: Attribute {attr} is not in the RR graph schema.")
+            exit(1)
+        attribute_fields.append(field)
+    return attribute_fields
+
+def set_fields(builder, fields, values):
+    """Set the fields of attribute_fields to values, given as they would be written in the XML"""
+    for (field_name, field_type), value in zip(fields, values):
+        setattr(builder, field_name, convert_value(str(value), field_type))
+
+def new_struct_like(schema, builder):
+    """New message of the loaded schema holding a struct of the same type as builder"""
+    struct_type = schema
+    for name in builder.schema.node.displayName.split(":", 1)[1].split("."):
+        struct_type = getattr(struct_type, name)
+    return struct_type.new_message()
+
+def fill_new_nodes(schema, node_list, start, nodes, segment_id):
+    '''
+    Fill node_list from index start with an array of new nodes (rows of id, layer, x, y, ptc). Every new node is a NONE
+    CHANX node of the 3D SB segment, the node format_nodes writes as XML.
+    '''
+    if len(nodes) == 0:
+        return
+
+    # The fields every new node shares are set once in a template that is copied, the nodes are filled one after the
+    # other so the message is laid out the same however the nodes are split in chunks
+    template = new_struct_like(schema, node_list[start])
+    template_fields = struct_fields(template)
+    set_fields(template, attribute_fields(template, ("capacity", "direction", "type")), (1, "NONE", "CHANX"))
+    timing = template.init(child_field(template_fields, "timing")[0])
+    set_fields(timing, attribute_fields(timing, ("C", "R")), (0, 0))
+    segment = template.init(child_field(template_fields, "segment")[0])
+    set_fields(segment, attribute_fields(segment, ("segment_id",)), (segment_id,))
+
+    # The other fields are set straight from the array, with their names looked up once, as this runs for every node
+    id_field = attribute_fields(template, ("id",))[0][0]
+    loc_field = child_field(template_fields, "loc")[0]
+    loc_fields = attribute_fields(new_struct_like(schema, template).init(loc_field), ("layer", "ptc", "xhigh", "xlow", "yhigh", "ylow"))
+    layer_field, ptc_field, xhigh_field, xlow_field, yhigh_field, ylow_field = (field_name for field_name, _ in loc_fields)
+    # ptc is text in the schemas where a node can have several ptcs
+    ptc_type = str if loc_fields[1][1] == "text" else int
+
+    for i, (node_id, layer, x, y, ptc) in enumerate(nodes.tolist(), start):
+        node_list[i] = template
+        node = node_list[i]
+        setattr(node, id_field, node_id)
+        loc = node.init(loc_field)
+        setattr(loc, layer_field, layer)
+        setattr(loc, ptc_field, ptc_type(ptc))
+        setattr(loc, xhigh_field, x)
+        setattr(loc, xlow_field, x)
+        setattr(loc, yhigh_field, y)
+        setattr(loc, ylow_field, y)
+
+def fill_new_edges(edge_list, start, edges):
+    """Fill edge_list from index start with an array of new edges (rows of src node, sink node, switch id)"""
+    if len(edges) == 0:
+        return
+
+    # Set straight from the array, with the field names looked up once, as this runs for every edge
+    src_field, sink_field, switch_field = (field_name for field_name, _ in attribute_fields(edge_list[start], ("src_node", "sink_node", "switch_id")))
+    for i, (src_node, sink_node, switch_id) in enumerate(edges.tolist(), start):
+        edge = edge_list[i]
+        setattr(edge, src_field, src_node)
+        setattr(edge, sink_field, sink_node)
+        setattr(edge, switch_field, switch_id)
+
+def write_rrg_binary(input_file_path, output_file_path, node_chunks, edge_chunks, num_new_nodes, num_new_edges, insertion_offsets, segment_id, schema_path="", memory_budget=None):
+    '''
+    Write the base RRG plus the new nodes and edges as a binary (Cap'n Proto) RR graph that VPR reads with
+    --read_rr_graph <file>.bin. The new nodes and edges are given as chunks of arrays (see fill_new_nodes and
+    fill_new_edges).
+
+    The base RRG is converted to a binary RRG once (see binary_rrg_cache_path), every 3D RRG then copies its lists
+    instead of parsing the XML again. That copy goes through every base node and edge (see copy_list), so on large RRGs
+    this is several times slower than write_rrg_streaming. A Cap'n Proto message is built whole in memory before it is written, so this
+    takes about twice the size of the binary base RRG plus the size of the new nodes and edges, whatever the
+    memory_budget the generated nodes and edges are kept under. A warning is printed if that is over memory_budget.
+
+    The output is written to a temporary file renamed into place, so a killed write never leaves a partial graph.
+    Either file can be compressed (see open_rrg).
+    '''
+    start_time = time.time()
+    print_verbose(f"Starting binary write to {output_file_path}")
+
+    schema = load_rrg_schema(schema_path)
+    if schema_path == "":
+        schema_path = find_rrg_schema()
+
+    cache_path = binary_rrg_cache_path(input_file_path, schema_path)
+    def convert_base_rrg(temp_path):
+        remove_stale_binary_rrgs(input_file_path, cache_path)
+        convert_rrg_to_binary(input_file_path, temp_path, insertion_offsets, schema)
+
+    build_artifact(cache_path, convert_base_rrg)
+
+    projected_bytes = 2 * os.path.getsize(cache_path) + num_new_nodes * RRG_BINARY_NODE_BYTES + num_new_edges * RRG_BINARY_EDGE_BYTES
+    if memory_budget is not None and projected_bytes > memory_budget:
+        print(f"WARNING: Writing {output_file_path} as a binary RR graph takes about {projected_bytes / 1024 ** 3:0.2f} GB of memory, over the memory budget of {memory_budget / 1024 ** 3:0.2f} GB")
+
+    with open(cache_path, "rb") as infile:
+        base_graph = schema.RrGraph.read(infile, traversal_limit_in_words=RRG_TRAVERSAL_LIMIT_WORDS)
+
+    rr_graph = schema.RrGraph.new_message()
+    graph_fields = struct_fields(rr_graph)
+    nodes_section = child_field(graph_fields, "rr_nodes")[0]
+    edges_section = child_field(graph_fields, "rr_edges")[0]
+    copy_fields(rr_graph, base_graph, skip=(nodes_section, edges_section))
+
+    nodes_list_field = child_field(struct_fields(rr_graph.init(nodes_section)), "node")[0]
+    base_nodes = getattr(getattr(base_graph, nodes_section), nodes_list_field)
+    num_base_nodes = len(base_nodes)
+    node_list = copy_list(getattr(rr_graph, nodes_section), getattr(base_graph, nodes_section), nodes_list_field, num_base_nodes + num_new_nodes)
+
+    edges_list_field = child_field(struct_fields(rr_graph.init(edges_section)), "edge")[0]
+    base_edges = getattr(getattr(base_graph, edges_section), edges_list_field)
+    num_base_edges = len(base_edges)
+    edge_list = copy_list(getattr(rr_graph, edges_section), getattr(base_graph, edges_section), edges_list_field, num_base_edges + num_new_edges)
+
+    # The copy doesn't refer to the base graph, free it before the new nodes and edges are added
+    del base_nodes, base_edges, base_graph
+
+    num_nodes = num_base_nodes
+    for nodes in node_chunks:
+        fill_new_nodes(schema, node_list, num_nodes, nodes, segment_id)
+        num_nodes += len(nodes)
+
+    num_edges = num_base_edges
+    for edges in edge_chunks:
+        fill_new_edges(edge_list, num_edges, edges)
+        num_edges += len(edges)
+
+    if num_nodes != num_base_nodes + num_new_nodes or num_edges != num_base_edges + num_new_edges:
+        print(f"ERROR: Wrote {num_nodes} nodes and {num_edges} edges to {output_file_path} but expected {num_base_nodes + num_new_nodes} nodes and {num_base_edges + num_new_edges} edges")
+        exit(1)
+
+    with atomic_write(output_file_path) as temp_path:
+        if rrg_compression(output_file_path) is None:
+            with open(temp_path, "wb") as outfile:
+                rr_graph.write(outfile)
+        else:
+            # pycapnp writes straight to the file descriptor, which would skip the compressor
+            with open_rrg(temp_path, "wb") as outfile:
+                outfile.write(rr_graph.to_bytes())
+
+    end_time = time.time()
+    print_verbose(f"Binary write completed in {((end_time - start_time) * 1000):0.2f} ms")
@@ -0,0 +1,148 @@
+import gzip
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from printing import print_verbose
+from artifact_store import atomic_write
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed RRGs keep their normal name with the extension of the compression added (rrg.xml.gz, rrg.xml.zst)
+RRG_COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+# RRGs are very repetitive XML, low levels already compress them ~15x at several times the speed of the default levels
+GZIP_COMPRESSION_LEVEL = 3
+ZSTD_COMPRESSION_LEVEL = 3
+
+# Size of the blocks RRGs are copied in when compressing or decompressing a whole file
+COMPRESSION_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Finished RRGs given to compress_rrg_in_background, compressed one at a time by a single thread. zlib and zstd release
+# the GIL while compressing, so the compression runs alongside whatever the caller does next
+background_executor = None
+background_futures = []
+
+# Content hashes of the RRGs hashed so far, keyed by (path, size, mtime)
+rrg_content_digests = {}
+
+def rrg_compression(file_path):
+    """Compression of an RRG file from its extension: "gzip", "zstd", or None for uncompressed files"""
+    extension = os.path.splitext(file_path)[1]
+    for compression, compression_extension in RRG_COMPRESSION_EXTENSIONS.items():
+        if extension == compression_extension:
+            return compression
+    return None
+
+def uncompressed_rrg_path(file_path):
+    """Path of an RRG without its compression extension, e.g. rrg.xml for rrg.xml.gz"""
+    if rrg_compression(file_path) is not None:
+        return os.path.splitext(file_path)[0]
+    return file_path
+
+def rrg_content_digest(file_path):
+    """
+    Hash of the uncompressed content of an RRG, the same for an RRG and its compressed copies. Cached until the file
+    changes, so the sidecars of an RRG only hash it once.
+    """
+    stat = os.stat(file_path)
+    cache_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    if cache_key not in rrg_content_digests:
+        hasher = hashlib.blake2b(digest_size=20)
+        with open_rrg(file_path, "rb") as infile:
+            for block in iter(lambda: infile.read(COMPRESSION_BLOCK_SIZE), b""):
+                hasher.update(block)
+        rrg_content_digests[cache_key] = hasher.hexdigest()
+
+    return rrg_content_digests[cache_key]
+
+def check_compression(compression):
+    """Exit with an error if compression is not one of RRG_COMPRESSION_EXTENSIONS or can't be used here"""
+    if compression not in RRG_COMPRESSION_EXTENSIONS:
+        print(f"ERROR: Unknown RRG compression {compression}, must be one of {', '.join(RRG_COMPRESSION_EXTENSIONS)}.")
+        exit(1)
+
+    if compression == "zstd" and zstandard is None:
+        print("ERROR: Reading or writing .zst RR graphs requires zstandard (pip install zstandard).")
+        exit(1)
+
+def open_rrg(file_path, mode="rb"):
+    '''
+    Open an RRG file in binary mode, compressed or not depending on its extension (see rrg_compression). Compressed
+    files are (de)compressed on the fly as they are read or written, so they can be streamed like plain files. Reading
+    them only seeks forward cheaply.
+    '''
+    compression = rrg_compression(file_path)
+    if compression is None:
+        return open(file_path, mode)
+
+    check_compression(compression)
+
+    if compression == "gzip":
+        return gzip.open(file_path, mode, compresslevel=GZIP_COMPRESSION_LEVEL)
+
+    if "r" in mode:
+        return zstandard.open(file_path, mode)
+    return zstandard.open(file_path, mode, cctx=zstandard.ZstdCompressor(level=ZSTD_COMPRESSION_LEVEL))
+
+def find_rrg_file(file_path):
+    """
+    Return the path the RRG file_path exists under, either file_path itself or its compressed version
+    (file_path.gz or file_path.zst), or None if there is none of them
+    """
+    for candidate in [file_path] + [file_path + extension for extension in RRG_COMPRESSION_EXTENSIONS.values()]:
+        if os.path.exists(candidate):
+            return candidate
+    return None
+
+def copy_rrg_file(input_file_path, output_file_path):
+    '''
+    Copy an RRG, (de)compressing it as given by the extensions of both paths. The copy is written atomically (see
+    atomic_write), so output_file_path only ever holds a complete RRG.
+    '''
+    with atomic_write(output_file_path) as temp_path:
+        with open_rrg(input_file_path, "rb") as infile, open_rrg(temp_path, "wb") as outfile:
+            shutil.copyfileobj(infile, outfile, COMPRESSION_BLOCK_SIZE)
+
+def compress_rrg_file(file_path, compression):
+    """Compress an RRG into file_path.gz or file_path.zst and remove the uncompressed file, returns the new path"""
+    check_compression(compression)
+
+    output_path = file_path + RRG_COMPRESSION_EXTENSIONS[compression]
+    print_verbose(f"Compressing {file_path} into {output_path}")
+
+    copy_rrg_file(file_path, output_path)
+    os.remove(file_path)
+
+    return output_path
+
+def decompress_rrg_file(file_path, output_dir):
+    """Write an uncompressed copy of a compressed RRG into output_dir, for tools that only read plain RRGs (VPR)"""
+    os.makedirs(output_dir, exist_ok=True)
+
+    output_path = os.path.join(output_dir, os.path.basename(uncompressed_rrg_path(file_path)))
+    print_verbose(f"Decompressing {file_path} into {output_path}")
+
+    copy_rrg_file(file_path, output_path)
+
+    return output_path
+
+def compress_rrg_in_background(file_path, compression):
+    """Start compressing a finished RRG with compress_rrg_file, wait_for_background_compression waits for it"""
+    global background_executor
+
+    check_compression(compression)
+
+    if background_executor is None:
+        background_executor = ThreadPoolExecutor(max_workers=1)
+
+    background_futures.append(background_executor.submit(compress_rrg_file, file_path, compression))
+
+def wait_for_background_compression():
+    """Wait for every RRG given to compress_rrg_in_background, returns their compressed paths"""
+    futures = list(background_futures)
+    background_futures.clear()
+    return [future.result() for future in futures]
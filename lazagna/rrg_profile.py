@@ -0,0 +1,220 @@
+import cProfile
+import io
+import json
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+import numpy as np
+import psutil
+from printing import print_verbose
+from artifact_store import atomic_write
+
+# The profile of a 3D RRG is written next to it as <output_path>.profile.json
+PROFILE_SUFFIX = ".profile.json"
+
+# Version of the profile layout, bump it whenever the keys of the report change
+PROFILE_FORMAT_VERSION = 1
+
+# Number of functions (cProfile) and allocation sites (tracemalloc) kept in a report
+PROFILE_TOP_ENTRIES = 30
+
+# Number of bins of the per-location histograms
+HISTOGRAM_BINS = 20
+
+def profile_path(output_path):
+    return output_path + PROFILE_SUFFIX
+
+def peak_rss_bytes():
+    """Peak resident memory of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def children_rss_bytes():
+    """Resident memory of the worker processes of this process right now, 0 if there are none"""
+    total = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+def children_peak_rss_bytes():
+    '''
+    Peak resident memory of the worker processes of this process so far: the sum of the peaks of the live ones (read
+    from /proc, so only on Linux) or the largest peak of the finished ones, whichever is larger. Pages forked workers
+    still share with this process count in both.
+    '''
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    finished_peak = peak if sys.platform == "darwin" else peak * 1024
+
+    live_peak = 0
+    for child in psutil.Process().children(recursive=True):
+        try:
+            with open(f"/proc/{child.pid}/status", "r") as infile:
+                for line in infile:
+                    if line.startswith("VmHWM:"):
+                        live_peak += int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+
+    return max(finished_peak, live_peak)
+
+def histogram(values, bins=HISTOGRAM_BINS):
+    """Summary and histogram of an array of values, in a form that can be written as JSON"""
+    values = np.asarray(values)
+    if len(values) == 0:
+        return {"count": 0}
+
+    counts, edges = np.histogram(values, bins=max(1, min(bins, int(values.max() - values.min()) + 1)))
+    return {
+        "count": int(len(values)),
+        "min": values.min().item(),
+        "max": values.max().item(),
+        "mean": float(values.mean()),
+        "bin_edges": edges.tolist(),
+        "counts": counts.tolist(),
+    }
+
+class PhaseProfiler:
+    """
+    Records the phases of a 3D RRG generation for a machine readable profile: the wall time, CPU time (of this process
+    and of its finished children), peak resident memory and, for phases that make nodes or edges, their rates.
+
+    Phases are recorded with the phase context manager. Each phase has a scope, None for phases shared by every 3D RRG
+    of a run (reading the base RRG) or the output path of the 3D RRG it belongs to, so the report of a 3D RRG holds the
+    shared phases and its own.
+
+    cProfile and tracemalloc are opt-in as they slow the run down. When enabled they run from start() on, and every
+    report includes the top functions and allocation sites since then.
+    """
+
+    def __init__(self, cprofile=False, trace_memory=False):
+        self.phases = []
+        self.histograms = {}
+        self.scope = None
+
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.trace_memory = trace_memory
+
+    def reset(self):
+        """Drop the phases and histograms recorded so far"""
+        self.phases = []
+        self.histograms = {}
+
+    def start(self):
+        """Start the cProfile and tracemalloc captures, if they are enabled"""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name, **counts):
+        '''
+        Record a phase of the run. Yields the record of the phase, the caller can set "nodes" and "edges" (or any other
+        count) in it while the phase runs
+        '''
+        record = {"name": name, "scope": self.scope, **counts}
+
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        start_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+        try:
+            yield record
+        finally:
+            end_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+            record["wall_s"] = time.perf_counter() - start_wall
+            record["cpu_s"] = time.process_time() - start_cpu
+            record["children_cpu_s"] = (end_children.ru_utime + end_children.ru_stime) - (start_children.ru_utime + start_children.ru_stime)
+            record["peak_rss_bytes"] = peak_rss_bytes()
+            record["children_rss_bytes"] = children_rss_bytes()
+            if self.trace_memory and tracemalloc.is_tracing():
+                record["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+
+            for count in ("nodes", "edges"):
+                if count in record and record["wall_s"] > 0:
+                    record[f"{count}_per_s"] = record[count] / record["wall_s"]
+
+            self.phases.append(record)
+
+    def set_histogram(self, name, values):
+        """Add a histogram of values to the report of the current scope"""
+        self.histograms[(self.scope, name)] = histogram(values)
+
+    def cprofile_top(self):
+        """The functions with the largest cumulative time since start(), as a list of dicts"""
+        stats = pstats.Stats(self.cprofile, stream=io.StringIO())
+        stats.sort_stats(pstats.SortKey.CUMULATIVE)
+
+        top = []
+        for function in stats.fcn_list[:PROFILE_TOP_ENTRIES]:
+            primitive_calls, calls, total_time, cumulative_time, _ = stats.stats[function]
+            file_name, line, function_name = function
+            top.append({
+                "function": f"{file_name}:{line}({function_name})",
+                "calls": calls,
+                "primitive_calls": primitive_calls,
+                "total_s": total_time,
+                "cumulative_s": cumulative_time,
+            })
+        return top
+
+    def tracemalloc_top(self):
+        """The source lines holding the most memory traced since start(), as a list of dicts"""
+        statistics = tracemalloc.take_snapshot().statistics("lineno")
+        return [{"line": str(statistic.traceback[0]), "size_bytes": statistic.size, "count": statistic.count} for statistic in statistics[:PROFILE_TOP_ENTRIES]]
+
+    def report(self, scope, **info):
+        """The profile of a scope (the output path of a 3D RRG) as a dict, info is added to it as is"""
+        report = {
+            "format_version": PROFILE_FORMAT_VERSION,
+            **info,
+            "phases": [phase for phase in self.phases if phase["scope"] is None or phase["scope"] == scope],
+            "histograms": {name: values for (histogram_scope, name), values in self.histograms.items() if histogram_scope == scope},
+            "peak_rss_bytes": peak_rss_bytes(),
+        }
+
+        # The SB workers of a parallel run hold memory of their own
+        phases_children_rss = max([phase.get("children_rss_bytes", 0) for phase in report["phases"]], default=0)
+        report["children_peak_rss_bytes"] = max(children_peak_rss_bytes(), phases_children_rss)
+        report["total_peak_rss_bytes"] = report["peak_rss_bytes"] + report["children_peak_rss_bytes"]
+
+        if self.cprofile is not None:
+            self.cprofile.disable()
+            report["cprofile"] = self.cprofile_top()
+            self.cprofile.enable()
+
+        if self.trace_memory and tracemalloc.is_tracing():
+            report["tracemalloc"] = self.tracemalloc_top()
+
+        return report
+
+    def write(self, scope, output_path, **info):
+        '''
+        Write the profile of a scope as JSON next to the 3D RRG at output_path (see profile_path), written to a temporary
+        file and renamed so readers never see a partial profile. Returns the path of the profile
+        '''
+        path = profile_path(output_path)
+        report = self.report(scope, output_path=output_path, **info)
+
+        with atomic_write(path) as temp_path, open(temp_path, "w") as outfile:
+            json.dump(report, outfile, indent=2)
+
+        print_verbose(f"Wrote the profile of {output_path} to {path}")
+        return path
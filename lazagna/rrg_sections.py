@@ -0,0 +1,230 @@
+from lxml import etree
+import json
+import mmap
+import os
+import re
+import time
+from printing import print_verbose
+from artifact_store import atomic_write
+from rrg_compression import open_rrg, rrg_compression, rrg_content_digest, uncompressed_rrg_path
+
+# Top level sections of an RRG, children of <rr_graph>
+RRG_SECTIONS = ["channels", "switches", "segments", "block_types", "grid", "rr_nodes", "rr_edges"]
+
+SECTION_START_PATTERN = re.compile(rb"<(" + b"|".join(section.encode() for section in RRG_SECTIONS) + rb")[\s>/]")
+
+# Bytes kept between two chunks of a compressed RRG, enough to find a section tag split between them
+SECTION_TAG_OVERLAP = max(len(section) for section in RRG_SECTIONS) + 3
+
+# Version of the section sidecar layout, bump it whenever what's stored in the sidecar changes
+RRG_SECTIONS_FORMAT_VERSION = 2
+RRG_SECTIONS_SUFFIX = ".sections.json"
+
+# Size of the chunks compressed RRGs are searched in
+SECTION_SCAN_CHUNK_SIZE = 16 * 1024 * 1024
+
+def rrg_sections_path(file_path):
+    """Section sidecar of an RRG, named after the uncompressed RRG so the RRG and its compressed copies share it"""
+    return uncompressed_rrg_path(file_path) + RRG_SECTIONS_SUFFIX
+
+def find_sections_in_buffer(buffer, pos, buffer_offset, sections, open_section):
+    '''
+    Find the sections starting and ending in buffer from pos. open_section is the (name, start offset) of a section
+    found before buffer that isn't closed yet, or None. Found sections are added to sections as name -> (start, end)
+    offsets in the file, the end being right after the closing tag.
+
+    Returns the position in buffer the search has to carry on from once more of the file is added to it, keeping enough
+    of the end of buffer for a tag split with the next chunk, and the section still open at the end of buffer.
+    '''
+    while True:
+        if open_section is None:
+            match = SECTION_START_PATTERN.search(buffer, pos)
+            if match is None:
+                return max(pos, len(buffer) - SECTION_TAG_OVERLAP), None
+
+            tag_end = buffer.find(b">", match.start())
+            if tag_end == -1:
+                # The rest of the tag is in the next chunk
+                return match.start(), None
+
+            name = match.group(1).decode()
+            if buffer[tag_end - 1:tag_end] == b"/":
+                sections[name] = (buffer_offset + match.start(), buffer_offset + tag_end + 1)
+            else:
+                open_section = (name, buffer_offset + match.start())
+            pos = tag_end + 1
+        else:
+            closing_tag = b"</" + open_section[0].encode() + b">"
+            end = buffer.find(closing_tag, pos)
+            if end == -1:
+                return max(pos, len(buffer) - SECTION_TAG_OVERLAP), open_section
+
+            sections[open_section[0]] = (open_section[1], buffer_offset + end + len(closing_tag))
+            open_section = None
+            pos = end + len(closing_tag)
+
+class RRGSectionIndex:
+    """
+    Byte ranges of the top level sections of an RRG (<switches>, <segments>, <rr_nodes>, <rr_edges>, ...), so callers
+    can read or parse only the sections they need instead of going through the whole RRG.
+
+    The sections are found once by searching the memory-mapped RRG and saved in a sidecar next to it
+    (<file>.sections.json), keyed by the RRG's size, mtime, compression and content hash. Compressed RRGs can't be
+    memory-mapped, they are searched and read while being decompressed, and their offsets are in the uncompressed RRG,
+    so an RRG and its compressed copies share the sidecar of the uncompressed name.
+    """
+
+    def __init__(self, file_path, use_sidecar=True):
+        self.file_path = file_path
+        self.file = None
+        self.mmap = None
+
+        if rrg_compression(file_path) is None and os.path.getsize(file_path) > 0:
+            self.file = open(file_path, "rb")
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.sections = self.load_sidecar() if use_sidecar else None
+        if self.sections is None:
+            self.sections = self.find_sections()
+            if use_sidecar:
+                self.save_sidecar()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+            self.mmap = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def find_sections(self):
+        """Search the RRG for its top level sections, returns them as name -> (start, end) offsets"""
+        start_time = time.time()
+        sections = {}
+
+        if self.mmap is not None:
+            find_sections_in_buffer(self.mmap, 0, 0, sections, None)
+        else:
+            buffer = b""
+            buffer_offset = 0
+            open_section = None
+            with open_rrg(self.file_path) as infile:
+                for chunk in iter(lambda: infile.read(SECTION_SCAN_CHUNK_SIZE), b""):
+                    buffer += chunk
+                    keep_from, open_section = find_sections_in_buffer(buffer, 0, buffer_offset, sections, open_section)
+                    buffer_offset += keep_from
+                    buffer = buffer[keep_from:]
+
+        end_time = time.time()
+        print_verbose(f"Finding the sections of {self.file_path} ({', '.join(sections)}) took {((end_time - start_time) * 1000):0.2f} ms")
+        return sections
+
+    def load_sidecar(self):
+        """
+        Sections saved in the sidecar, or None if there is no sidecar or it doesn't match the RRG anymore. As for the RRG
+        index, the content hash decides when only the mtime or the compression of the RRG changed.
+        """
+        sidecar_path = rrg_sections_path(self.file_path)
+        if not os.path.exists(sidecar_path):
+            return None
+
+        try:
+            with open(sidecar_path, "r") as infile:
+                sidecar = json.load(infile)
+
+            if sidecar["format_version"] != RRG_SECTIONS_FORMAT_VERSION:
+                print_verbose(f"RRG sections {sidecar_path} have an old format, searching the RRG again")
+                return None
+
+            stat = os.stat(self.file_path)
+            same_compression = sidecar["file_compression"] == rrg_compression(self.file_path)
+            refresh_sidecar = not same_compression or sidecar["file_size"] != stat.st_size or sidecar["file_mtime_ns"] != stat.st_mtime_ns
+            if (same_compression and sidecar["file_size"] != stat.st_size) or (refresh_sidecar and sidecar["file_hash"] != rrg_content_digest(self.file_path)):
+                print_verbose(f"RRG sections {sidecar_path} are out of date, searching the RRG again")
+                return None
+
+            sections = {name: tuple(section_range) for name, section_range in sidecar["sections"].items()}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"WARNING: Could not read the RRG sections {sidecar_path}, searching the RRG again: {e}")
+            return None
+
+        # Same content under a new mtime or compression, update the sidecar so the next run doesn't have to hash the RRG
+        if refresh_sidecar:
+            self.sections = sections
+            self.save_sidecar()
+
+        return sections
+
+    def save_sidecar(self):
+        """Save the sections next to the RRG, written to a temporary file and renamed so readers never see a partial sidecar"""
+        sidecar_path = rrg_sections_path(self.file_path)
+        stat = os.stat(self.file_path)
+        sidecar = {
+            "format_version": RRG_SECTIONS_FORMAT_VERSION,
+            "file_size": stat.st_size,
+            "file_mtime_ns": stat.st_mtime_ns,
+            "file_compression": rrg_compression(self.file_path),
+            "file_hash": rrg_content_digest(self.file_path),
+            "sections": self.sections,
+        }
+
+        try:
+            with atomic_write(sidecar_path) as temp_path, open(temp_path, "w") as outfile:
+                json.dump(sidecar, outfile)
+        except OSError as e:
+            print(f"WARNING: Could not write the RRG sections {sidecar_path}: {e}")
+
+    def range(self, name):
+        """(start, end) byte offsets of a section, or None if the RRG doesn't have it"""
+        return self.sections.get(name)
+
+    def read(self, name):
+        """Bytes of a section, from its opening to its closing tag, or None if the RRG doesn't have it"""
+        section_range = self.range(name)
+        if section_range is None:
+            return None
+
+        start, end = section_range
+        if self.mmap is not None:
+            return self.mmap[start:end]
+
+        with open_rrg(self.file_path) as infile:
+            infile.seek(start)
+            return infile.read(end - start)
+
+    def chunks(self, name, chunk_size=SECTION_SCAN_CHUNK_SIZE):
+        """Generator yielding the bytes of a section in chunks of chunk_size, for sections too large to read at once"""
+        section_range = self.range(name)
+        if section_range is None:
+            return
+
+        start, end = section_range
+        if self.mmap is not None:
+            for offset in range(start, end, chunk_size):
+                yield self.mmap[offset:min(offset + chunk_size, end)]
+            return
+
+        with open_rrg(self.file_path) as infile:
+            infile.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = infile.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                yield chunk
+                remaining -= len(chunk)
+
+    def parse(self, name):
+        """Parse a section on its own, returns its element or None if the RRG doesn't have it"""
+        data = self.read(name)
+        if data is None:
+            return None
+
+        parser = etree.XMLParser(huge_tree=True, remove_blank_text=True, remove_comments=True)
+        return etree.fromstring(data, parser)
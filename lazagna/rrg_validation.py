@@ -0,0 +1,149 @@
+import numpy as np
+from printing import print_verbose
+
+# Node rows are (id, layer, x, y, ptc) and edge rows (src node, sink node, switch id), see create_sb_connections
+NODE_ID, NODE_LAYER, NODE_X, NODE_Y, NODE_PTC = range(5)
+EDGE_SRC, EDGE_SINK, EDGE_SWITCH = range(3)
+
+# PTCs are 32 bit in VPR, the location of a node is packed above its ptc in the keys checked for duplicates
+PTC_KEY_BITS = 32
+
+class RRGDeltaValidator:
+    """
+    Checks the nodes and edges generated for a 3D RRG against the base RRG they are added to, chunk by chunk as they
+    are generated and before anything is written, so a broken 3D RRG fails here instead of after VPR spent minutes
+    loading it. Only the loaded base RRG (its channel ptcs, switches and segments) is used, the files are never
+    read again.
+
+    The checks are:
+        - The new node ids follow the base RRG without gaps or duplicates (rrg_max_node_id + 1 up to the last new id)
+        - The new nodes are inside the device, and their ptcs are unique per (layer, x, y) and above the ptcs of the base
+          CHANX nodes at the same location (the new nodes are CHANX nodes to VPR)
+        - Every edge starts and ends at a node of the base RRG or a new node
+        - Every edge switch id is a switch of the RRG, and the segment id of the new nodes is a segment of the RRG
+
+    Usage:
+        validator = RRGDeltaValidator(...)
+        validator.reset(output_path)
+        validator.check_nodes(nodes) / validator.check_edges(edges) for every chunk
+        validator.finish()
+
+    Any failed check prints an error and exits.
+    """
+
+    def __init__(self, base_max_node_id, base_max_ptcs, switch_ids, segment_ids, segment_id):
+        self.base_max_node_id = base_max_node_id
+
+        # Highest ptc of the base CHANX nodes at every [layer, x, y] of the device, -1 where there are none
+        self.base_max_ptcs = base_max_ptcs
+        self.device_shape = base_max_ptcs.shape
+
+        self.valid_switches = np.zeros(max(switch_ids, default=-1) + 1, dtype=bool)
+        self.valid_switches[list(switch_ids)] = True
+
+        self.segment_id = segment_id
+        self.segment_ids = set(segment_ids)
+
+    def reset(self, output_path):
+        """Start checking the nodes and edges of a new 3D RRG, written to output_path"""
+        self.output_path = output_path
+
+        self.num_nodes = 0
+        self.num_edges = 0
+        self.seen_ids = np.zeros(0, dtype=bool)
+        self.ptc_keys = []
+        self.min_endpoint = 0
+        self.max_endpoint = -1
+
+        if self.segment_id not in self.segment_ids:
+            self.fail(f"the 3D SB segment id {self.segment_id} is not a segment of the base RRG")
+
+    def fail(self, message):
+        print(f"ERROR: Validation of {self.output_path} failed, {message}")
+        exit(1)
+
+    def check_nodes(self, nodes):
+        """Check a chunk of new nodes, rows of (id, layer, x, y, ptc)"""
+        if len(nodes) == 0:
+            return
+
+        offsets = nodes[:, NODE_ID] - self.base_max_node_id - 1
+        if offsets.min() < 0:
+            node_id = nodes[offsets.argmin(), NODE_ID]
+            self.fail(f"new node {node_id} reuses the id of a node of the base RRG (0 to {self.base_max_node_id})")
+
+        # Mark the ids seen so far, gaps and ids repeated within the chunk are found once every node is in (see finish)
+        if offsets.max() >= len(self.seen_ids):
+            grown = np.zeros(max(int(offsets.max()) + 1, 2 * len(self.seen_ids)), dtype=bool)
+            grown[:len(self.seen_ids)] = self.seen_ids
+            self.seen_ids = grown
+        if self.seen_ids[offsets].any():
+            node_id = nodes[self.seen_ids[offsets].argmax(), NODE_ID]
+            self.fail(f"node id {node_id} is used by two new nodes")
+        self.seen_ids[offsets] = True
+        self.num_nodes += len(nodes)
+
+        location = (nodes[:, NODE_LAYER], nodes[:, NODE_X], nodes[:, NODE_Y])
+        outside = np.zeros(len(nodes), dtype=bool)
+        for coordinate, size in zip(location, self.device_shape):
+            outside |= (coordinate < 0) | (coordinate >= size)
+        if outside.any():
+            node = nodes[outside.argmax()]
+            self.fail(f"new node {node[NODE_ID]} at layer {node[NODE_LAYER]} ({node[NODE_X]}, {node[NODE_Y]}) is outside of the device")
+
+        ptcs = nodes[:, NODE_PTC]
+        if ptcs.min() < 0 or ptcs.max() >= 2 ** (PTC_KEY_BITS - 1):
+            node = nodes[((ptcs < 0) | (ptcs >= 2 ** (PTC_KEY_BITS - 1))).argmax()]
+            self.fail(f"new node {node[NODE_ID]} has the ptc {node[NODE_PTC]}, outside of the 32 bit ptcs of VPR")
+
+        location_keys = np.ravel_multi_index(location, self.device_shape)
+        colliding = ptcs <= self.base_max_ptcs.reshape(-1)[location_keys]
+        if colliding.any():
+            node = nodes[colliding.argmax()]
+            self.fail(f"new node {node[NODE_ID]} at layer {node[NODE_LAYER]} ({node[NODE_X]}, {node[NODE_Y]}) has the ptc {node[NODE_PTC]}, but the base RRG already has CHANX tracks up to ptc {self.base_max_ptcs[node[NODE_LAYER], node[NODE_X], node[NODE_Y]]} there")
+
+        self.ptc_keys.append((location_keys << PTC_KEY_BITS) | ptcs)
+
+    def check_edges(self, edges):
+        """Check a chunk of new edges, rows of (src node, sink node, switch id)"""
+        if len(edges) == 0:
+            return
+
+        endpoints = edges[:, [EDGE_SRC, EDGE_SINK]]
+        self.min_endpoint = min(self.min_endpoint, int(endpoints.min()))
+        self.max_endpoint = max(self.max_endpoint, int(endpoints.max()))
+        if self.min_endpoint < 0:
+            edge = edges[(endpoints < 0).any(axis=1).argmax()]
+            self.fail(f"edge {edge[EDGE_SRC]} -> {edge[EDGE_SINK]} has a negative node id")
+
+        switches = edges[:, EDGE_SWITCH]
+        invalid = (switches < 0) | (switches >= len(self.valid_switches))
+        invalid[~invalid] = ~self.valid_switches[switches[~invalid]]
+        if invalid.any():
+            edge = edges[invalid.argmax()]
+            self.fail(f"edge {edge[EDGE_SRC]} -> {edge[EDGE_SINK]} uses the switch id {edge[EDGE_SWITCH]}, which is not a switch of the base RRG")
+
+        self.num_edges += len(edges)
+
+    def finish(self):
+        """Checks that need every node and edge of the 3D RRG, once they are all generated"""
+        if int(self.seen_ids.sum()) != self.num_nodes:
+            self.fail(f"{self.num_nodes - int(self.seen_ids.sum())} new nodes reuse the id of another new node")
+
+        if not self.seen_ids[:self.num_nodes].all():
+            missing_id = self.base_max_node_id + 1 + int((~self.seen_ids[:self.num_nodes]).argmax())
+            self.fail(f"the new node ids are not dense, {missing_id} is missing between {self.base_max_node_id + 1} and {self.base_max_node_id + self.num_nodes}")
+
+        max_node_id = self.base_max_node_id + self.num_nodes
+        if self.max_endpoint > max_node_id:
+            self.fail(f"an edge ends at node {self.max_endpoint}, but the last node of the 3D RRG is {max_node_id}")
+
+        if len(self.ptc_keys) > 0:
+            keys = np.sort(np.concatenate(self.ptc_keys))
+            duplicates = keys[1:] == keys[:-1]
+            if duplicates.any():
+                key = int(keys[1:][duplicates][0])
+                layer, x, y = np.unravel_index(key >> PTC_KEY_BITS, self.device_shape)
+                self.fail(f"two new nodes at layer {layer} ({x}, {y}) have the same ptc {key & ((1 << PTC_KEY_BITS) - 1)}")
+
+        print_verbose(f"Validated {self.num_nodes} new nodes and {self.num_edges} new edges of {self.output_path}")
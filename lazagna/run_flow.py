@@ -6,11 +6,27 @@ from arch_xml_modification import *
 from file_handling import *
 from script_editing import *
 from printing import print_verbose
+from switch_block_generator import SwitchBlockGenerator, SBVariant
+from sb_locations import SB_LOCATION_SEED_DEFAULT
+from rrg_compression import find_rrg_file, rrg_compression, check_compression, decompress_rrg_file
+from rrg_profile import profile_path
+from artifact_store import artifact_key, artifact_locks, build_artifact, file_digest
+from memory_admission import run_measuring_memory, task_logs_out_of_memory
 import shutil
 import sys
+import csv
+import json
 
 and2_blif_path = "/benchmarks/and2/and2.blif"
 
+# Run directory of an OpenFPGA task and the results it writes there, relative to the task directory
+TASK_RUN_DIR = "/run001"
+TASK_RESULT_PATH = TASK_RUN_DIR + "/task_result.csv"
+
+# 3D SB generator reused by the 3D RRGs of the same architecture, see get_sb_generator
+sb_generator = None
+sb_generator_key = None
+
 def run_command_in_temp_dir(command, original_dir, handle_error=True, verbose=False):
     """
     Run a command in a temporary directory.
@@ -60,26 +76,55 @@ def run_command_in_temp_dir(command, original_dir, handle_error=True, verbose=Fa
             os.chdir(original_dir)
 
 def run_task(original_dir, temp_dir=""):
+    """
+    Run the OpenFPGA task in temp_dir, measuring its memory (see run_measuring_memory). A task without results also
+    looks killed for lack of memory if its logs show it (see task_logs_out_of_memory).
 
+    Returns:
+        tuple: (peak RSS in bytes, whether it looks killed for lack of memory)
+    """
     run_command = ["python3",
                original_dir + "/OpenFPGA/openfpga_flow/scripts/run_fpga_task.py",
                temp_dir]
-    
-    run_command_in_temp_dir(run_command, original_dir, handle_error=False, verbose=False)
 
-def run_flow(original_dir, width, height, channel_width, benchmark_name="", temp_dir ="", type_sb="full", arch_path="", rrg_3d_path="", percent_connectivity=0.5, place_algorithm="cube_bb", connection_type="subset", run_num=1, output_additional_info=""):
+    # Errors are not raised, a failed task is seen by its missing results
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        returncode, stdout, stderr, peak_rss, out_of_memory = run_measuring_memory(run_command, temporary_dir)
+
+    if returncode != 0:
+        print_verbose(f"OpenFPGA task {temp_dir} failed with error code {returncode}")
+
+    # The OOM killer kills VPR, whose output is in the logs of the task, while run_fpga_task.py exits normally
+    if not out_of_memory and not os.path.exists(temp_dir + TASK_RESULT_PATH):
+        out_of_memory = task_logs_out_of_memory(temp_dir + TASK_RUN_DIR)
+
+    return peak_rss, out_of_memory
+
+def run_flow(original_dir, width, height, channel_width, benchmark_name="", temp_dir ="", type_sb="full", arch_path="", rrg_3d_path="", percent_connectivity=0.5, place_algorithm="cube_bb", connection_type="subset", run_num=1, output_additional_info="", requeue_on_oom=False):
+    """
+    Run the OpenFPGA task of a benchmark and copy its results, or write empty results if it failed. With
+    requeue_on_oom, a task that failed for lack of memory writes no results so it can be run again.
+
+    Returns:
+        dict: peak_rss_bytes of the task, out_of_memory if it has no results and looks killed for lack of memory (see
+        run_task), requeue if it should be run again and total_run_time, the TotalRunTime of its results
+        (None if it has no results)
+    """
     print_verbose(f"Temp Dir for benchmark {benchmark_name}: {temp_dir}")
 
     start_time = time.time()
-    run_task(original_dir, temp_dir)
+    peak_rss, out_of_memory = run_task(original_dir, temp_dir)
     end_time = time.time()
 
     run_time = (end_time - start_time) * 1000
-    print_verbose(f"Running OpenFPGA task for benchmark {benchmark_name} took {run_time:0.2f} ms")
+    print_verbose(f"Running OpenFPGA task for benchmark {benchmark_name} took {run_time:0.2f} ms with a peak RSS of {peak_rss / 1024 ** 2:0.1f} MB")
 
     # Now copy results into somewhere else maybe?
     # Feels a bit sketch should automate it so the reuslts are auto placed into nice named area but oh well
-    task_result_path = "/run001/task_result.csv"
+    task_result_path = TASK_RESULT_PATH
+
+    # A task that has results wasn't killed, whatever else the OOM killer did meanwhile
+    status = {"peak_rss_bytes": peak_rss, "out_of_memory": out_of_memory and not os.path.exists(temp_dir + task_result_path), "requeue": False, "total_run_time": None}
     results_path = "/results/3d_" + type_sb + "_cw_" + output_file_name(channel_width=channel_width, width=width, height=height, percent_connectivity=percent_connectivity, place_algorithm=place_algorithm, connection_type=connection_type, run_num=run_num, additional_info=output_additional_info) + "/"
     result_file_name = benchmark_name + "_results_cw_" + output_file_name(channel_width=channel_width, width=width, height=height, percent_connectivity=percent_connectivity, place_algorithm=place_algorithm, connection_type=connection_type, run_num=run_num, additional_info=output_additional_info) + ".csv"
 
@@ -92,9 +137,13 @@ def run_flow(original_dir, width, height, channel_width, benchmark_name="", temp
         start_time = time.time()
         copy_results(original_dir, task_result_path, results_path, result_file_name, temp_dir)
         end_time = time.time()
+        status["total_run_time"] = read_total_run_time(original_dir + results_path + result_file_name)
 
         run_time = (end_time - start_time) * 1000
         print_verbose(f"Copying the results for benchmark {benchmark_name} to {original_dir + results_path + result_file_name} took {run_time:0.2f} ms")
+    elif status["out_of_memory"] and requeue_on_oom:
+        print(f"WARNING: Benchmark {benchmark_name} ran out of memory after reaching {peak_rss / 1024 ** 3:0.2f} GB, running it again")
+        status["requeue"] = True
     else:
         start_time = time.time()
         generate_empty_results(original_dir, results_path, result_file_name, benchmark_name)
@@ -103,8 +152,16 @@ def run_flow(original_dir, width, height, channel_width, benchmark_name="", temp
         run_time = (end_time - start_time) * 1000
         print_verbose(f"Generating Empty Results file and writing to {original_dir + results_path + result_file_name} took {run_time:0.2f} ms")
 
-def setup_flow(original_dir, width, height, channel_width, type_sb="full", percent_connectivity=0.5, place_algorithm="cube_bb", is_verilog_benchmarks=False, connection_type="subset", arch_file="", random_seed=1, run_num=1, extra_vpr_options="", output_additional_info="", temp_dir="", vertical_connectivity=1, sb_switch_name="", sb_segment_name="", sb_input_pattern=[], sb_output_pattern=[], sb_location_pattern="repeated_interval", sb_grid_csv_path="", vertical_delay_ratio=1, sb_3d_switch_name="3D_SB_switch", base_delay_switch="", switch_interlayer_pairs={}, update_arch_delay=False):
-    
+    return status
+
+def setup_flow(original_dir, width, height, channel_width, type_sb="full", percent_connectivity=0.5, place_algorithm="cube_bb", is_verilog_benchmarks=False, connection_type="subset", arch_file="", random_seed=1, run_num=1, extra_vpr_options="", output_additional_info="", temp_dir="", vertical_connectivity=1, sb_switch_name="", sb_segment_name="", sb_input_pattern=[], sb_output_pattern=[], sb_location_pattern="repeated_interval", sb_grid_csv_path="", vertical_delay_ratio=1, sb_3d_switch_name="3D_SB_switch", base_delay_switch="", switch_interlayer_pairs={}, update_arch_delay=False, rrg_format="xml", compression="none", sb_location_seed=SB_LOCATION_SEED_DEFAULT):
+
+    if rrg_format != "xml" and rrg_format != "bin":
+        print(f"ERROR: Unknown RRG format {rrg_format}, must be xml or bin.")
+        exit(1)
+
+    if compression != "none":
+        check_compression(compression)
 
     # Copy the task directory to the temp directory and work on it from there
     shutil.copytree(original_dir + "/task", temp_dir + "/task", dirs_exist_ok=True)
@@ -116,6 +173,99 @@ def setup_flow(original_dir, width, height, channel_width, type_sb="full", perce
 
     script_path ="/designs/bitstream_script.openfpga"
 
+    arch_base_file, arch_output_file_path, arch_output_file_name = get_arch_paths(original_dir, width, height, type_sb=type_sb, arch_file=arch_file, vertical_delay_ratio=vertical_delay_ratio, update_arch_delay=update_arch_delay, sb_3d_switch_name=sb_3d_switch_name, base_delay_switch=base_delay_switch, switch_interlayer_pairs=switch_interlayer_pairs)
+
+    generate_modified_arch(original_dir, arch_base_file, arch_output_file_path, width, height, vertical_delay_ratio=vertical_delay_ratio, sb_3d_switch_name=sb_3d_switch_name, base_delay_switch=base_delay_switch, switch_interlayer_pairs=switch_interlayer_pairs, update_arch_delay=update_arch_delay)
+    
+    # copy the modified arch file into the task
+    # TODO: This is a bit sketchy, should make it more robust in the future to allow for multiple arch runs at the same time, no hard coding values
+    command = ["cp", arch_output_file_path, temp_dir + "/task/designs/vtr_arch.xml"]
+    run_command_in_temp_dir(command, original_dir)
+
+    relative_arch_path = os.path.relpath(arch_output_file_path, original_dir)
+    relative_arch_path = "/" + relative_arch_path
+
+    start_time = time.time()
+    append_cw_to_script(temp_dir + "/task" + script_path, str(channel_width))
+    end_time = time.time()
+
+    run_time = (end_time - start_time) * 1000
+    print_verbose(f"Adding Channel Width to execution script took {run_time:0.2f} ms")
+
+    start_time = time.time()
+    append_place_algorithm_to_script(temp_dir + "/task" + script_path, place_algorithm)
+    end_time = time.time()
+
+    run_time = (end_time - start_time) * 1000
+    print_verbose(f"Adding Placement Algorithm to execution script took {run_time:0.2f} ms")
+
+    rrg_path = get_base_rrg_path(channel_width, arch_output_file_name)
+
+    rrg_3d_path = get_3d_rrg_path(type_sb, channel_width, percent_connectivity, connection_type, arch_output_file_name, vertical_connectivity=vertical_connectivity, sb_input_pattern=sb_input_pattern, sb_output_pattern=sb_output_pattern, sb_location_pattern=sb_location_pattern, sb_grid_csv_path=sb_grid_csv_path, sb_location_seed=sb_location_seed, sb_switch_name=sb_switch_name, sb_segment_name=sb_segment_name)
+
+    # if base rrg does not exist, create it (AKA run VTR)
+    generate_base_rrg(original_dir, relative_arch_path, channel_width, rrg_path)
+
+    # if 3d rrg does not exist (compressed or not), create it. Runs of a sweep needing the same 3D RRG wait for the one
+    # generating it instead of generating it again. Its XML and binary writers (and the compression after them) already
+    # write it to a temporary file renamed into place, so it's built in place
+    if type_sb == "3d_cb" or type_sb == "2d" or type_sb == "3d_cb_out_only":
+        print_verbose(f"3D RRG not generated since type {type_sb} does not need a custom RRG, using base RRG")
+    else:
+        start_time = time.time()
+        built = build_artifact(original_dir + get_rrg_path_for_format(rrg_3d_path, rrg_format), lambda path: create_custom_3d_rrg(rrg_path, get_rrg_path_for_format(rrg_3d_path, rrg_format), original_dir, percent_connectivity, connection_type, arch_file=arch_base_file, vertical_connectivity=vertical_connectivity, sb_switch_name=sb_switch_name, sb_segment_name=sb_segment_name, sb_input_pattern=sb_input_pattern, sb_output_pattern=sb_output_pattern, sb_location_pattern=sb_location_pattern, sb_grid_csv_path=sb_grid_csv_path, compression=compression, sb_location_seed=sb_location_seed), exists=rrg_exists, in_place=True)
+        end_time = time.time()
+
+        run_time = (end_time - start_time) * 1000
+        if built:
+            print_verbose(f"Generating 3D RRG from Base RRG took {run_time:0.2f} ms")
+        else:
+            print_verbose(f"3D RRG previously generated at {find_rrg_file(original_dir + get_rrg_path_for_format(rrg_3d_path, rrg_format))}")
+
+    if type_sb == "3d_cb" or type_sb == "2d" or type_sb == "3d_cb_out_only":
+        # Copy Base RRG path into task script (only need base since 3D SBs are not used)
+        append_rrg_to_script(temp_dir + "/task" + script_path, get_rrg_path_for_vpr(original_dir + rrg_path, temp_dir))
+
+    else:
+        # Copy 3D RRG path into task script
+        append_rrg_to_script(temp_dir + "/task" + script_path, get_rrg_path_for_vpr(original_dir + get_rrg_path_for_format(rrg_3d_path, rrg_format), temp_dir))
+
+
+
+    if is_verilog_benchmarks:
+        # TODO: This is a bit sketchy, should make it more robust in the future to allow for multiple arch runs at the same time, no hard coding values
+        command = ["cp", temp_dir + "/task/config_templates/verilog_task.conf", temp_dir + "/task/config/task.conf"]
+        run_command_in_temp_dir(command, original_dir)
+    else:
+        # TODO: This is a bit sketchy, should make it more robust in the future to allow for multiple arch runs at the same time, no hard coding values
+        command = ["cp", temp_dir + "/task/config_templates/blif_task.conf", temp_dir + "/task/config/task.conf"]
+        run_command_in_temp_dir(command, original_dir)
+
+    #append random seed to script
+    append_random_seed_to_script(temp_dir + "/task" + script_path, random_seed)
+
+    #append extra vpr options to script
+    if extra_vpr_options != "":
+        append_extra_vpr_option_to_script(temp_dir + "/task" + script_path, extra_vpr_options)
+
+    # Make tasks_run directory
+    #Output folder name based on parameters and time of run
+    curr_time = time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime())
+    folder_name = "3d_" + type_sb + "_cw_" + output_file_name(channel_width=channel_width, width=width, height=height, percent_connectivity=percent_connectivity, place_algorithm=place_algorithm, connection_type=connection_type, run_num=run_num, additional_info=output_additional_info) + "_" + curr_time
+    os.makedirs(original_dir + "/tasks_run/" + folder_name, exist_ok=True)
+    return original_dir + "/tasks_run/" + folder_name
+
+def get_arch_paths(original_dir, width, height, type_sb="full", arch_file="", vertical_delay_ratio=1, update_arch_delay=False, sb_3d_switch_name="3D_SB_switch", base_delay_switch="", switch_interlayer_pairs={}):
+    """
+    Get the base arch file for the type of switch block, and the path and name of the arch file modified for the given dimensions.
+
+    The name ends with the artifact_key of everything the modified arch is made from (the content of the base arch file,
+    the dimensions and the delay options), so a changed base arch file or delay option never reuses a stale arch, base
+    RRG or 3D RRG.
+
+    Returns:
+        tuple: (arch_base_file, arch_output_file_path, arch_output_file_name)
+    """
     # Set the base arch file and output directory based on the type of switch block
     # Base arch layout will be modified to have the correct dimensions and then saved to the output directory
     if type_sb == "3d_cb":
@@ -145,12 +295,21 @@ def setup_flow(original_dir, width, height, channel_width, type_sb="full", perce
     if update_arch_delay:
         delay_ratio_string = "_delay_ratio_" + str(vertical_delay_ratio)
 
-    arch_output_file_name = os.path.splitext(os.path.basename(arch_base_file))[0] + "_" + str(width) + "x" + str(height) + delay_ratio_string + ".xml"
+    arch_inputs = {"base_arch": file_digest(arch_base_file), "width": int(width), "height": int(height)}
+    if update_arch_delay:
+        arch_inputs.update(vertical_delay_ratio=float(vertical_delay_ratio), sb_3d_switch_name=sb_3d_switch_name, base_delay_switch=base_delay_switch, switch_interlayer_pairs=switch_interlayer_pairs)
+    arch_key = artifact_key("arch", **arch_inputs)
+
+    arch_output_file_name = os.path.splitext(os.path.basename(arch_base_file))[0] + "_" + str(width) + "x" + str(height) + delay_ratio_string + "_" + arch_key + ".xml"
 
     arch_output_file_path = arch_output_dir + arch_output_file_name
 
-    # Check if the modified Arch XML already exists, if not make it
-    if not os.path.exists(original_dir + arch_output_file_path):
+    return arch_base_file, arch_output_file_path, arch_output_file_name
+
+def generate_modified_arch(original_dir, arch_base_file, arch_output_file_path, width, height, vertical_delay_ratio=1, sb_3d_switch_name="3D_SB_switch", base_delay_switch="", switch_interlayer_pairs={}, update_arch_delay=False):
+    # Check if the modified Arch XML already exists, if not make it. It is saved to a temporary file renamed once
+    # complete, so the runs copying it never read a partial arch
+    def build(temp_path):
         start_time = time.time()
         tree, root = load_xml(arch_base_file)
         end_time = time.time()
@@ -170,37 +329,34 @@ def setup_flow(original_dir, width, height, channel_width, type_sb="full", perce
         print_verbose(f"Modifiying Base Arch XML took {run_time:0.2f} ms")
 
         start_time = time.time()
-        save_xml(tree, arch_output_file_path)
+        save_xml(tree, temp_path)
         end_time = time.time()
 
         run_time = (end_time - start_time) * 1000
         print_verbose(f"Saving the modified Arch XML took {run_time:0.2f} ms")
-    else:
-        print_verbose(f"Modified Arch XML previously generated")
-    
-    # copy the modified arch file into the task
-    # TODO: This is a bit sketchy, should make it more robust in the future to allow for multiple arch runs at the same time, no hard coding values
-    command = ["cp", arch_output_file_path, temp_dir + "/task/designs/vtr_arch.xml"]
-    run_command_in_temp_dir(command, original_dir)
 
-    relative_arch_path = os.path.relpath(arch_output_file_path, original_dir)
-    relative_arch_path = "/" + relative_arch_path
-
-    start_time = time.time()
-    append_cw_to_script(temp_dir + "/task" + script_path, str(channel_width))
-    end_time = time.time()
-
-    run_time = (end_time - start_time) * 1000
-    print_verbose(f"Adding Channel Width to execution script took {run_time:0.2f} ms")
-
-    start_time = time.time()
-    append_place_algorithm_to_script(temp_dir + "/task" + script_path, place_algorithm)
-    end_time = time.time()
+    if not build_artifact(arch_output_file_path, build):
+        print_verbose(f"Modified Arch XML previously generated")
 
-    run_time = (end_time - start_time) * 1000
-    print_verbose(f"Adding Placement Algorithm to execution script took {run_time:0.2f} ms")
+def get_base_rrg_path(channel_width, arch_output_file_name):
+    return "/base_rrg/rrg_cw_" + str(channel_width) + "_" + arch_output_file_name
 
-    rrg_path = "/base_rrg/rrg_cw_" + str(channel_width) + "_" + arch_output_file_name
+def get_3d_rrg_path(type_sb, channel_width, percent_connectivity, connection_type, arch_output_file_name, vertical_connectivity=1, sb_input_pattern=[], sb_output_pattern=[], sb_location_pattern="repeated_interval", sb_grid_csv_path="", sb_location_seed=SB_LOCATION_SEED_DEFAULT, sb_switch_name="", sb_segment_name=""):
+    """
+    Path of a 3D RRG relative to original_dir. Next to the readable options, the name has the artifact_key of every
+    option the 3D RRG is generated from (the base RRG, whose name has the key of its arch, the exact connectivity, the
+    3D SB switch and segment, the content of a custom SB grid CSV, ...), so 3D RRGs of different options never share a file.
+    """
+    rrg_3d_inputs = {
+        "base_rrg": get_base_rrg_path(channel_width, arch_output_file_name),
+        "type_sb": type_sb,
+        "percent_connectivity": float(percent_connectivity),
+        "connection_type": connection_type,
+        "vertical_connectivity": float(vertical_connectivity),
+        "sb_location_pattern": sb_location_pattern,
+        "sb_switch_name": sb_switch_name,
+        "sb_segment_name": sb_segment_name,
+    }
 
     vertical_connectivity_string = "vp_" + str(vertical_connectivity) + "_"
     if vertical_connectivity == 1:
@@ -224,76 +380,183 @@ def setup_flow(original_dir, width, height, channel_width, type_sb="full", perce
             print("ERROR: No output pattern provided for custom connection type.")
             exit(1)
 
+        rrg_3d_inputs.update(sb_input_pattern=sb_input_pattern, sb_output_pattern=sb_output_pattern)
+
     # if the location pattern is custom, add its pattern to the path
     if sb_location_pattern != "repeated_interval":
         if sb_location_pattern == "custom":
             if sb_grid_csv_path == "":
                 print("ERROR: No custom SB grid CSV path provided.")
                 exit(1)
+            elif not os.path.exists(sb_grid_csv_path):
+                print(f"ERROR: Custom SB grid CSV {sb_grid_csv_path} does not exist.")
+                exit(1)
             else:
                 sb_pattern_string += "_" + sb_location_pattern + "_" + os.path.splitext(os.path.basename(sb_grid_csv_path))[0]
+                rrg_3d_inputs["sb_grid_csv"] = file_digest(sb_grid_csv_path)
+        elif sb_location_pattern == "random":
+            # The seed picks the locations, 3D RRGs of different seeds must not be mistaken for one another
+            sb_pattern_string += "_" + sb_location_pattern + "_seed_" + str(sb_location_seed)
+            rrg_3d_inputs["sb_location_seed"] = int(sb_location_seed)
         else:
             sb_pattern_string += "_" + sb_location_pattern
 
-    rrg_3d_path = "/rrg_3d/rrg_3d_" + type_sb + "_cw_" + str(channel_width) + "_" + str(int(percent_connectivity * 100)) + "percent_" + connection_type + sb_pattern_string + "_" + vertical_connectivity_string + arch_output_file_name
+    rrg_3d_key = artifact_key("rrg_3d", **rrg_3d_inputs)
 
-    # if base rrg does not exist, create it (AKA run VTR)
-    if not os.path.exists(original_dir + rrg_path):
-        start_time = time.time()
-        create_base_rrg(original_dir, relative_arch_path, channel_width=channel_width, path_to_write_rrg=rrg_path)
-        end_time = time.time()
+    return "/rrg_3d/rrg_3d_" + type_sb + "_cw_" + str(channel_width) + "_" + str(int(percent_connectivity * 100)) + "percent_" + connection_type + sb_pattern_string + "_" + vertical_connectivity_string + rrg_3d_key + "_" + arch_output_file_name
+
+def rrg_exists(rrg_path):
+    """Whether an RRG exists, compressed or not (see find_rrg_file)"""
+    return find_rrg_file(rrg_path) is not None
+
+def generate_base_rrg(original_dir, relative_arch_path, channel_width, rrg_path):
+    # if base rrg does not exist (compressed or not), create it (AKA run VTR). Only one of the runs needing it runs VTR,
+    # which writes it to a temporary file renamed once complete
+    start_time = time.time()
+    built = build_artifact(original_dir + rrg_path, lambda path: create_base_rrg(original_dir, relative_arch_path, channel_width=channel_width, path_to_write_rrg="/" + os.path.relpath(path, original_dir)), exists=rrg_exists)
+    end_time = time.time()
 
+    if built:
         run_time = (end_time - start_time) * 1000
         print_verbose(f"Generating Base RRG took {run_time:0.2f} ms")
     else:
-        print_verbose(f"Base RRG previously generated at {original_dir + rrg_path}")
+        print_verbose(f"Base RRG previously generated at {find_rrg_file(original_dir + rrg_path)}")
 
-    # if 3d rrg does not exist, create it
-    if not os.path.exists(original_dir + rrg_3d_path) and type_sb != "3d_cb" and type_sb != "2d" and type_sb != "3d_cb_out_only":
-        start_time = time.time()
-        create_custom_3d_rrg(rrg_path, rrg_3d_path, original_dir, percent_connectivity, connection_type, arch_file=arch_base_file, vertical_connectivity=vertical_connectivity, sb_switch_name=sb_switch_name, sb_segment_name=sb_segment_name, sb_input_pattern=sb_input_pattern, sb_output_pattern=sb_output_pattern, sb_location_pattern=sb_location_pattern, sb_grid_csv_path=sb_grid_csv_path)
-        end_time = time.time()
+def get_rrg_path_for_vpr(rrg_path, temp_dir):
+    """
+    Path of the RRG to give VPR, which only reads uncompressed RRGs. If the RRG only exists compressed (see
+    find_rrg_file) it is decompressed into the temporary directory of the run.
+    """
+    found_path = find_rrg_file(rrg_path)
+    if found_path is None:
+        print(f"ERROR: RRG {rrg_path} does not exist.")
+        exit(1)
 
-        run_time = (end_time - start_time) * 1000
-        print_verbose(f"Generating 3D RRG from Base RRG took {run_time:0.2f} ms")    
-    else:
-        if type_sb == "3d_cb" or type_sb == "2d" or type_sb == "3d_cb_out_only":
-            print_verbose(f"3D RRG not generated since type {type_sb} does not need a custom RRG, using base RRG")
-        else:
-            print_verbose(f"3D RRG previously generated at {original_dir + rrg_3d_path}")
+    if rrg_compression(found_path) is None:
+        return found_path
 
-    if type_sb == "3d_cb" or type_sb == "2d" or type_sb == "3d_cb_out_only":
-        # Copy Base RRG path into task script (only need base since 3D SBs are not used)
-        append_rrg_to_script(temp_dir + "/task" + script_path, original_dir + rrg_path)
+    start_time = time.time()
+    decompressed_path = decompress_rrg_file(found_path, temp_dir + "/rrg")
+    end_time = time.time()
 
-    else:
-        # Copy 3D RRG path into task script
-        append_rrg_to_script(temp_dir + "/task" + script_path, original_dir + rrg_3d_path)
+    run_time = (end_time - start_time) * 1000
+    print_verbose(f"Decompressing RRG {found_path} for VPR took {run_time:0.2f} ms")
 
+    return decompressed_path
 
+def get_run_artifact_paths(original_dir, params):
+    """
+    Paths of the modified arch, base RRG and 3D RRG a run of a sweep uses, as setup_flow names them.
 
-    if is_verilog_benchmarks:
-        # TODO: This is a bit sketchy, should make it more robust in the future to allow for multiple arch runs at the same time, no hard coding values
-        command = ["cp", temp_dir + "/task/config_templates/verilog_task.conf", temp_dir + "/task/config/task.conf"]
-        run_command_in_temp_dir(command, original_dir)
-    else:
-        # TODO: This is a bit sketchy, should make it more robust in the future to allow for multiple arch runs at the same time, no hard coding values
-        command = ["cp", temp_dir + "/task/config_templates/blif_task.conf", temp_dir + "/task/config/task.conf"]
-        run_command_in_temp_dir(command, original_dir)
+    Args:
+        original_dir (str): LaZagna root directory
+        params (dict): Run parameters, as given to run_interface
 
-    #append random seed to script
-    append_random_seed_to_script(temp_dir + "/task" + script_path, random_seed)
+    Returns:
+        tuple: (arch_base_file, arch_output_file_path, arch_output_file_name, rrg_path, rrg_3d_path). rrg_path and
+        rrg_3d_path are relative to original_dir, rrg_3d_path is in the RRG format of the run and None for the types
+        that give VPR the base RRG (3d_cb, 2d and 3d_cb_out_only)
+    """
+    type_sb = params['type_sb']
 
-    #append extra vpr options to script
-    if extra_vpr_options != "":
-        append_extra_vpr_option_to_script(temp_dir + "/task" + script_path, extra_vpr_options)
+    arch_base_file, arch_output_file_path, arch_output_file_name = get_arch_paths(original_dir, params['width'], params['height'], type_sb=type_sb, arch_file=params['arch_file'], vertical_delay_ratio=params['vertical_delay_ratio'], update_arch_delay=params['update_arch_delay'], sb_3d_switch_name=params['sb_switch_name'], base_delay_switch=params['base_delay_switch'], switch_interlayer_pairs=params['switch_interlayer_pairs'])
 
-    # Make tasks_run directory
-    #Output folder name based on parameters and time of run
-    curr_time = time.strftime("%Y-%m-%d_%H:%M:%S", time.localtime())
-    folder_name = "3d_" + type_sb + "_cw_" + output_file_name(channel_width=channel_width, width=width, height=height, percent_connectivity=percent_connectivity, place_algorithm=place_algorithm, connection_type=connection_type, run_num=run_num, additional_info=output_additional_info) + "_" + curr_time
-    os.makedirs(original_dir + "/tasks_run/" + folder_name, exist_ok=True)
-    return original_dir + "/tasks_run/" + folder_name
+    rrg_path = get_base_rrg_path(params['channel_width'], arch_output_file_name)
+
+    rrg_3d_path = None
+    if type_sb != "3d_cb" and type_sb != "2d" and type_sb != "3d_cb_out_only":
+        rrg_3d_path = get_3d_rrg_path(type_sb, params['channel_width'], params['percent_connectivity'], params['connection_type'], arch_output_file_name, vertical_connectivity=params['vertical_connectivity'], sb_input_pattern=params['sb_input_pattern'], sb_output_pattern=params['sb_output_pattern'], sb_location_pattern=params['sb_location_pattern'], sb_grid_csv_path=params['sb_grid_csv_path'], sb_location_seed=params.get('sb_location_seed', SB_LOCATION_SEED_DEFAULT), sb_switch_name=params['sb_switch_name'], sb_segment_name=params['sb_segment_name'])
+        rrg_3d_path = get_rrg_path_for_format(rrg_3d_path, params.get('rrg_format', "xml"))
+
+    return arch_base_file, arch_output_file_path, arch_output_file_name, rrg_path, rrg_3d_path
+
+def group_3d_rrgs_by_base_rrg(original_dir, run_params):
+    """
+    Find the 3D RRGs that the runs of a sweep need and that don't exist yet, grouped by the base RRG (and 3D SB switch
+    and segment) they are generated from, so each group can be made by a single 3D SB creator call.
+
+    Args:
+        original_dir (str): LaZagna root directory
+        run_params (list): Run parameter dictionaries, as given to run_interface
+
+    Returns:
+        list: One dictionary per base RRG, with the arguments of create_3d_rrg_group
+    """
+    groups = {}
+
+    for params in run_params:
+        arch_base_file, arch_output_file_path, arch_output_file_name, rrg_path, rrg_3d_path = get_run_artifact_paths(original_dir, params)
+        if rrg_3d_path is None or rrg_exists(original_dir + rrg_3d_path):
+            continue
+
+        compression = params.get('rrg_compression', "none")
+        key = (rrg_path, arch_base_file, params['sb_switch_name'], params['sb_segment_name'], compression)
+        if key not in groups:
+            groups[key] = {
+                "original_dir": original_dir,
+                "width": params['width'],
+                "height": params['height'],
+                "channel_width": params['channel_width'],
+                "arch_base_file": arch_base_file,
+                "arch_output_file_path": arch_output_file_path,
+                "rrg_path": rrg_path,
+                "vertical_delay_ratio": params['vertical_delay_ratio'],
+                "base_delay_switch": params['base_delay_switch'],
+                "switch_interlayer_pairs": params['switch_interlayer_pairs'],
+                "update_arch_delay": params['update_arch_delay'],
+                "sb_switch_name": params['sb_switch_name'],
+                "sb_segment_name": params['sb_segment_name'],
+                "rrg_compression": compression,
+                "variants": {}
+            }
+
+        variant = {
+            "output_path": original_dir + rrg_3d_path,
+            "percent_connectivity": params['percent_connectivity'],
+            "connection_type": params['connection_type'],
+            "vertical_connectivity_percentage": params['vertical_connectivity'],
+            "sb_location_pattern": params['sb_location_pattern'],
+        }
+
+        if params['sb_location_pattern'] == "custom":
+            variant["sb_grid_csv"] = params['sb_grid_csv_path']
+
+        if params['sb_location_pattern'] == "random":
+            variant["sb_location_seed"] = int(params.get('sb_location_seed', SB_LOCATION_SEED_DEFAULT))
+
+        if params['connection_type'] == "custom":
+            variant["sb_input_pattern"] = [int(x) for x in params['sb_input_pattern']]
+            variant["sb_output_pattern"] = [int(x) for x in params['sb_output_pattern']]
+
+        # Several runs (seeds, placement algorithms, ...) share the same 3D RRG, only generate it once
+        groups[key]["variants"][rrg_3d_path] = variant
+
+    for group in groups.values():
+        group["variants"] = list(group["variants"].values())
+
+    return list(groups.values())
+
+def create_3d_rrg_group(group):
+    """
+    Generate all the 3D RRGs of a group from group_3d_rrgs_by_base_rrg with one 3D SB creator call, so the base RRG is
+    only read once. The modified arch and base RRG of the group must exist (see plan_sweep).
+    """
+    original_dir = group['original_dir']
+
+    # Hold the locks of all the 3D RRGs of the group, the runs needing one of them wait for it instead of generating it
+    # again. Those generated by someone else meanwhile are left out
+    with artifact_locks([variant["output_path"] for variant in group['variants']]):
+        variants = [variant for variant in group['variants'] if not rrg_exists(variant["output_path"])]
+        if len(variants) == 0:
+            print_verbose(f"3D RRGs from Base RRG {original_dir + group['rrg_path']} previously generated")
+            return
+
+        start_time = time.time()
+        create_custom_3d_rrgs(group['rrg_path'], variants, original_dir, arch_file=group['arch_base_file'], sb_switch_name=group['sb_switch_name'], sb_segment_name=group['sb_segment_name'], compression=group['rrg_compression'])
+        end_time = time.time()
+
+    run_time = (end_time - start_time) * 1000
+    print_verbose(f"Generating {len(variants)} 3D RRGs from Base RRG {original_dir + group['rrg_path']} took {run_time:0.2f} ms")
 
 def create_base_rrg(original_dir:str, path_to_arch:str, channel_width=2, path_to_write_rrg="/base_rrg/rr_graph.xml", path_to_benchmark=and2_blif_path):
     
@@ -315,65 +578,161 @@ def create_base_rrg(original_dir:str, path_to_arch:str, channel_width=2, path_to
     
     run_command_in_temp_dir(command, original_dir, handle_error=False, verbose=False)
 
-def create_custom_3d_rrg(base_arch_path, output_file_path, original_dir, percent_connectivity=0.5, connection_type="subset", arch_file ="", vertical_connectivity=1, sb_switch_name="", sb_segment_name="", sb_input_pattern=[], sb_output_pattern=[], sb_location_pattern="repeated_interval", sb_grid_csv_path=""):
+def get_sb_generator(arch_file, sb_switch_name="", sb_segment_name=""):
+    """
+    Get a 3D SB generator for the given architecture and 3D SB switch and segment. The last generator is kept so the
+    3D RRGs made one after the other from the same architecture (and base RRG) reuse the parsed architecture and RRG.
+    """
+    global sb_generator, sb_generator_key
+
+    # Empty names use the creator's default 3D SB switch and segment
+    switch_name = sb_switch_name if sb_switch_name != "" else "3D_SB_switch"
+    segment_name = sb_segment_name if sb_segment_name != "" else "3D_SB_connection"
+
+    key = (os.path.abspath(arch_file), os.path.getmtime(arch_file), switch_name, segment_name)
+    if sb_generator is None or sb_generator_key != key:
+        sb_generator = SwitchBlockGenerator(arch_file, segment_name=segment_name, switch_name=switch_name)
+        sb_generator_key = key
+
+    return sb_generator
+
+def create_custom_3d_rrg(base_arch_path, output_file_path, original_dir, percent_connectivity=0.5, connection_type="subset", arch_file ="", vertical_connectivity=1, sb_switch_name="", sb_segment_name="", sb_input_pattern=[], sb_output_pattern=[], sb_location_pattern="repeated_interval", sb_grid_csv_path="", compression="none", sb_location_seed=SB_LOCATION_SEED_DEFAULT):
 
     # Make sure the output directory exists
     os.makedirs(os.path.dirname(original_dir + output_file_path), exist_ok=True)
 
-    command = ["python3", 
-               original_dir + "/scripts/3d_sb_creator.py",
-               "-f", original_dir + base_arch_path,
-               "-o", original_dir + output_file_path,
-               "-p", str(percent_connectivity),
-               "-c", connection_type,
-               "-a", arch_file,
-               "-vp", str(vertical_connectivity),
-               "--sb_location_pattern", sb_location_pattern,]
-
-    sb_grid_csv_string = ""
+    sb_grid_csv = ""
 
     if sb_location_pattern == "custom":
         if sb_grid_csv_path == "":
             print("ERROR: No custom SB grid CSV path provided.")
             exit(1)
         else:
+            sb_grid_csv = sb_grid_csv_path
 
-            command.append("--sb_grid_csv")
-            command.append(sb_grid_csv_path)
-
-    sb_input_pattern_string = ""
-    sb_output_pattern_string = ""
+    input_pattern = None
+    output_pattern = None
 
     if connection_type == "custom":
         if sb_input_pattern != []:
-            sb_input_pattern = [str(x) for x in sb_input_pattern]
-            command.append("--sb_input_pattern")
-            for x in sb_input_pattern:
-                command.append(str(x))
+            input_pattern = [int(x) for x in sb_input_pattern]
         else:
             print("ERROR: No input pattern provided for custom connection type.")
             exit(1)
         
         if sb_output_pattern != []:
-            sb_output_pattern = [str(x) for x in sb_output_pattern]
-            command.append("--sb_output_pattern")
-            for x in sb_output_pattern:
-                command.append(str(x))
+            output_pattern = [int(x) for x in sb_output_pattern]
         else:
             print("ERROR: No output pattern provided for custom connection type.")
             exit(1)
 
+    variant = SBVariant(
+        output_path=original_dir + output_file_path,
+        percent_connectivity=float(percent_connectivity),
+        connection_type=connection_type.lower(),
+        vertical_connectivity_percentage=float(vertical_connectivity),
+        sb_location_pattern=sb_location_pattern,
+        sb_grid_csv=sb_grid_csv,
+        sb_location_seed=int(sb_location_seed),
+        sb_input_pattern=input_pattern,
+        sb_output_pattern=output_pattern
+    )
+
+    generator = get_sb_generator(arch_file, sb_switch_name, sb_segment_name)
+    generator.load_rrg(find_rrg_file(original_dir + base_arch_path))
+    generator.generate([variant], compression=compression if compression != "none" else None, profile=True)
+
+def create_custom_3d_rrgs(base_arch_path, variants, original_dir, arch_file="", sb_switch_name="", sb_segment_name="", compression="none"):
+    """
+    Generate several 3D RRGs from the same base RRG, reading the base RRG only once.
 
-    if sb_switch_name != "":
-        command.append("--sb_3d_switch")
-        command.append(sb_switch_name)
+    Args:
+        base_arch_path (str): Path of the base RRG, relative to original_dir
+        variants (list): One dictionary per 3D RRG with the fields of SBVariant (output_path is absolute)
+        compression (str): "gzip" or "zstd" to compress each 3D RRG in the background once written, "none" to keep them uncompressed
+    """
+    sb_variants = []
+    for variant in variants:
+        os.makedirs(os.path.dirname(variant["output_path"]), exist_ok=True)
+        sb_variants.append(SBVariant(**{**variant, "connection_type": variant["connection_type"].lower()}))
 
-    if sb_segment_name != "":
-        command.append("--sb_3d_segment")
-        command.append(sb_segment_name)
+    generator = get_sb_generator(arch_file, sb_switch_name, sb_segment_name)
+    generator.load_rrg(find_rrg_file(original_dir + base_arch_path))
+    generator.generate(sb_variants, compression=compression if compression != "none" else None, profile=True)
 
-    
-    run_command_in_temp_dir(command, original_dir, verbose=True)
+def collect_3d_rrg_profiles(original_dir, rrg_groups, results_file="/results/3d_rrg_profiles.csv"):
+    """
+    Gather the profiles written next to the 3D RRGs of rrg_groups (see PhaseProfiler) into one CSV, one row per 3D RRG
+    and phase, so the time and memory of the 3D RRG generation can be compared across a sweep.
+
+    Args:
+        original_dir (str): LaZagna root directory
+        rrg_groups (list): Groups from group_3d_rrgs_by_base_rrg, once generated
+        results_file (str): Path of the CSV, relative to original_dir
+
+    Returns:
+        int: Number of profiles found
+    """
+    fields = ["output_path", "base_rrg", "num_sb_locations", "phase", "wall_s", "cpu_s", "children_cpu_s", "peak_rss_bytes", "children_rss_bytes", "nodes", "edges", "nodes_per_s", "edges_per_s"]
+    rows = []
+
+    for group in rrg_groups:
+        for variant in group['variants']:
+            path = profile_path(variant['output_path'])
+            if not os.path.exists(path):
+                print_verbose(f"No profile for 3D RRG {variant['output_path']}")
+                continue
+
+            try:
+                with open(path, "r") as infile:
+                    profile = json.load(infile)
+            except (OSError, ValueError) as e:
+                print(f"WARNING: Could not read the profile {path}: {e}")
+                continue
+
+            for phase in profile["phases"]:
+                row = {field: phase.get(field, "") for field in fields}
+                row.update(output_path=variant['output_path'], base_rrg=profile.get("base_rrg", ""), num_sb_locations=profile.get("num_sb_locations", ""), phase=phase["name"])
+                rows.append(row)
+
+    if len(rows) == 0:
+        return 0
+
+    os.makedirs(os.path.dirname(original_dir + results_file), exist_ok=True)
+    with open(original_dir + results_file, "w", newline="") as outfile:
+        writer = csv.DictWriter(outfile, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+    num_profiles = len({row["output_path"] for row in rows})
+    print_verbose(f"Wrote the profiles of {num_profiles} 3D RRGs to {original_dir + results_file}")
+    return num_profiles
+
+def get_finished_base_rrgs(original_dir, rrg_groups, run_params):
+    """
+    Base RRGs to compress once the 3D RRGs of rrg_groups are generated: those of groups with rrg_compression set, that
+    are still uncompressed and that no run gives to VPR directly (types 3d_cb, 2d and 3d_cb_out_only), so nothing
+    reads them anymore.
+
+    Returns:
+        list: (absolute base RRG path, compression) pairs
+    """
+    used_by_vpr = set()
+    for params in run_params:
+        rrg_path, rrg_3d_path = get_run_artifact_paths(original_dir, params)[3:]
+        if rrg_3d_path is None:
+            used_by_vpr.add(rrg_path)
+
+    base_rrgs = {}
+    for group in rrg_groups:
+        if group['rrg_compression'] == "none" or group['rrg_path'] in used_by_vpr:
+            continue
+
+        rrg_path = find_rrg_file(original_dir + group['rrg_path'])
+        if rrg_path is not None and rrg_compression(rrg_path) is None:
+            base_rrgs[rrg_path] = group['rrg_compression']
+
+    return list(base_rrgs.items())
 
 def copy_results(original_dir, task_result_path, results_path, result_name, temp_dir=""):
         
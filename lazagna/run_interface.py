@@ -5,10 +5,12 @@ from concurrent.futures import ThreadPoolExecutor
 import random
 from script_editing import update_config_simple, update_config_verilog
 from run_flow import *
+from sb_locations import SB_LOCATION_SEED_DEFAULT
+from runtime_history import RuntimeHistory, RUNTIME_HISTORY_FILE, benchmark_runtime_args
 from printing import print_verbose
 import printing
 
-def run_one_benchmark(i, blif_file="", verilog_file="", act_file="", original_dir="", width="", height="", channel_width="", type_sb="full", percent_connectivity=0.5, place_algorithm="cube_bb", verilog_benchmarks=False, connection_type="subset", benchmark_top_name="", output_folder_name="", run_number=1, output_additional_info="", temp_template_dir=""):
+def run_one_benchmark(i, blif_file="", verilog_file="", act_file="", original_dir="", width="", height="", channel_width="", type_sb="full", percent_connectivity=0.5, place_algorithm="cube_bb", verilog_benchmarks=False, connection_type="subset", benchmark_top_name="", output_folder_name="", run_number=1, output_additional_info="", temp_template_dir="", requeue_on_oom=False):
     with tempfile.TemporaryDirectory() as temp_dir:
         temp_task_dir = os.path.join(temp_dir, "task")
         # copy config
@@ -35,12 +37,16 @@ def run_one_benchmark(i, blif_file="", verilog_file="", act_file="", original_di
         print_verbose(f"Running Benchmark: {i} {extract_file_name(verilog_file)} with Width: {width}, Height: {height}, Channel Width: {channel_width}")
 
         start_time = time.time()
-        run_flow(original_dir=original_dir, width=width, height=height, channel_width=channel_width, benchmark_name=extract_file_name(verilog_file), temp_dir=temp_task_dir, type_sb=type_sb, percent_connectivity=percent_connectivity, place_algorithm=place_algorithm, connection_type=connection_type, run_num=run_number, output_additional_info=output_additional_info)
+        status = run_flow(original_dir=original_dir, width=width, height=height, channel_width=channel_width, benchmark_name=extract_file_name(verilog_file), temp_dir=temp_task_dir, type_sb=type_sb, percent_connectivity=percent_connectivity, place_algorithm=place_algorithm, connection_type=connection_type, run_num=run_number, output_additional_info=output_additional_info, requeue_on_oom=requeue_on_oom)
         end_time = time.time()
 
         elapsed_time_ms = (end_time - start_time) * 1000
         print_verbose(f"\tBenchmark {extract_file_name(verilog_file)} took {elapsed_time_ms:.2f} ms")
 
+        # The run is done again, only keep the task of the last one
+        if status["requeue"]:
+            return status
+
         # Make sure tasks_run folder exists
         os.makedirs(original_dir + "/tasks_run", exist_ok=True)
 
@@ -76,6 +82,8 @@ def run_one_benchmark(i, blif_file="", verilog_file="", act_file="", original_di
         command = ["cp", "-r", temp_task_dir, output_folder_name + "/task_" + extract_file_name(verilog_file)]
         run_command_in_temp_dir(command, original_dir)
 
+        return status
+
 ITD_paper_top_modules = {
                          "attention_layer.v":"attention_layer",
                          "bnn.v":"bnn",
@@ -169,108 +177,131 @@ VTR_benchmarks_top_modules = {"arm_core.v":"arm_core",
                               "tpu.16x16.int8.v":"top",
                               "tpu.32x32.int8.v":"top"}
 
-def run_interface(params):
-    """Run the interface with parameters from a dictionary."""
-
-    expected_params = [
-        'original_dir', 'width', 'height', 'channel_width', 'type_sb',
-        'percent_connectivity', 'place_algorithm', 'is_verilog_benchmarks',
-        'connection_type', 'arch_file', 'seed', 'run_num',
-        'additional_vpr_options', 'cur_loop_identifier', 'blif_files',
-        'verilog_files', 'act_files', 'top_module_names', 'vertical_connectivity',
-        'sb_switch_name', 'sb_segment_name', 'sb_input_pattern',
-        'sb_output_pattern', 'sb_location_pattern', 'sb_grid_csv_path',
-        'vertical_delay_ratio', 'base_delay_switch', 'switch_interlayer_pairs',
-        'update_arch_delay', 'num_task_workers'
-    ]
-    # Check if all expected parameters are present
-    
+# Parameters every run (from get_run_params_from_yaml) must have
+expected_params = [
+    'original_dir', 'width', 'height', 'channel_width', 'type_sb',
+    'percent_connectivity', 'place_algorithm', 'is_verilog_benchmarks',
+    'connection_type', 'arch_file', 'seed', 'run_num',
+    'additional_vpr_options', 'cur_loop_identifier', 'blif_files',
+    'verilog_files', 'act_files', 'top_module_names', 'vertical_connectivity',
+    'sb_switch_name', 'sb_segment_name', 'sb_input_pattern',
+    'sb_output_pattern', 'sb_location_pattern', 'sb_grid_csv_path',
+    'vertical_delay_ratio', 'base_delay_switch', 'switch_interlayer_pairs',
+    'update_arch_delay'
+]
+
+def check_run_params(params, expected_params=expected_params):
+    """Whether params has all the expected parameters, the missing ones are printed"""
     missing_params = [param for param in expected_params if param not in params]
 
     if len(missing_params) > 0:
         print(f"ERROR: Missing parameters: {', '.join(missing_params)}")
-        return
+        return False
+
+    return True
+
+def setup_run(params, temp_dir):
+    """
+    Set up the task template of a run in temp_dir (see setup_flow), that all of its benchmarks copy.
+
+    Returns:
+        tuple: (task_run_folder, output_identifier), given to run_one_benchmark through benchmark_run_args
+    """
+    task_run_folder = setup_flow(
+        original_dir=params['original_dir'],
+        width=params['width'],
+        height=params['height'],
+        channel_width=params['channel_width'],
+        type_sb=params['type_sb'],
+        percent_connectivity=params['percent_connectivity'],
+        place_algorithm=params['place_algorithm'],
+        is_verilog_benchmarks=params['is_verilog_benchmarks'],
+        connection_type=params['connection_type'],
+        arch_file=params['arch_file'],
+        random_seed=params['seed'],
+        run_num=params['run_num'],
+        extra_vpr_options=params['additional_vpr_options'],
+        output_additional_info=params['cur_loop_identifier'],
+        temp_dir=temp_dir,
+        vertical_connectivity=params['vertical_connectivity'],
+        sb_switch_name=params['sb_switch_name'],
+        sb_segment_name=params['sb_segment_name'],
+        sb_input_pattern=params['sb_input_pattern'],
+        sb_output_pattern=params['sb_output_pattern'],
+        sb_location_pattern=params['sb_location_pattern'],
+        sb_grid_csv_path=params['sb_grid_csv_path'],
+        vertical_delay_ratio=params['vertical_delay_ratio'],
+        sb_3d_switch_name=params['sb_switch_name'],
+        base_delay_switch=params['base_delay_switch'],
+        switch_interlayer_pairs=params['switch_interlayer_pairs'],
+        update_arch_delay=params['update_arch_delay'],
+        rrg_format=params.get('rrg_format', "xml"),
+        compression=params.get('rrg_compression', "none"),
+        sb_location_seed=params.get('sb_location_seed', SB_LOCATION_SEED_DEFAULT)
+    )
+
+    output_identifier = params['cur_loop_identifier']
+
+    print_verbose(f"Task run folder created: {task_run_folder}")
+
+    if params['connection_type'] == 'custom':
+        output_identifier = params['cur_loop_identifier'] + "_custom"
+        output_identifier += "_input_" + str(params['sb_input_pattern']).replace("_","")
+        output_identifier += "_output_" + str(params['sb_output_pattern']).replace("_","")
+
+    if params['sb_location_pattern'] == "custom":
+        output_identifier += "_location_" + str(params['sb_location_pattern']).replace("_","")
+        output_identifier += "_grid_csv_path_" + os.path.basename(params['sb_grid_csv_path']).split(".")[0] 
+
+    if params['sb_location_pattern'] == "random":
+        output_identifier += "_location_" + str(params['sb_location_pattern']).replace("_","")
+        output_identifier += "_seed_" + str(params.get('sb_location_seed', SB_LOCATION_SEED_DEFAULT))
+
+    return task_run_folder, output_identifier
+
+def benchmark_run_args(params, i, task_run_folder, output_identifier, temp_template_dir):
+    """Keyword arguments of run_one_benchmark for benchmark i of a run set up by setup_run in temp_template_dir"""
+    return dict(
+        blif_file=params['blif_files'][i],                                # blif file path
+        verilog_file=params['verilog_files'][i],                          # verilog file path
+        act_file=params['act_files'][i],                                   # activity file path
+        original_dir=params['original_dir'],                              # original directory
+        width=params['width'],                                            # width parameter
+        height=params['height'],                                          # height parameter
+        channel_width=params['channel_width'],                            # channel width
+        type_sb=params['type_sb'],                                        # switch block type
+        percent_connectivity=params['percent_connectivity'],              # connectivity percentage
+        place_algorithm=params['place_algorithm'],                        # placement algorithm
+        verilog_benchmarks=params['is_verilog_benchmarks'],              # using verilog benchmarks?
+        connection_type=params['connection_type'],                        # connection type
+        benchmark_top_name=params['top_module_names'].get(os.path.basename(params['verilog_files'][i]), ""), # top module name
+        output_folder_name=task_run_folder,                                # output folder
+        run_number=params['run_num'],                                     # run number
+        output_additional_info=output_identifier,             # additional info
+        temp_template_dir=temp_template_dir                                # template directory
+    )
 
+def run_interface(params):
+    """Run the interface with parameters from a dictionary."""
 
+    # Check if all expected parameters are present
+    if not check_run_params(params, expected_params + ['num_task_workers']):
+        return
 
     with tempfile.TemporaryDirectory() as outer_temp_dir:
         # Setup flow using params dictionary
-        task_run_folder = setup_flow(
-            original_dir=params['original_dir'],
-            width=params['width'],
-            height=params['height'],
-            channel_width=params['channel_width'],
-            type_sb=params['type_sb'],
-            percent_connectivity=params['percent_connectivity'],
-            place_algorithm=params['place_algorithm'],
-            is_verilog_benchmarks=params['is_verilog_benchmarks'],
-            connection_type=params['connection_type'],
-            arch_file=params['arch_file'],
-            random_seed=params['seed'],
-            run_num=params['run_num'],
-            extra_vpr_options=params['additional_vpr_options'],
-            output_additional_info=params['cur_loop_identifier'],
-            temp_dir=outer_temp_dir,
-            vertical_connectivity=params['vertical_connectivity'],
-            sb_switch_name=params['sb_switch_name'],
-            sb_segment_name=params['sb_segment_name'],
-            sb_input_pattern=params['sb_input_pattern'],
-            sb_output_pattern=params['sb_output_pattern'],
-            sb_location_pattern=params['sb_location_pattern'],
-            sb_grid_csv_path=params['sb_grid_csv_path'],
-            vertical_delay_ratio=params['vertical_delay_ratio'],
-            sb_3d_switch_name=params['sb_switch_name'],
-            base_delay_switch=params['base_delay_switch'],
-            switch_interlayer_pairs=params['switch_interlayer_pairs'],
-            update_arch_delay=params['update_arch_delay']
-        )
-
-        output_identifier = params['cur_loop_identifier']
-
-        print_verbose(f"Task run folder created: {task_run_folder}")
-
-        if params['connection_type'] == 'custom':
-            output_identifier = params['cur_loop_identifier'] + "_custom"
-            output_identifier += "_input_" + str(params['sb_input_pattern']).replace("_","")
-            output_identifier += "_output_" + str(params['sb_output_pattern']).replace("_","")
-
-        if params['sb_location_pattern'] == "custom":
-            output_identifier += "_location_" + str(params['sb_location_pattern']).replace("_","")
-            output_identifier += "_grid_csv_path_" + os.path.basename(params['sb_grid_csv_path']).split(".")[0] 
-
-        if params['sb_location_pattern'] == "random":
-            output_identifier += "_location_" + str(params['sb_location_pattern']).replace("_","")
-
-        
+        task_run_folder, output_identifier = setup_run(params, outer_temp_dir)
 
         # Parallelized up to n workers
         max_workers = params['num_task_workers']
+        # Longest benchmarks first, so the last ones to start are short
+        runtime_history = RuntimeHistory(params['original_dir'] + RUNTIME_HISTORY_FILE)
+        benchmark_order = sorted(range(len(params['blif_files'])), key=lambda i: -runtime_history.estimate(*benchmark_runtime_args(params['original_dir'], params, i)))
+
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             futures = []
-            for i in range(len(params['blif_files'])):
-                futures.append(
-                    executor.submit(
-                        run_one_benchmark,
-                        i,                                                                 # benchmark index
-                        blif_file=params['blif_files'][i],                                # blif file path
-                        verilog_file=params['verilog_files'][i],                          # verilog file path
-                        act_file=params['act_files'][i],                                   # activity file path
-                        original_dir=params['original_dir'],                              # original directory
-                        width=params['width'],                                            # width parameter
-                        height=params['height'],                                          # height parameter
-                        channel_width=params['channel_width'],                            # channel width
-                        type_sb=params['type_sb'],                                        # switch block type
-                        percent_connectivity=params['percent_connectivity'],              # connectivity percentage
-                        place_algorithm=params['place_algorithm'],                        # placement algorithm
-                        verilog_benchmarks=params['is_verilog_benchmarks'],              # using verilog benchmarks?
-                        connection_type=params['connection_type'],                        # connection type
-                        benchmark_top_name=params['top_module_names'].get(os.path.basename(params['verilog_files'][i]), ""), # top module name
-                        output_folder_name=task_run_folder,                                # output folder
-                        run_number=params['run_num'],                                     # run number
-                        output_additional_info=output_identifier,             # additional info
-                        temp_template_dir=outer_temp_dir                                   # template directory
-                    )
-                )
+            for i in benchmark_order:
+                futures.append(executor.submit(run_one_benchmark, i, **benchmark_run_args(params, i, task_run_folder, output_identifier, outer_temp_dir)))
 
             for future in futures:
                 future.result()
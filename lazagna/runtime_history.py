@@ -0,0 +1,69 @@
+import os
+from artifact_store import load_versioned_json, save_versioned_json
+from file_handling import extract_file_name
+from run_flow import get_run_artifact_paths
+
+# TotalRunTime of past benchmark runs, relative to the LaZagna root directory
+RUNTIME_HISTORY_FILE = "/results/runtime_history.json"
+
+# Version of the runtime history layout, histories of another version are ignored
+RUNTIME_HISTORY_VERSION = 1
+
+def runtime_key(benchmark_name, arch_name, channel_width, type_sb):
+    return f"{benchmark_name}|{arch_name}|{channel_width}|{type_sb}"
+
+def benchmark_runtime_args(original_dir, params, i):
+    """
+    Arguments of RuntimeHistory.estimate and RuntimeHistory.record for benchmark i of a config. The arch is the
+    modified arch the config runs on, whose name covers the device size and the arch template.
+    """
+    arch_output_file_name = get_run_artifact_paths(original_dir, params)[2]
+    return extract_file_name(params['verilog_files'][i]), os.path.splitext(arch_output_file_name)[0], int(params['channel_width']), params['type_sb'], os.path.getsize(params['blif_files'][i])
+
+class RuntimeHistory:
+    """
+    TotalRunTime of the runs of each (benchmark, arch, channel width, type_sb), kept across sweeps in a JSON file so the
+    scheduler can start the longest runs first.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.runs = {}
+
+        history = load_versioned_json(path, RUNTIME_HISTORY_VERSION, "runtime history")
+        if history is not None:
+            self.runs = history["runs"]
+
+    def estimate(self, benchmark_name, arch_name, channel_width, type_sb, benchmark_bytes):
+        """
+        Projected TotalRunTime of a run. A benchmark run before on another arch, channel width or type_sb takes the mean
+        of those runs, the design matters far more than the device. A benchmark never run before is estimated from the
+        size of its file at the TotalRunTime per byte of all the runs so far, or by its size alone without any, which still
+        orders the benchmarks never run before largest first.
+        """
+        key = runtime_key(benchmark_name, arch_name, channel_width, type_sb)
+        if key in self.runs:
+            return self.runs[key]["total_run_time"]
+
+        same_benchmark = [run["total_run_time"] for other_key, run in self.runs.items() if other_key.split("|")[0] == benchmark_name]
+        if len(same_benchmark) > 0:
+            return sum(same_benchmark) / len(same_benchmark)
+
+        total_bytes = sum(run["benchmark_bytes"] for run in self.runs.values())
+        if total_bytes > 0:
+            return benchmark_bytes * sum(run["total_run_time"] for run in self.runs.values()) / total_bytes
+        return benchmark_bytes
+
+    def record(self, benchmark_name, arch_name, channel_width, type_sb, benchmark_bytes, total_run_time):
+        """Keep the mean TotalRunTime of the runs, runs without results (a TotalRunTime of None) are left out"""
+        if total_run_time is None:
+            return
+
+        key = runtime_key(benchmark_name, arch_name, channel_width, type_sb)
+        run = self.runs.setdefault(key, {"total_run_time": 0.0, "num_runs": 0})
+        run["total_run_time"] = (run["total_run_time"] * run["num_runs"] + total_run_time) / (run["num_runs"] + 1)
+        run["num_runs"] += 1
+        run["benchmark_bytes"] = benchmark_bytes
+
+    def save(self):
+        save_versioned_json(self.path, RUNTIME_HISTORY_VERSION, {"runs": self.runs})
@@ -0,0 +1,159 @@
+import os
+from collections import OrderedDict
+import numpy as np
+
+SB_LOCATION_PATTERNS = ["repeated_interval", "random", "custom", "core", "perimeter", "rows", "columns"]
+
+# Seed of the random pattern when none is given. Only the random pattern uses the seed
+SB_LOCATION_SEED_DEFAULT = 1
+
+# Number of masks kept by sb_location_mask, the least recently used ones are dropped past it
+SB_LOCATION_CACHE_SIZE = 64
+
+sb_location_cache = OrderedDict()
+
+def repeated_interval_mask(grid_x, grid_y, percent):
+    """Evenly spaced locations over the grid, taken in x-major order"""
+    mask = np.zeros((grid_x + 1, grid_y + 1), dtype=bool)
+    true_count = round(mask.size * percent)
+    mask.flat[np.linspace(0, mask.size - 1, true_count, dtype=int)] = True
+    return mask
+
+def random_mask(grid_x, grid_y, percent, seed):
+    """Locations picked at random with a generator seeded with seed, so the same seed always gives the same locations"""
+    mask = np.zeros((grid_x + 1, grid_y + 1), dtype=bool)
+    num_to_keep = int(mask.size * percent)
+    mask.flat[np.random.default_rng(seed).choice(mask.size, num_to_keep, replace=False)] = True
+    return mask
+
+def rows_mask(grid_x, grid_y, percent):
+    """Every location of evenly spaced rows, at least one"""
+    mask = np.zeros((grid_x + 1, grid_y + 1), dtype=bool)
+    rows_to_select = max(1, round((grid_y + 1) * percent))
+    mask[:, np.linspace(0, grid_y, rows_to_select, dtype=int)] = True
+    return mask
+
+def columns_mask(grid_x, grid_y, percent):
+    """Every location of evenly spaced columns, at least one"""
+    mask = np.zeros((grid_x + 1, grid_y + 1), dtype=bool)
+    cols_to_select = max(1, round((grid_x + 1) * percent))
+    mask[np.linspace(0, grid_x, cols_to_select, dtype=int), :] = True
+    return mask
+
+def chebyshev_distances(grid_x, grid_y):
+    """Chebyshev distance (max of |x - center_x| and |y - center_y|) of every location from the center of the grid"""
+    x = np.abs(np.arange(grid_x + 1) - grid_x // 2)
+    y = np.abs(np.arange(grid_y + 1) - grid_y // 2)
+    return np.maximum(x[:, None], y[None, :])
+
+def core_mask(grid_x, grid_y, percent):
+    """
+    A square-shaped core from the center of the grid, expanding outward. Locations at the same distance from the center
+    are taken in x-major order
+    """
+    distances = chebyshev_distances(grid_x, grid_y).ravel()
+    mask = np.zeros((grid_x + 1, grid_y + 1), dtype=bool)
+    elements_to_include = round(mask.size * percent)
+    mask.flat[np.lexsort((np.arange(mask.size), distances))[:elements_to_include]] = True
+    return mask
+
+def perimeter_mask(grid_x, grid_y, percent):
+    """
+    A square-shaped perimeter around the grid, moving inward. Locations at the same distance from the center are taken
+    in reverse x-major order
+    """
+    distances = chebyshev_distances(grid_x, grid_y).ravel()
+    mask = np.zeros((grid_x + 1, grid_y + 1), dtype=bool)
+    elements_to_include = round(mask.size * percent)
+    mask.flat[np.lexsort((-np.arange(mask.size), -distances))[:elements_to_include]] = True
+    return mask
+
+def custom_mask(file_path, grid_x, grid_y):
+    '''
+        Function to read the SB locations if user specifies custom SB location using CSV file.
+        The bottom left corner of the grid is (0, 0) and the top right corner is (width-1, height-1).
+        The Y direction is vertical and the X direction is horizontal.
+
+        The csv file only contains the SB locations, with "x" indicating a SB location and "o" indicating no SB location.
+
+        An example csv file contents for a 4x4 grid:
+        ```
+            o,o,o,o
+            o,o,x,o
+            o,x,o,o
+            o,o,o,o
+        ```
+
+    '''
+    mask = np.zeros((grid_x + 1, grid_y + 1), dtype=bool)
+    with open(file_path, 'r') as file:
+        # Read all lines
+        lines = file.readlines()
+        # Reverse the lines to make bottom row y=0
+        lines.reverse()
+
+        if len(lines) != grid_y + 1:
+            print("Error: The number of rows in the CSV file does not match the grid size of the FPGA.")
+            exit(1)
+
+        for y, line in enumerate(lines):
+            # Split the line by comma and remove whitespace/newlines
+            row = [cell.strip() for cell in line.split(',')]
+
+            if len(row) != grid_x + 1:
+                print("Error: The number of columns in the CSV file does not match the grid size of the FPGA.")
+                exit(1)
+
+            mask[:, y] = np.array(row) == 'x'
+    return mask
+
+def sb_location_mask(grid_x, grid_y, percent, pattern_type="repeated_interval", sb_grid_csv="", seed=SB_LOCATION_SEED_DEFAULT):
+    """
+    Boolean mask of shape (grid_x + 1, grid_y + 1) of the SB locations of a pattern, True where there is a 3D SB.
+
+    Masks are cached by (pattern, grid, percent, seed), the seed only being part of the key for the random pattern and
+    custom patterns being keyed by their CSV and its modification time. The returned mask is read-only as it is shared
+    with later calls.
+    """
+    if pattern_type not in SB_LOCATION_PATTERNS:
+        print(f"ERROR: Unknown SB location pattern {pattern_type}.")
+        exit(1)
+
+    if not 0 <= percent <= 1:
+        print(f"ERROR: The SB connectivity percentage must be between 0 and 1 (inclusive), not {percent}.")
+        exit(1)
+
+    if pattern_type == "custom":
+        key = (pattern_type, grid_x, grid_y, os.path.abspath(sb_grid_csv), os.path.getmtime(sb_grid_csv))
+    else:
+        key = (pattern_type, grid_x, grid_y, percent, seed if pattern_type == "random" else None)
+
+    if key in sb_location_cache:
+        sb_location_cache.move_to_end(key)
+        return sb_location_cache[key]
+
+    if pattern_type == "repeated_interval":
+        mask = repeated_interval_mask(grid_x, grid_y, percent)
+    elif pattern_type == "random":
+        mask = random_mask(grid_x, grid_y, percent, seed)
+    elif pattern_type == "rows":
+        mask = rows_mask(grid_x, grid_y, percent)
+    elif pattern_type == "columns":
+        mask = columns_mask(grid_x, grid_y, percent)
+    elif pattern_type == "core":
+        mask = core_mask(grid_x, grid_y, percent)
+    elif pattern_type == "perimeter":
+        mask = perimeter_mask(grid_x, grid_y, percent)
+    else:
+        mask = custom_mask(sb_grid_csv, grid_x, grid_y)
+
+    mask.flags.writeable = False
+    sb_location_cache[key] = mask
+    if len(sb_location_cache) > SB_LOCATION_CACHE_SIZE:
+        sb_location_cache.popitem(last=False)
+
+    return mask
+
+def sb_location_array(grid_x, grid_y, percent, pattern_type="repeated_interval", sb_grid_csv="", seed=SB_LOCATION_SEED_DEFAULT):
+    """The SB locations of a pattern (see sb_location_mask) as an (N, 2) array of (x, y), in x-major order"""
+    return np.argwhere(sb_location_mask(grid_x, grid_y, percent, pattern_type, sb_grid_csv, seed))
@@ -1,4 +1,17 @@
-def append_rrg_to_script(script_path, rrg_path):
+import os
+
+def get_rrg_path_for_format(rrg_path, rrg_format="xml"):
+    """
+    Path of the RRG in the given format, "xml" or "bin" (VPR's binary Cap'n Proto format). VPR picks the format from the
+    extension, binary RRGs are kept next to the XML ones with a .bin extension.
+    """
+    if rrg_format == "bin":
+        return os.path.splitext(rrg_path)[0] + ".bin"
+    return rrg_path
+
+def append_rrg_to_script(script_path, rrg_path, rrg_format="xml"):
+    rrg_path = get_rrg_path_for_format(rrg_path, rrg_format)
+
     with open(script_path, 'r') as file:
         lines = file.readlines()
 
@@ -0,0 +1,169 @@
+import heapq
+import os
+from collections import namedtuple
+from concurrent.futures import wait, FIRST_COMPLETED
+from functools import partial
+import psutil
+from printing import print_verbose
+from run_flow import get_run_artifact_paths, group_3d_rrgs_by_base_rrg, generate_modified_arch, generate_base_rrg, create_3d_rrg_group, rrg_exists
+
+# A node of the DAG of a sweep. name is (kind, id) with kind one of TASK_PRIORITIES. run is called in a worker once all
+# the tasks named in prerequisites are done, with the results of the tasks named in inputs as arguments
+SweepTask = namedtuple("SweepTask", ["name", "run", "prerequisites", "inputs"], defaults=[()])
+
+# Order in which ready tasks start, lowest first: the artifacts runs wait on go before the runs, and base RRGs (a VPR
+# run each) before the 3D RRGs of base RRGs already built. The setups of the runs and their benchmarks share a
+# priority, so they start longest first (a setup counting as the longest benchmark of its run), then in planning order
+TASK_PRIORITIES = {"arch": 0, "base_rrg": 1, "rrg_3d": 2, "setup": 3, "benchmark": 3}
+
+# Seconds between two checks of the available memory while tasks are held back for memory
+MEMORY_RECHECK_S = 10
+
+def plan_sweep(original_dir, run_params, setup_job, benchmark_job):
+    """
+    Expand a sweep into a DAG of tasks: the modified archs, the base RRGs built from them, the 3D RRGs generated from
+    the base RRGs (one task per group of group_3d_rrgs_by_base_rrg, so each base RRG is read once), the setup of each
+    run after the artifacts it uses, and one task per (run, benchmark) after the setup of its run. Artifacts shared by
+    several runs get a single task, those that already exist none.
+
+    Args:
+        original_dir (str): LaZagna root directory
+        run_params (list): Run parameter dictionaries, as given to run_interface
+        setup_job (function): Called with the parameters of a run to set it up
+        benchmark_job (function): Called with the parameters of a run, the index of a benchmark and the result of
+            setup_job for the run to run the benchmark
+
+    Returns:
+        tuple: (dictionary of the SweepTasks by name, in planning order, list of the 3D RRG groups, indexed by the id of
+        their rrg_3d tasks)
+    """
+    tasks = {}
+
+    rrg_groups = group_3d_rrgs_by_base_rrg(original_dir, run_params)
+    rrg_3d_tasks = {}
+    for index, group in enumerate(rrg_groups):
+        for variant in group['variants']:
+            rrg_3d_tasks[variant["output_path"]] = ("rrg_3d", index)
+
+    for index, params in enumerate(run_params):
+        arch_base_file, arch_output_file_path, arch_output_file_name, rrg_path, rrg_3d_path = get_run_artifact_paths(original_dir, params)
+
+        arch_task = ("arch", arch_output_file_path)
+        if arch_task not in tasks and not os.path.exists(arch_output_file_path):
+            tasks[arch_task] = SweepTask(arch_task, partial(generate_modified_arch, original_dir, arch_base_file, arch_output_file_path, params['width'], params['height'], vertical_delay_ratio=params['vertical_delay_ratio'], sb_3d_switch_name=params['sb_switch_name'], base_delay_switch=params['base_delay_switch'], switch_interlayer_pairs=params['switch_interlayer_pairs'], update_arch_delay=params['update_arch_delay']), [])
+
+        base_rrg_task = ("base_rrg", rrg_path)
+        if base_rrg_task not in tasks and not rrg_exists(original_dir + rrg_path):
+            relative_arch_path = "/" + os.path.relpath(arch_output_file_path, original_dir)
+            tasks[base_rrg_task] = SweepTask(base_rrg_task, partial(generate_base_rrg, original_dir, relative_arch_path, params['channel_width'], rrg_path), [name for name in [arch_task] if name in tasks])
+
+        prerequisites = [name for name in [arch_task, base_rrg_task] if name in tasks]
+
+        if rrg_3d_path is not None and original_dir + rrg_3d_path in rrg_3d_tasks:
+            rrg_3d_task = rrg_3d_tasks[original_dir + rrg_3d_path]
+            if rrg_3d_task not in tasks:
+                tasks[rrg_3d_task] = SweepTask(rrg_3d_task, partial(create_3d_rrg_group, rrg_groups[rrg_3d_task[1]]), list(prerequisites))
+            prerequisites.append(rrg_3d_task)
+
+        setup_task = ("setup", index)
+        tasks[setup_task] = SweepTask(setup_task, partial(setup_job, params), prerequisites)
+
+        for i in range(len(params['blif_files'])):
+            benchmark_task = ("benchmark", (index, i))
+            tasks[benchmark_task] = SweepTask(benchmark_task, partial(benchmark_job, params, i), [setup_task], [setup_task])
+
+    return tasks, rrg_groups
+
+def run_sweep(tasks, executor, max_workers, on_done=None, memory_estimate=None, memory_budget=None, runtime_estimate=None):
+    """
+    Run the tasks of plan_sweep on executor, each as soon as its prerequisites are done. All the workers share one queue
+    of ready tasks, so a worker that frees up takes the next task of the whole sweep (whatever run it belongs to) and
+    no worker idles while any benchmark is waiting. At most max_workers tasks are given to executor at a time, so a
+    ready artifact is never queued behind runs that are not started yet (ready tasks start by TASK_PRIORITIES, then
+    longest runtime_estimate first, then in planning order). Starting the longest runs first keeps a huge benchmark
+    from starting last and running alone long after the others are done.
+
+    With a memory_budget, a task only starts if the memory_estimate of the running tasks plus its own fits the budget
+    and its own fits the memory available now. A task that doesn't fit reserves its estimate, so the smaller tasks
+    after it can't keep it waiting forever. When nothing is running the next task always starts.
+
+    Args:
+        tasks (dict): SweepTasks by name, see plan_sweep
+        executor (Executor): Runs the tasks
+        max_workers (int): Number of tasks running at the same time
+        on_done (function): Called in this process with the name and result of every task as it finishes. If it
+            returns a SweepTask, that task is run in place of the finished one, which isn't done yet
+        memory_estimate (function): Projected peak memory of a task, in bytes, by name
+        memory_budget (int): Memory the running tasks may take together, in bytes
+        runtime_estimate (function): Projected runtime of a task, by name, only compared between tasks
+
+    Returns:
+        dict: The result of every task, by name
+    """
+    tasks = dict(tasks)
+    order = {name: index for index, name in enumerate(tasks)}
+    dependents = {name: [] for name in tasks}
+    num_waiting_on = {}
+    for name, task in tasks.items():
+        num_waiting_on[name] = len(task.prerequisites)
+        for prerequisite in task.prerequisites:
+            dependents[prerequisite].append(name)
+
+    def ready_entry(name):
+        return (TASK_PRIORITIES[name[0]], -runtime_estimate(name) if runtime_estimate is not None else 0, order[name], name)
+
+    ready = [ready_entry(name) for name in tasks if num_waiting_on[name] == 0]
+    heapq.heapify(ready)
+
+    running = {}
+    running_memory = {}
+    results = {}
+
+    while len(ready) > 0 or len(running) > 0:
+        reserved_memory = 0
+        waiting_for_memory = []
+        while len(ready) > 0 and len(running) < max_workers:
+            entry = heapq.heappop(ready)
+            name = entry[-1]
+
+            estimate = memory_estimate(name) if memory_estimate is not None else 0
+            if memory_budget is not None and len(running) > 0 and estimate > 0:
+                projected = sum(running_memory.values()) + reserved_memory + estimate
+                if projected > memory_budget or estimate > psutil.virtual_memory().available:
+                    print_verbose(f"Holding {name[0]} task {name[1]} back, it needs {estimate / 1024 ** 3:0.2f} GB and {projected / 1024 ** 3:0.2f} GB of the {memory_budget / 1024 ** 3:0.2f} GB budget would be in use")
+                    reserved_memory += estimate
+                    waiting_for_memory.append(entry)
+
+                    # Nothing after it can fit anymore
+                    if reserved_memory >= memory_budget:
+                        break
+                    continue
+
+            print_verbose(f"Starting {name[0]} task {name[1]}")
+            future = executor.submit(tasks[name].run, *[results[input_name] for input_name in tasks[name].inputs])
+            running[future] = name
+            running_memory[future] = estimate
+
+        for entry in waiting_for_memory:
+            heapq.heappush(ready, entry)
+
+        # Tasks held back for memory also start once memory is freed by something else than the sweep
+        done, _ = wait(running, timeout=MEMORY_RECHECK_S if len(waiting_for_memory) > 0 else None, return_when=FIRST_COMPLETED)
+        for future in done:
+            name = running.pop(future)
+            del running_memory[future]
+            result = future.result()
+
+            retry = on_done(name, result) if on_done is not None else None
+            if retry is not None:
+                tasks[name] = retry
+                heapq.heappush(ready, ready_entry(name))
+                continue
+
+            results[name] = result
+            for dependent in dependents[name]:
+                num_waiting_on[dependent] -= 1
+                if num_waiting_on[dependent] == 0:
+                    heapq.heappush(ready, ready_entry(dependent))
+
+    return results
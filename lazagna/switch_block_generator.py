@@ -0,0 +1,1941 @@
+from lxml import etree
+from collections import namedtuple, defaultdict, deque
+import time
+import numpy as np
+import tempfile
+import shutil
+import os
+import array
+import errno
+import io
+import zipfile
+import json
+import re
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from printing import print_verbose
+from artifact_store import atomic_write
+from rrg_binary import is_binary_rrg_path, load_rrg_schema, write_rrg_binary
+from rrg_compression import rrg_compression, rrg_content_digest, uncompressed_rrg_path, open_rrg, check_compression, compress_rrg_in_background, wait_for_background_compression
+from rrg_sections import RRGSectionIndex
+from rrg_validation import RRGDeltaValidator
+from rrg_profile import PhaseProfiler
+from sb_locations import SB_LOCATION_PATTERNS, SB_LOCATION_SEED_DEFAULT, sb_location_array
+
+# One 3D RRG to generate from the loaded base RRG. Fields after connection_type are optional
+SBVariant = namedtuple("SBVariant", ["output_path", "percent_connectivity", "connection_type", "vertical_connectivity_percentage", "sb_location_pattern", "sb_grid_csv", "max_number_of_crossings", "sb_input_pattern", "sb_output_pattern", "sb_bypass_pairs", "sb_location_seed"], defaults=(1.0, "repeated_interval", "", -1, None, None, None, SB_LOCATION_SEED_DEFAULT))
+
+CONNECTION_TYPES = ["subset", "wilton", "wilton_2", "wilton_3", "custom"]
+
+# Input and output pattern of each connection type, the offsets into the ptc ordered lists of the four SB sides that
+# connection i starts from (see SwitchBlockGenerator.create_sb_connections). The custom type takes them from the variant
+CONNECTION_PATTERNS = {
+    "subset": ((0, 0, 0, 0), (0, 0, 0, 0)),
+    "wilton": ((0, 1, 2, 3), (0, 1, 2, 3)),
+    "wilton_2": ((0, 0, 0, 0), (1, 2, 3, 4)),
+    "wilton_3": ((0, 0, 0, 0), (1, 1, 1, 1)),
+}
+
+# Connections of a batch of SB locations, one entry per location, layer pair and direction (see SwitchBlockGenerator.plan_sb_connections)
+SBConnectionPlan = namedtuple("SBConnectionPlan", ["x", "y", "input_layer", "output_layer", "input_starts", "input_lens", "output_starts", "output_lens", "num_connections"])
+
+# Integer codes used by the channel node table for the node type and direction columns
+CHAN_TYPE_CODES = {"CHANX": 0, "CHANY": 1}
+CHANX = CHAN_TYPE_CODES["CHANX"]
+CHANY = CHAN_TYPE_CODES["CHANY"]
+
+DIRECTION_CODES = {"INC_DIR": 0, "DEC_DIR": 1}
+INC_DIR = DIRECTION_CODES["INC_DIR"]
+DEC_DIR = DIRECTION_CODES["DEC_DIR"]
+# Any other direction (e.g. BI_DIR) is kept in the table but can't be classified by the SB code
+OTHER_DIR = 2
+
+class ChanNodeTable:
+    """
+    Struct-of-arrays store for the CHANX/CHANY nodes of the base RR graph.
+
+    Nodes are appended one at a time while parsing into compact typed buffers, then `finalize()` turns
+    every column into a NumPy array and builds the (type, layer, x, y) location index. After that every
+    node is referred to by its row number in the table.
+    """
+
+    COLUMNS = (
+        ("id", "q", np.int64),
+        ("type", "b", np.int8),
+        ("layer", "h", np.int16),
+        ("xlow", "i", np.int32),
+        ("xhigh", "i", np.int32),
+        ("ylow", "i", np.int32),
+        ("yhigh", "i", np.int32),
+        ("direction", "b", np.int8),
+        ("ptc", "i", np.int32),
+        ("segment", "i", np.int32),
+    )
+
+    def __init__(self):
+        self._buffers = {name: array.array(code) for name, code, _ in self.COLUMNS}
+        self.num_rows = 0
+        self.index_rows = np.zeros(0, dtype=np.int32)
+        self.index_offsets = np.zeros(1, dtype=np.int64)
+        self.index_shape = (0, 0, 0, 0)
+
+    def append(self, node_id, type_code, layer, xlow, xhigh, ylow, yhigh, direction_code, ptc, segment):
+        buffers = self._buffers
+        buffers["id"].append(node_id)
+        buffers["type"].append(type_code)
+        buffers["layer"].append(layer)
+        buffers["xlow"].append(xlow)
+        buffers["xhigh"].append(xhigh)
+        buffers["ylow"].append(ylow)
+        buffers["yhigh"].append(yhigh)
+        buffers["direction"].append(direction_code)
+        buffers["ptc"].append(ptc)
+        buffers["segment"].append(segment)
+        self.num_rows += 1
+
+    def extend(self, columns):
+        """Append many nodes at once, columns maps the name of every column to an array with one value per node"""
+        for name, _, dtype in self.COLUMNS:
+            self._buffers[name].frombytes(np.asarray(columns[name], dtype=dtype).tobytes())
+        self.num_rows += len(columns["id"])
+
+    def finalize(self):
+        """
+        Convert the parse buffers into NumPy columns and build the location index.
+
+        A node is indexed at every location it spans: along x if xhigh != xlow, otherwise along y.
+        The index is a CSR layout, `index_rows[index_offsets[k]:index_offsets[k + 1]]` are the rows
+        (in increasing order) found at linear location key k.
+        """
+        for name, _, dtype in self.COLUMNS:
+            setattr(self, name, np.frombuffer(self._buffers.pop(name), dtype=dtype).copy() if self.num_rows else np.zeros(0, dtype=dtype))
+        self._buffers = None
+
+        if self.num_rows == 0:
+            return
+
+        spans_x = self.xhigh != self.xlow
+        lengths = np.where(spans_x, self.xhigh - self.xlow, self.yhigh - self.ylow).astype(np.int64) + 1
+
+        rows = np.repeat(np.arange(self.num_rows, dtype=np.int32), lengths)
+        steps = np.arange(len(rows), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        xs = self.xlow[rows] + np.where(spans_x[rows], steps, 0)
+        ys = self.ylow[rows] + np.where(spans_x[rows], 0, steps)
+
+        self.index_shape = (len(CHAN_TYPE_CODES), int(self.layer.max()) + 1, int(xs.max()) + 1, int(ys.max()) + 1)
+        keys = np.ravel_multi_index((self.type[rows], self.layer[rows], xs, ys), self.index_shape)
+
+        order = np.argsort(keys, kind="stable")
+        self.index_rows = rows[order]
+        self.index_offsets = np.zeros(np.prod(self.index_shape) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=np.prod(self.index_shape)), out=self.index_offsets[1:])
+
+    def rows_at(self, type_code, x, y, layer):
+        """Return the rows of the nodes of the given type found at (x, y) on the given layer."""
+        num_types, num_layers, num_x, num_y = self.index_shape
+        if not (0 <= layer < num_layers and 0 <= x < num_x and 0 <= y < num_y):
+            return self.index_rows[:0]
+        key = ((type_code * num_layers + layer) * num_x + x) * num_y + y
+        return self.index_rows[self.index_offsets[key]:self.index_offsets[key + 1]]
+
+    def max_ptcs(self, type_code):
+        """
+        Return the highest ptc of the nodes of the given type found at every [layer, x, y] of the index, -1 where there
+        are none. Computed from the location index, so nodes are counted at every location they span.
+        """
+        num_types, num_layers, num_x, num_y = self.index_shape
+        max_ptcs = np.full(num_layers * num_x * num_y, -1, dtype=np.int32)
+        if type_code >= num_types:
+            return max_ptcs.reshape(num_layers, num_x, num_y)
+
+        # The keys of one type are contiguous in the index, in [layer, x, y] order
+        type_offsets = self.index_offsets[type_code * len(max_ptcs):(type_code + 1) * len(max_ptcs) + 1]
+        counts = np.diff(type_offsets)
+        ptcs = self.ptc[self.index_rows[type_offsets[0]:type_offsets[-1]]]
+
+        occupied = counts > 0
+        if occupied.any():
+            max_ptcs[occupied] = np.maximum.reduceat(ptcs, (type_offsets[:-1] - type_offsets[0])[occupied])
+
+        return max_ptcs.reshape(num_layers, num_x, num_y)
+
+    def to_arrays(self):
+        """Return the table columns and index as a dict of arrays, used to save the table in the RRG index sidecar"""
+        arrays = {f"node_{name}": getattr(self, name) for name, _, _ in self.COLUMNS}
+        arrays["node_index_rows"] = self.index_rows
+        arrays["node_index_offsets"] = self.index_offsets
+        arrays["node_index_shape"] = np.array(self.index_shape, dtype=np.int64)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild a finalized table from the arrays returned by to_arrays"""
+        table = cls()
+        table._buffers = None
+        for name, _, dtype in cls.COLUMNS:
+            setattr(table, name, np.asarray(arrays[f"node_{name}"], dtype=dtype))
+        table.num_rows = len(table.id)
+        table.index_rows = np.asarray(arrays["node_index_rows"])
+        table.index_offsets = np.asarray(arrays["node_index_offsets"])
+        table.index_shape = tuple(int(dim) for dim in arrays["node_index_shape"])
+        return table
+
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name, _, _ in self.COLUMNS) + self.index_rows.nbytes + self.index_offsets.nbytes
+
+
+RR_NODES_CLOSING_TAG = b"</rr_nodes>"
+RR_EDGES_CLOSING_TAG = b"</rr_edges>"
+NODE_CLOSING_TAG = b"</node>"
+
+# Size of the chunks the base RRG is read and copied in
+RRG_READ_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Node ids, and the channel nodes as VPR writes them, for the rr_nodes scanner (see scan_rr_nodes). The groups are
+# direction, id, X or Y, layer, ptc, xhigh, xlow, yhigh, ylow and segment id
+NODE_ID_PATTERN = re.compile(rb' id="(\d+)"')
+CHAN_NODE_PATTERN = re.compile(
+    rb'<node capacity="\d+" direction="([A-Z_]+)" id="(\d+)" type="CHAN([XY])">\s*'
+    rb'<loc layer="(\d+)" ptc="(\d+)" xhigh="(\d+)" xlow="(\d+)" yhigh="(\d+)" ylow="(\d+)"/>\s*'
+    rb'<timing [^>]*/>\s*<segment segment_id="(\d+)"/>'
+)
+
+# Version of the parsed RRG index sidecar layout, bump it whenever what's stored in the sidecar changes
+RRG_INDEX_FORMAT_VERSION = 2
+RRG_INDEX_SUFFIX = ".index.npz"
+
+# Number of regions the SB locations are split into per job for parallel generation, more regions than jobs balance
+# the load when some regions take longer than others
+SB_REGIONS_PER_JOB = 4
+
+# Number of regions per job that are being generated or waiting to be stored at any time
+SB_REGIONS_IN_FLIGHT_PER_JOB = 2
+
+# Default memory budget for the generated nodes and edges of one 3D RRG, past it they are spilled to a temporary file
+SB_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# Number of SB locations whose connections are built together, bounds the size of the temporary arrays
+SB_LOCATIONS_PER_BATCH = 1024
+
+# New nodes and edges are formatted with one string formatting call per batch of this many
+FORMAT_BATCH_SIZE = 10000
+
+NODE_XML_FORMAT = (
+    '  <node capacity="1" direction="NONE" id="%d" type="CHANX">\n'
+    '    <loc layer="%d" ptc="%d" xhigh="%d" xlow="%d" yhigh="%d" ylow="%d"/>\n'
+    '    <timing C="0" R="0"/>\n'
+    '    <segment segment_id="%d"/>\n'
+    '  </node>\n'
+)
+EDGE_XML_FORMAT = '  <edge sink_node="%d" src_node="%d" switch_id="%d"/>\n'
+
+# Generator the forked workers of the parallel SB generation work with, set by the parent right before the pool is
+# created so the workers inherit it (and the RRG it has loaded) without pickling it
+_worker_generator = None
+
+def iterparse_with_offsets(file_path, tags_to_locate, found_offsets, chunk_size=RRG_READ_CHUNK_SIZE):
+    """
+    Generator yielding (event, element) pairs like etree.iterparse, feeding the parser the bytes of the file in chunks.
+    Compressed RRGs are decompressed on the fly (see open_rrg), offsets are always in the uncompressed RRG.
+
+    While feeding, each chunk is also searched for the byte strings in tags_to_locate, and found_offsets[tag] is set to the
+    file offset of the last occurrence seen so far. So when the parser reports the end of an element, the offset of its
+    closing tag is already known without another pass over the file.
+    """
+    parser = etree.XMLPullParser(
+        events=('start', 'end'),
+        huge_tree=True,
+        remove_blank_text=True,
+        remove_comments=True
+    )
+
+    overlap = max(len(tag) for tag in tags_to_locate) - 1
+    tail = b""
+    chunk_offset = 0
+
+    with open_rrg(file_path) as infile:
+        while True:
+            chunk = infile.read(chunk_size)
+            if not chunk:
+                break
+
+            # Search the end of the previous chunk too, in case a tag is split between two chunks
+            window = tail + chunk
+            window_offset = chunk_offset - len(tail)
+            for tag in tags_to_locate:
+                pos = window.rfind(tag)
+                if pos != -1:
+                    found_offsets[tag] = window_offset + pos
+
+            parser.feed(chunk)
+            yield from parser.read_events()
+
+            chunk_offset += len(chunk)
+            tail = window[-overlap:] if overlap > 0 else b""
+
+    parser.close()
+    yield from parser.read_events()
+
+def rfind_in_file(infile, needle, start, end, block_size=1024 * 1024):
+    """
+    Return the offset of the last occurrence of needle in the byte range [start, end) of the open binary file, or -1.
+    Reads backwards from end in blocks so it only touches the end of the range when the needle is near it.
+    """
+    block_end = end
+    while block_end > start:
+        block_start = max(start, block_end - block_size)
+        infile.seek(block_start)
+        # Read a little past the block so a needle split between two blocks is still found
+        block = infile.read(min(end, block_end + len(needle) - 1) - block_start)
+        pos = block.rfind(needle)
+        if pos != -1:
+            return block_start + pos
+        block_end = block_start
+    return -1
+
+def scan_insertion_lines(infile, rr_nodes_tag_offset, chunk_size=RRG_READ_CHUNK_SIZE):
+    """
+    The searches of locate_insertion_offsets in one forward pass over the open binary file, for compressed RRGs that
+    can't be read backwards. Returns the offsets of the last newline before rr_nodes_tag_offset, of the last
+    </rr_edges> after it and of the last newline between the two, or -1 for the ones that aren't there.
+    """
+    nodes_newline_offset = -1
+    rr_edges_tag_offset = -1
+    edges_newline_offset = -1
+    # Last newline before the current window
+    last_newline_offset = -1
+
+    overlap = len(RR_EDGES_CLOSING_TAG) - 1
+    tail = b""
+    chunk_offset = 0
+
+    for chunk in iter(lambda: infile.read(chunk_size), b""):
+        window = tail + chunk
+        window_offset = chunk_offset - len(tail)
+
+        if window_offset < rr_nodes_tag_offset:
+            pos = window.rfind(b"\n", 0, rr_nodes_tag_offset - window_offset)
+            if pos != -1:
+                nodes_newline_offset = window_offset + pos
+
+        pos = window.rfind(RR_EDGES_CLOSING_TAG)
+        if pos != -1 and window_offset + pos >= rr_nodes_tag_offset:
+            rr_edges_tag_offset = window_offset + pos
+            newline_pos = window.rfind(b"\n", 0, pos)
+            edges_newline_offset = window_offset + newline_pos if newline_pos != -1 else last_newline_offset
+
+        chunk_offset += len(chunk)
+        tail = window[-overlap:]
+
+        pos = window.rfind(b"\n", 0, len(window) - len(tail))
+        if pos != -1:
+            last_newline_offset = window_offset + pos
+
+    if edges_newline_offset < rr_nodes_tag_offset:
+        edges_newline_offset = -1
+
+    return nodes_newline_offset, rr_edges_tag_offset, edges_newline_offset
+
+def locate_insertion_offsets(file_path, rr_nodes_tag_offset):
+    """
+    Return the byte offsets where the new nodes and new edges are inserted in the base RRG: the start of the lines
+    holding </rr_nodes> and </rr_edges>. The </rr_nodes> offset comes from the parse, </rr_edges> is found by
+    searching backwards from the end of the file since rr_edges is the last section of the RRG. Compressed RRGs are
+    searched forwards (see scan_insertion_lines), the offsets are in the uncompressed RRG.
+    """
+    if rrg_compression(file_path) is not None:
+        with open_rrg(file_path) as infile:
+            nodes_newline_offset, rr_edges_tag_offset, edges_newline_offset = scan_insertion_lines(infile, rr_nodes_tag_offset)
+    else:
+        file_size = os.path.getsize(file_path)
+
+        with open(file_path, 'rb') as infile:
+            rr_edges_tag_offset = rfind_in_file(infile, RR_EDGES_CLOSING_TAG, rr_nodes_tag_offset, file_size)
+            nodes_newline_offset = rfind_in_file(infile, b"\n", 0, rr_nodes_tag_offset)
+            edges_newline_offset = rfind_in_file(infile, b"\n", rr_nodes_tag_offset, rr_edges_tag_offset)
+
+    if rr_edges_tag_offset == -1:
+        print(f"ERROR: Could not find {RR_EDGES_CLOSING_TAG.decode()} in {file_path}")
+        exit(1)
+
+    # If a closing tag doesn't start its own line, insert right before the tag itself
+    nodes_insert_offset = nodes_newline_offset + 1 if nodes_newline_offset != -1 else rr_nodes_tag_offset
+    edges_insert_offset = edges_newline_offset + 1 if edges_newline_offset != -1 else rr_edges_tag_offset
+
+    return nodes_insert_offset, edges_insert_offset
+
+def scan_node_block(block):
+    """
+    Read the channel nodes of a block of complete rr_nodes elements with CHAN_NODE_PATTERN. Returns their columns (see
+    ChanNodeTable.COLUMNS, NONE nodes are left out like in add_node) and the largest node id of the block, or None if
+    a node of the block isn't laid out the way the pattern expects.
+    """
+    node_ids = NODE_ID_PATTERN.findall(block)
+    if len(node_ids) != block.count(b"<node"):
+        return None
+
+    chan_nodes = CHAN_NODE_PATTERN.findall(block)
+    if len(chan_nodes) != block.count(b'type="CHANX"') + block.count(b'type="CHANY"'):
+        return None
+
+    max_node_id = int(np.array(node_ids).astype(np.int64).max()) if len(node_ids) > 0 else 0
+
+    fields = np.array(chan_nodes, dtype=bytes).reshape(-1, 10)
+    fields = fields[fields[:, 0] != b"NONE"]
+
+    direction = np.full(len(fields), OTHER_DIR, dtype=np.int8)
+    for name, code in DIRECTION_CODES.items():
+        direction[fields[:, 0] == name.encode()] = code
+
+    columns = {
+        "id": fields[:, 1].astype(np.int64),
+        "type": np.where(fields[:, 2] == b"X", CHANX, CHANY),
+        "layer": fields[:, 3].astype(np.int64),
+        "xlow": fields[:, 6].astype(np.int64),
+        "xhigh": fields[:, 5].astype(np.int64),
+        "ylow": fields[:, 8].astype(np.int64),
+        "yhigh": fields[:, 7].astype(np.int64),
+        "direction": direction,
+        "ptc": fields[:, 4].astype(np.int64),
+        "segment": fields[:, 9].astype(np.int64),
+    }
+    return columns, max_node_id
+
+def scan_rr_nodes(sections, chunk_size=RRG_READ_CHUNK_SIZE):
+    """
+    Fast alternative to parsing rr_nodes with lxml. The channel nodes are found in the raw bytes of the rr_nodes section
+    (see RRGSectionIndex) with regular expressions and converted a chunk at a time with NumPy, without building any element.
+
+    Returns the channel node columns (see scan_node_block), the largest node id, the number of nodes and the offset of
+    </rr_nodes>. Returns None if the nodes aren't all laid out the way VPR writes them, the RRG then has to be parsed
+    with lxml.
+    """
+    section_range = sections.range("rr_nodes")
+    if section_range is None:
+        return None
+
+    blocks = []
+    max_node_id = 0
+    num_nodes = 0
+
+    # Scan the nodes in blocks ending with a complete node, the last block ends with </rr_nodes>
+    buffer = b""
+    for chunk in sections.chunks("rr_nodes", chunk_size):
+        buffer += chunk
+
+        end = buffer.rfind(NODE_CLOSING_TAG)
+        if end == -1:
+            continue
+        end += len(NODE_CLOSING_TAG)
+
+        scanned = scan_node_block(buffer[:end])
+        if scanned is None:
+            return None
+
+        blocks.append(scanned[0])
+        max_node_id = max(max_node_id, scanned[1])
+        num_nodes += buffer.count(b"<node", 0, end)
+        buffer = buffer[end:]
+
+    if b"<node" in buffer or not buffer.endswith(RR_NODES_CLOSING_TAG):
+        return None
+
+    columns = {name: np.concatenate([block[name] for block in blocks]) if len(blocks) > 0 else np.zeros(0, dtype=dtype) for name, _, dtype in ChanNodeTable.COLUMNS}
+    return columns, max_node_id, num_nodes, section_range[1] - len(RR_NODES_CLOSING_TAG)
+
+def rrg_index_path(file_path):
+    """Index sidecar of an RRG, named after the uncompressed RRG so the RRG and its compressed copies share it"""
+    return uncompressed_rrg_path(file_path) + RRG_INDEX_SUFFIX
+
+def format_edges(edges):
+    """
+    Format an array of edges (rows of src node, sink node, switch id) as RRG XML, returned as bytes
+    """
+    blocks = []
+    for i in range(0, len(edges), FORMAT_BATCH_SIZE):
+        batch = edges[i:i + FORMAT_BATCH_SIZE]
+        blocks.append(((EDGE_XML_FORMAT * len(batch)) % tuple(batch[:, [1, 0, 2]].ravel().tolist())).encode('utf-8'))
+
+    return b"".join(blocks)
+
+class PTCAllocator:
+    """
+    Hands out the ptcs of the new 3D SB nodes, counting up per [layer, x, y] location of the device. The ptcs of a
+    location start right above the highest ptc of the base RRG's CHANX nodes there (the new nodes are CHANX nodes to
+    VPR), so they never collide with the channel tracks, whatever the channel width.
+
+    The counters are a dense int32 array, only made from the base ptcs once the first ptc of a 3D RRG is handed out.
+    """
+
+    def __init__(self, base_max_ptcs, shape):
+        self.base_max_ptcs = np.full(shape, -1, dtype=np.int32)
+        overlap = tuple(slice(0, min(a, b)) for a, b in zip(base_max_ptcs.shape, shape))
+        self.base_max_ptcs[overlap] = base_max_ptcs[overlap]
+
+        # Last ptc handed out at every location, None until the first allocation after a reset
+        self.last_ptcs = None
+
+    def reset(self):
+        """Forget the ptcs handed out so far, the next 3D RRG starts from the base RRG's ptcs again"""
+        self.last_ptcs = None
+
+    def allocate(self, layers, xs, ys, counts):
+        """
+        Take counts[i] consecutive ptcs at location (layers[i], xs[i], ys[i]) for every i, in order. Returns the first
+        ptc of each request
+        """
+        if self.last_ptcs is None:
+            self.last_ptcs = self.base_max_ptcs.copy()
+
+        keys = np.ravel_multi_index((layers, xs, ys), self.last_ptcs.shape)
+
+        # Requests for the same location take their ptcs one after the other
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        taken_before = np.cumsum(counts[order]) - counts[order]
+        group_starts = np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))
+        taken_before -= np.maximum.accumulate(np.where(group_starts, taken_before, 0))
+
+        last_ptcs = self.last_ptcs.reshape(-1)
+        first_ptcs = last_ptcs[keys].astype(np.int64) + 1
+        first_ptcs[order] += taken_before
+        np.add.at(last_ptcs, keys, counts.astype(np.int32))
+
+        return first_ptcs
+
+
+class SpillStore:
+    """
+    Ordered store of the nodes and edges generated for one 3D RRG, kept as chunks: arrays of new nodes or edges, or
+    blocks of them already formatted as XML. The chunks stay in memory until together they take more than memory_budget
+    bytes, then they are all moved to a temporary file, so the memory used is set by the budget and not by the size of
+    the fabric. Reading a stream back gives its chunks in the order they were added, one at a time.
+    """
+
+    STREAMS = ("nodes", "edges")
+
+    def __init__(self, memory_budget, temp_dir=None):
+        self.memory_budget = memory_budget
+        self.temp_dir = temp_dir
+        self.spill_file = None
+        self.memory_bytes = 0
+
+        # Per stream: the chunks in memory, the (offset, size, shape) of the chunks in the spill file (shape is None for
+        # formatted blocks) and the number of nodes or edges
+        self.memory_chunks = {stream: [] for stream in self.STREAMS}
+        self.spilled_chunks = {stream: [] for stream in self.STREAMS}
+        self.counts = {stream: 0 for stream in self.STREAMS}
+
+    def append(self, stream, chunk, count):
+        """Add a chunk holding count nodes or edges to the end of the stream"""
+        if count == 0:
+            return
+
+        self.memory_chunks[stream].append(chunk)
+        self.counts[stream] += count
+        self.memory_bytes += chunk.nbytes if isinstance(chunk, np.ndarray) else len(chunk)
+
+        if self.memory_budget is not None and self.memory_bytes > self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        """Move every chunk in memory to the end of the spill file"""
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(dir=self.temp_dir)
+            print_verbose(f"Generated nodes and edges are over the memory budget of {self.memory_budget / (1024 * 1024):0.0f} MB, spilling them to a temporary file")
+
+        self.spill_file.seek(0, os.SEEK_END)
+        for stream in self.STREAMS:
+            for chunk in self.memory_chunks[stream]:
+                offset = self.spill_file.tell()
+                if isinstance(chunk, np.ndarray):
+                    chunk = np.ascontiguousarray(chunk, dtype=np.int64)
+                    self.spill_file.write(chunk.data)
+                    self.spilled_chunks[stream].append((offset, chunk.nbytes, chunk.shape))
+                else:
+                    self.spill_file.write(chunk)
+                    self.spilled_chunks[stream].append((offset, len(chunk), None))
+
+            self.memory_chunks[stream] = []
+
+        self.memory_bytes = 0
+
+    def chunks(self, stream):
+        """Yield the chunks of the stream in order, the spilled ones are read back one at a time"""
+        for offset, size, shape in self.spilled_chunks[stream]:
+            self.spill_file.seek(offset)
+            data = self.spill_file.read(size)
+            yield data if shape is None else np.frombuffer(data, dtype=np.int64).reshape(shape)
+
+        for chunk in self.memory_chunks[stream]:
+            yield chunk
+
+    def close(self):
+        """Delete the spill file"""
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+def formatted_chunks(chunks, format_chunk):
+    """Yield the chunks as formatted XML blocks, chunks that are arrays are formatted with format_chunk"""
+    for chunk in chunks:
+        yield chunk if isinstance(chunk, bytes) else format_chunk(chunk)
+
+def write_formatted_blocks(outfile, blocks):
+    """
+    Write blocks of nodes or edges that were already formatted (see format_nodes and format_edges)
+    """
+    for block in blocks:
+        outfile.write(block)
+
+def kernel_copy_file_range(in_fd, out_fd, offset, count):
+    return os.copy_file_range(in_fd, out_fd, count, offset_src=offset)
+
+def kernel_sendfile(in_fd, out_fd, offset, count):
+    return os.sendfile(out_fd, in_fd, offset, count)
+
+# Kernel side copy calls available on this platform, tried in order
+KERNEL_COPY_FUNCTIONS = [function for name, function in (("copy_file_range", kernel_copy_file_range), ("sendfile", kernel_sendfile)) if hasattr(os, name)]
+
+# errno values meaning a kernel copy call can't be used for this pair of files, in which case the next method is tried
+KERNEL_COPY_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+def copy_byte_range(infile, outfile, offset, num_bytes=None):
+    """
+    Copy num_bytes (or everything up to the end of infile if None) starting at byte offset of infile to the current
+    position of outfile.
+
+    Between plain files the data is moved by the kernel with os.copy_file_range (or os.sendfile) so it never passes
+    through Python, and on filesystems supporting it copy_file_range doesn't copy the data at all. If neither call works
+    for these files, or one of them is compressed (see open_rrg), it falls back to copying large binary blocks.
+    """
+    end = offset + num_bytes if num_bytes is not None else None
+
+    # Anything buffered has to reach the file before the kernel appends to it
+    outfile.flush()
+
+    # Compressed files have a file descriptor too, but of the compressed data, so only plain files are copied by the kernel
+    if isinstance(infile, io.BufferedReader) and isinstance(outfile, io.BufferedWriter):
+        in_fd = infile.fileno()
+        out_fd = outfile.fileno()
+        if end is None:
+            end = os.fstat(in_fd).st_size
+
+        for kernel_copy in KERNEL_COPY_FUNCTIONS:
+            try:
+                while offset < end:
+                    copied = kernel_copy(in_fd, out_fd, offset, end - offset)
+                    if copied == 0:
+                        raise EOFError(f"Base RRG ended {end - offset} bytes earlier than expected")
+                    offset += copied
+                return
+            except OSError as e:
+                if e.errno not in KERNEL_COPY_UNSUPPORTED_ERRNOS:
+                    raise
+
+    # Compressed files are only read forwards, so don't seek if already there
+    if infile.tell() != offset:
+        infile.seek(offset)
+
+    if end is None:
+        shutil.copyfileobj(infile, outfile, RRG_READ_CHUNK_SIZE)
+        return
+
+    while offset < end:
+        block = infile.read(min(end - offset, RRG_READ_CHUNK_SIZE))
+        if not block:
+            raise EOFError(f"Base RRG ended {end - offset} bytes earlier than expected")
+        outfile.write(block)
+        offset += len(block)
+
+def write_sb_nodes_and_edges_streaming_simple(input_file_path, output_file_path, nodes_to_write, edges_to_write, insertion_offsets, write_nodes=write_formatted_blocks, write_edges=write_formatted_blocks):
+    """
+    Splice the new nodes and edges into a copy of the base RRG at the byte offsets found while reading it (start of
+    the </rr_nodes> and </rr_edges> lines). The three untouched ranges of the base RRG are copied by the kernel, only
+    the new node and edge blocks are formatted in Python, and the original formatting is preserved exactly.
+
+    Either file can be compressed (see open_rrg), the ranges are then streamed through the (de)compressor instead.
+
+    The nodes and edges are written with write_nodes and write_edges, by default they are iterables of formatted blocks
+    (see formatted_chunks), so they can be streamed from a SpillStore.
+    """
+    start_time = time.time()
+    print_verbose(f"Starting streaming write to {output_file_path}")
+    
+    nodes_insert_offset, edges_insert_offset = insertion_offsets
+
+    with atomic_write(output_file_path) as temp_path:
+        with open_rrg(input_file_path, 'rb') as infile, \
+             open_rrg(temp_path, 'wb') as outfile:
+
+            copy_byte_range(infile, outfile, 0, nodes_insert_offset)
+
+            # Insert new nodes before </rr_nodes>
+            write_nodes(outfile, nodes_to_write)
+
+            copy_byte_range(infile, outfile, nodes_insert_offset, edges_insert_offset - nodes_insert_offset)
+
+            # Insert new edges before </rr_edges>
+            write_edges(outfile, edges_to_write)
+
+            copy_byte_range(infile, outfile, edges_insert_offset)
+
+    end_time = time.time()
+    print_verbose(f"Streaming write completed in {((end_time - start_time) * 1000):0.2f} ms")
+
+# temporary fix for mapping segment id at output to its correct switch
+node_switch_id = {
+    "0": "2",
+    "1": "3",
+    "2": "7"
+
+}
+
+def split_sb_locations(sb_locations, num_regions):
+    """Split the SB locations into num_regions contiguous regions of (almost) the same size, keeping their order"""
+    num_regions = max(1, min(num_regions, len(sb_locations)))
+    bounds = np.linspace(0, len(sb_locations), num_regions + 1).astype(int)
+    return [sb_locations[bounds[i]:bounds[i + 1]] for i in range(num_regions)]
+
+def create_sb_executor(num_jobs):
+    '''
+        Function to create the process pool for parallel SB generation, or None if generation has to be serial.
+        Workers are forked once the RRG is loaded so they share the channel node table and every other global
+        set up by the parent
+    '''
+    if num_jobs <= 1:
+        return None
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        print("WARNING: Parallel SB generation needs the fork start method, which is not available on this platform. Generating serially")
+        return None
+
+    return ProcessPoolExecutor(max_workers=num_jobs, mp_context=multiprocessing.get_context("fork"))
+
+def read_variants_file(variants_file, defaults=None):
+    '''
+    Function to read the list of variants to generate from a JSON file. Each entry is an object with the fields of
+    SBVariant, the fields that are left out use the value in the defaults dict (or the SBVariant default).
+    '''
+    try:
+        with open(variants_file, 'r') as infile:
+            entries = json.load(infile)
+    except (OSError, ValueError) as e:
+        print(f"ERROR: Could not read variants file {variants_file}: {e}")
+        exit(1)
+
+    if not isinstance(entries, list) or len(entries) == 0:
+        print(f"ERROR: Variants file {variants_file} must contain a non-empty list of variants.")
+        exit(1)
+
+    defaults = {**SBVariant._field_defaults, "output_path": None, "percent_connectivity": None, "connection_type": None, **(defaults or {})}
+
+    variants = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            print(f"ERROR: Variant {i} in variants file {variants_file} must be an object, got {json.dumps(entry)}.")
+            exit(1)
+
+        unknown = [key for key in entry if key not in SBVariant._fields]
+        if len(unknown) > 0:
+            print(f"ERROR: Unknown keys in variants file {variants_file}: {', '.join(unknown)}")
+            exit(1)
+
+        fields = {**defaults, **entry}
+        if fields["output_path"] is None or fields["percent_connectivity"] is None or fields["connection_type"] is None:
+            print(f"ERROR: Every variant in {variants_file} needs an output_path, percent_connectivity and connection_type.")
+            exit(1)
+
+        fields["connection_type"] = fields["connection_type"].lower()
+        fields["sb_bypass_pairs"] = parse_bypass_pairs(fields["sb_bypass_pairs"])
+        variants.append(SBVariant(**fields))
+
+    return variants
+
+def parse_bypass_pairs(pairs):
+    '''
+    Function to read the bypass layer pairs of a variant, given as "m:n" strings (command line) or [m, n] lists (variants
+    file). Returns them as a tuple of (lower layer, upper layer) tuples, or None if there are none.
+    '''
+    if pairs is None or len(pairs) == 0:
+        return None
+
+    parsed = []
+    for pair in pairs:
+        try:
+            layers = [int(layer) for layer in (pair.split(":") if isinstance(pair, str) else pair)]
+        except (TypeError, ValueError):
+            layers = []
+
+        if len(layers) != 2:
+            print(f"ERROR: Bypass layer pair {pair} must be two layers, given as m:n.")
+            exit(1)
+
+        parsed.append((min(layers), max(layers)))
+
+    return tuple(parsed)
+
+def connection_pattern(variant):
+    """Return the input and output pattern of the variant's connection type (see CONNECTION_PATTERNS) as arrays"""
+    if variant.connection_type == "custom":
+        input_pattern, output_pattern = variant.sb_input_pattern, variant.sb_output_pattern
+    else:
+        input_pattern, output_pattern = CONNECTION_PATTERNS[variant.connection_type]
+
+    return np.array(input_pattern, dtype=np.int64), np.array(output_pattern, dtype=np.int64)
+
+def check_variant(variant):
+    if variant.connection_type not in CONNECTION_TYPES:
+        print(f"ERROR: Unknown connection type {variant.connection_type}.")
+        exit(1)
+
+    if variant.connection_type == "custom":
+        input_pat = variant.sb_input_pattern
+        if input_pat == None:
+            print("ERROR: Custom connection pattern specified but no input pattern provided. Input and Output pattern are required for custom connection.")
+            exit(1)
+
+        output_pat = variant.sb_output_pattern
+        if output_pat == None:
+            print("ERROR: Custom connection pattern specified but no output pattern provided. Input and Output pattern are required for custom connection.")
+            exit(1)
+
+        if len(input_pat) != 4 or len(output_pat) != 4:
+            print("ERROR: Custom connection pattern must be of length 4.")
+            exit(1)
+
+    if variant.sb_location_pattern not in SB_LOCATION_PATTERNS:
+        print(f"ERROR: Unknown SB location pattern {variant.sb_location_pattern}.")
+        exit(1)
+
+    for lower, upper in variant.sb_bypass_pairs or ():
+        if lower < 0 or upper - lower < 2:
+            print(f"ERROR: Bypass layer pair {lower}:{upper} must join two layers that are not adjacent, adjacent layers are always connected.")
+            exit(1)
+
+    if variant.sb_bypass_pairs is not None and len(set(variant.sb_bypass_pairs)) != len(variant.sb_bypass_pairs):
+        print("ERROR: The same bypass layer pair is given more than once.")
+        exit(1)
+
+    if not isinstance(variant.sb_location_seed, int) or variant.sb_location_seed < 0:
+        print(f"ERROR: The SB location seed must be a non-negative integer, not {variant.sb_location_seed}.")
+        exit(1)
+
+    if variant.sb_location_pattern == "custom":
+        if variant.sb_grid_csv == "":
+            print("ERROR: Custom SB location pattern specified but no CSV file provided.")
+            exit(1)
+
+def _count_sb_region_nodes(variant, sb_locations):
+    return _worker_generator.count_sb_region_nodes(variant, sb_locations)
+
+def _generate_sb_region_text(variant, sb_locations, base_node_id, keep_arrays=False, formatted=True):
+    return _worker_generator.generate_sb_region_text(variant, sb_locations, base_node_id, keep_arrays, formatted)
+
+
+class SwitchBlockGenerator:
+    """
+    In-process 3D SB generator. Holds the architecture connection patterns and a loaded base RRG, so any number of
+    3D RRGs can be generated from one read of the base RRG, and the same generator can be reused for other base RRGs
+    of the same architecture.
+
+    Usage:
+        generator = SwitchBlockGenerator(arch_file)
+        generator.load_rrg(rrg_path)
+        generator.generate([SBVariant(output_path, percent_connectivity, connection_type), ...], num_jobs=1)
+
+    Outputs ending in .bin are written in VPR's binary (Cap'n Proto) RR graph format, any other output as XML.
+    """
+
+    def __init__(self, arch_file, segment_name="3D_SB_connection", switch_name="3D_SB_switch", rrg_schema="", memory_budget=SB_MEMORY_BUDGET, profiler=None):
+        self.arch_file = arch_file
+        self.segment_name = segment_name
+        self.switch_name = switch_name
+
+        # Cap'n Proto schema of the binary RR graph, used for outputs ending in .bin ("" for the one in the VTR tree)
+        self.rrg_schema = rrg_schema
+
+        # Bytes of generated nodes and edges kept in memory before they are spilled to a temporary file (None for no limit)
+        self.memory_budget = memory_budget
+
+        # Records the phases of loading the base RRG and generating each 3D RRG, see generate(profile=True)
+        self.profiler = profiler if profiler is not None else PhaseProfiler()
+
+        self.max_node_id = 0
+
+        # Highest node id in the base RRG, every generated 3D RRG numbers its new nodes from here
+        self.rrg_max_node_id = 0
+
+        # Table holding every CHANX/CHANY node of the base RRG, later stages refer to nodes by their row in this table
+        self.chan_nodes = ChanNodeTable()
+
+        # Hands out the ptcs of the 3D SB nodes per [layer, x, y], made once the base RRG is loaded (see load_structure)
+        self.ptc_allocator = None
+
+        self.device_max_x = 0
+        self.device_max_y = 0
+        self.device_max_layer = 0
+
+        # Segment ID to use for 3D SB connection
+        self.segment_id = 0
+
+        # Switch ID to use for 3D SB connection
+        self.switch_id = 2
+
+        # Connection pattern of every segment of the architecture, key: segment name, value: connection pattern (list of bools)
+        self.arch_patterns = {}
+
+        # Same patterns keyed by the segment id of the loaded RRG
+        self.pattern_dict = defaultdict(list)
+
+        # Switch and segment tables of the base RRG, lists of (id, name) in file order
+        self.rrg_switches = []
+        self.rrg_segments = []
+
+        # Byte offsets in the base RRG where the new nodes and the new edges are inserted (start of the </rr_nodes> and </rr_edges> lines)
+        self.rrg_insertion_offsets = None
+
+        # Connection patterns indexed by [segment id, pattern index], built from pattern_dict once the segment ids are known
+        self.pattern_matrix = None
+        self.pattern_lengths = None
+
+        # Channel nodes of every SB location split by layer, side and input/output, see build_sb_index
+        self.sb_index_rows = np.zeros(0, dtype=np.int32)
+        self.sb_index_offsets = np.zeros(1, dtype=np.int64)
+        self.sb_index_shape = (0, 0, 0)
+
+        # Path, size and modification time of the loaded base RRG
+        self.rrg_path = None
+        self.rrg_stat = None
+
+        self.parse_arch_xml(arch_file)
+
+    def load_rrg(self, file_path, use_index=True, scan_nodes=True):
+        '''
+        Load the base RRG to generate the 3D RRGs from. Nothing is done if the same unchanged file is already loaded.
+        scan_nodes=False always parses the nodes with lxml (see read_structure_streaming)
+        '''
+        stat = os.stat(file_path)
+        if self.rrg_path == os.path.abspath(file_path) and self.rrg_stat == (stat.st_size, stat.st_mtime_ns):
+            print_verbose(f"Base RRG {file_path} already loaded")
+            return
+
+        # The phases of the previous base RRG (and its 3D RRGs) don't belong in the profiles of this one
+        self.profiler.reset()
+
+        self.load_structure(file_path, self.segment_name, self.switch_name, use_index=use_index, scan_nodes=scan_nodes)
+
+        self.rrg_path = os.path.abspath(file_path)
+        self.rrg_stat = (stat.st_size, stat.st_mtime_ns)
+
+    def generate(self, variants, num_jobs=1, compression=None, validate=False, profile=False):
+        '''
+        Generate one 3D RRG per variant from the loaded base RRG, with num_jobs processes.
+
+        With profile, the profile of each 3D RRG (the phases of loading the base RRG and of generating it, see
+        PhaseProfiler, and histograms of the new nodes and edges per SB location) is written as JSON next to it, in
+        <output_path>.profile.json.
+
+        With validate, the new nodes and edges of each 3D RRG are checked against the base RRG before it is written (see
+        RRGDeltaValidator), and generation stops with an error at the first 3D RRG that fails.
+
+        If compression ("gzip" or "zstd") is given, each finished 3D RRG is compressed in the background while the next
+        one is generated, and replaced by <output_path>.gz or .zst. Outputs already named as compressed files are
+        compressed while they are written instead.
+        '''
+        if self.rrg_path is None:
+            print("ERROR: No base RRG loaded, call load_rrg first.")
+            exit(1)
+
+        if num_jobs < 1:
+            print("ERROR: The number of jobs must be at least 1.")
+            exit(1)
+
+        if compression is not None:
+            check_compression(compression)
+
+        for variant in variants:
+            check_variant(variant)
+
+            for lower, upper in variant.sb_bypass_pairs or ():
+                if upper > self.device_max_layer:
+                    print(f"ERROR: Bypass layer pair {lower}:{upper} of {variant.output_path} goes past the top layer of the base RRG ({self.device_max_layer}).")
+                    exit(1)
+
+        output_paths = [os.path.abspath(variant.output_path) for variant in variants]
+        if len(set(output_paths)) != len(output_paths):
+            print("ERROR: Two variants write to the same output file.")
+            exit(1)
+
+        # Check the binary RR graph schema is there before generating anything
+        if any(is_binary_rrg_path(variant.output_path) for variant in variants):
+            load_rrg_schema(self.rrg_schema)
+
+        # Same for the compression of outputs named as compressed files
+        for variant in variants:
+            if rrg_compression(variant.output_path) is not None:
+                check_compression(rrg_compression(variant.output_path))
+
+        # Pick the SB locations of every variant up front, so a bad location pattern fails before anything is written
+        with self.profiler.phase("sb_locations"):
+            variant_locations = [sb_location_array(self.device_max_x, self.device_max_y, variant.percent_connectivity, variant.sb_location_pattern, variant.sb_grid_csv, variant.sb_location_seed) for variant in variants]
+
+        validator = None
+        if validate:
+            validator = RRGDeltaValidator(self.rrg_max_node_id, self.ptc_allocator.base_max_ptcs, [id_val for id_val, _ in self.rrg_switches], [id_val for id_val, _ in self.rrg_segments], self.segment_id)
+
+        global _worker_generator
+        _worker_generator = self
+        sb_executor = create_sb_executor(num_jobs)
+
+        try:
+            for variant, sb_locations in zip(variants, variant_locations):
+                variant_start_time = time.time()
+
+                design_string = f"{self.rrg_path} with {(variant.percent_connectivity * 100):0.1f} SBs, connection type: {variant.connection_type}, vertical connectivity percentage: {variant.vertical_connectivity_percentage} outputting to {variant.output_path}"
+
+                print(f"Creating 3D SBs for {design_string}")
+
+                self.profiler.scope = variant.output_path
+                if profile:
+                    self.profile_sb_locations(variant, sb_locations)
+
+                self.create_sb(None, variant, sb_locations, base_rrg_path=self.rrg_path, executor=sb_executor, num_jobs=num_jobs, validator=validator)
+
+                if compression is not None and rrg_compression(variant.output_path) is None:
+                    compress_rrg_in_background(variant.output_path, compression)
+
+                variant_end_time = time.time()
+                if len(variants) > 1:
+                    print(f"Generating SBs for {variant.output_path} took { ((variant_end_time - variant_start_time) * 1000):0.2f} ms")
+
+                if profile:
+                    self.profiler.write(variant.output_path, variant.output_path,
+                        base_rrg=self.rrg_path,
+                        variant=variant._asdict(),
+                        num_jobs=num_jobs,
+                        num_sb_locations=len(sb_locations),
+                        device={"layers": self.device_max_layer + 1, "x": self.device_max_x + 1, "y": self.device_max_y + 1},
+                        base_chan_nodes=self.chan_nodes.num_rows,
+                        base_max_node_id=self.rrg_max_node_id,
+                        total_wall_s=variant_end_time - variant_start_time)
+
+            wait_for_background_compression()
+        finally:
+            self.profiler.scope = None
+            if sb_executor is not None:
+                sb_executor.shutdown()
+            _worker_generator = None
+
+    def add_node(self, node_id, type_attr, layer, xhigh, xlow, yhigh, ylow, direction, ptc_node, id_segment):
+        """
+        Add a CHANX/CHANY node to the channel node table, converting its attributes to integers once.
+        """
+        if direction == "NONE":
+            return
+
+        self.chan_nodes.append(int(node_id), CHAN_TYPE_CODES[type_attr], int(layer), int(xlow), int(xhigh), int(ylow), int(yhigh), DIRECTION_CODES.get(direction, OTHER_DIR), int(ptc_node), int(id_segment))
+
+    def read_structure_streaming(self, file_path, scan_nodes=True, use_sections=True):
+        """
+        Read the switches, segments and channel nodes of the base RRG, and record the byte offsets where the new nodes and
+        edges have to be inserted when writing the output. The edges are never parsed.
+
+        With scan_nodes only the sections that are needed are read, found with RRGSectionIndex (whose sidecar is only
+        used with use_sections): the switches and segments are parsed on their own and the nodes are read by the rr_nodes
+        scanner (see extract_nodes_scanning). Otherwise, or if the RRG isn't written the way the scanner expects, a single
+        streaming lxml parse goes over the file from the start up to </rr_nodes>.
+        """
+        start_time = time.time()
+        print_verbose(f"Starting streaming read of {file_path}")
+
+        # Drop anything left from a previously loaded RRG
+        self.chan_nodes = ChanNodeTable()
+        self.max_node_id = 0
+        self.device_max_x = 0
+        self.device_max_y = 0
+        self.device_max_layer = 0
+
+        rr_nodes_tag_offset = -1
+        if scan_nodes:
+            with RRGSectionIndex(file_path, use_sidecar=use_sections) as sections:
+                self.extract_switches_and_segments_indexed(sections)
+                rr_nodes_tag_offset = self.extract_nodes_scanning(sections)
+
+        if rr_nodes_tag_offset == -1:
+            found_offsets = {}
+            parser = iterparse_with_offsets(file_path, (RR_NODES_CLOSING_TAG,), found_offsets)
+
+            # Switches and segments come before the nodes in the RRG, so both readers share the same event stream
+            self.extract_switches_and_segments_streaming(parser)
+            self.extract_nodes_streaming(parser)
+            rr_nodes_tag_offset = found_offsets.get(RR_NODES_CLOSING_TAG, -1)
+            parser.close()
+
+        if rr_nodes_tag_offset == -1:
+            print(f"ERROR: Could not find {RR_NODES_CLOSING_TAG.decode()} in {file_path}")
+            exit(1)
+
+        self.rrg_insertion_offsets = locate_insertion_offsets(file_path, rr_nodes_tag_offset)
+        print_verbose(f"New nodes inserted at byte {self.rrg_insertion_offsets[0]}, new edges inserted at byte {self.rrg_insertion_offsets[1]}")
+
+        end_time = time.time()
+        print_verbose(f"Reading XML file took {((end_time - start_time) * 1000):0.2f} ms")
+
+    def save_rrg_index(self, file_path, file_hash=None):
+        """
+        Save everything read from the base RRG (channel node table and index, device size, switch and segment tables
+        and insertion offsets) in a binary sidecar next to it, keyed by the RRG's size, mtime, compression and content
+        hash (see rrg_content_digest).
+        The sidecar is written to a temporary file and renamed so concurrent runs never see a partial sidecar.
+        """
+        start_time = time.time()
+        index_path = rrg_index_path(file_path)
+        stat = os.stat(file_path)
+
+        if file_hash is None:
+            file_hash = rrg_content_digest(file_path)
+
+        arrays = self.chan_nodes.to_arrays()
+        arrays.update(
+            format_version=np.array(RRG_INDEX_FORMAT_VERSION),
+            file_size=np.array(stat.st_size, dtype=np.int64),
+            file_mtime_ns=np.array(stat.st_mtime_ns, dtype=np.int64),
+            file_compression=np.array(str(rrg_compression(file_path))),
+            file_hash=np.array(file_hash),
+            max_node_id=np.array(self.max_node_id, dtype=np.int64),
+            device_max=np.array([self.device_max_x, self.device_max_y, self.device_max_layer], dtype=np.int64),
+            insertion_offsets=np.array(self.rrg_insertion_offsets, dtype=np.int64),
+            switch_ids=np.array([id_val for id_val, _ in self.rrg_switches], dtype=np.int64),
+            switch_names=np.array([name for _, name in self.rrg_switches], dtype=str),
+            segment_ids=np.array([id_val for id_val, _ in self.rrg_segments], dtype=np.int64),
+            segment_names=np.array([name for _, name in self.rrg_segments], dtype=str),
+        )
+
+        try:
+            with atomic_write(index_path) as temp_path, open(temp_path, 'wb') as outfile:
+                np.savez(outfile, **arrays)
+        except OSError as e:
+            print(f"WARNING: Could not write the RRG index {index_path}: {e}")
+            return
+
+        end_time = time.time()
+        print_verbose(f"Saving RRG index to {index_path} took {((end_time - start_time) * 1000):0.2f} ms")
+
+    def load_rrg_index(self, file_path):
+        """
+        Load what was read from the base RRG from its index sidecar. Returns False if there is no sidecar or it doesn't
+        match the RRG anymore, in which case the RRG has to be parsed again.
+
+        The sidecar is trusted right away when the RRG size and mtime match. If only the mtime changed (file touched or
+        copied), or the RRG was compressed or decompressed since, the content hash of the uncompressed RRG decides.
+        """
+
+        start_time = time.time()
+        index_path = rrg_index_path(file_path)
+
+        if not os.path.exists(index_path):
+            return False
+
+        try:
+            with np.load(index_path, allow_pickle=False) as index:
+                if int(index["format_version"]) != RRG_INDEX_FORMAT_VERSION:
+                    print_verbose(f"RRG index {index_path} has an old format, re-reading RRG")
+                    return False
+
+                stat = os.stat(file_path)
+                same_compression = str(index["file_compression"]) == str(rrg_compression(file_path))
+                if same_compression and int(index["file_size"]) != stat.st_size:
+                    print_verbose(f"RRG index {index_path} is out of date, re-reading RRG")
+                    return False
+
+                refresh_index = False
+                if not same_compression or int(index["file_size"]) != stat.st_size or int(index["file_mtime_ns"]) != stat.st_mtime_ns:
+                    file_hash = rrg_content_digest(file_path)
+                    if str(index["file_hash"]) != file_hash:
+                        print_verbose(f"RRG index {index_path} is out of date, re-reading RRG")
+                        return False
+                    refresh_index = True
+
+                self.chan_nodes = ChanNodeTable.from_arrays(index)
+                self.max_node_id = int(index["max_node_id"])
+                self.device_max_x, self.device_max_y, self.device_max_layer = (int(value) for value in index["device_max"])
+                self.rrg_insertion_offsets = tuple(int(value) for value in index["insertion_offsets"])
+                self.rrg_switches = list(zip(index["switch_ids"].tolist(), index["switch_names"].tolist()))
+                self.rrg_segments = list(zip(index["segment_ids"].tolist(), index["segment_names"].tolist()))
+
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            print(f"WARNING: Could not read the RRG index {index_path}, re-reading RRG: {e}")
+            return False
+
+        # Same content under a new mtime or compression, update the sidecar so the next run doesn't have to hash the RRG again
+        if refresh_index:
+            self.save_rrg_index(file_path, file_hash)
+
+        end_time = time.time()
+        print_verbose(f"Loaded RRG index {index_path} ({self.chan_nodes.num_rows} channel nodes) in {((end_time - start_time) * 1000):0.2f} ms")
+        return True
+
+    def load_structure(self, file_path, segment_name, switch_name, use_index=True, scan_nodes=True):
+        """
+        Get the channel nodes, switches, segments and insertion offsets of the base RRG, from its index sidecar when it's
+        valid, otherwise by reading the RRG (and then saving the sidecar for the next run)
+        """
+        loaded = False
+        if use_index:
+            with self.profiler.phase("load_rrg_index") as phase:
+                loaded = self.load_rrg_index(file_path)
+                phase["loaded"] = loaded
+
+        if not loaded:
+            with self.profiler.phase("read_rrg", file_bytes=os.path.getsize(file_path)) as phase:
+                self.read_structure_streaming(file_path, scan_nodes=scan_nodes, use_sections=use_index)
+                phase["chan_nodes"] = self.chan_nodes.num_rows
+
+            if use_index:
+                with self.profiler.phase("save_rrg_index"):
+                    self.save_rrg_index(file_path)
+
+        self.select_switch_and_segment(segment_name, switch_name)
+
+        with self.profiler.phase("build_sb_index"):
+            self.build_sb_index()
+
+        self.ptc_allocator = PTCAllocator(self.chan_nodes.max_ptcs(CHANX), (self.device_max_layer + 1, self.device_max_x + 1, self.device_max_y + 1))
+
+        self.rrg_max_node_id = self.max_node_id
+
+    def reset_sb_state(self):
+        """Reset the node id and ptc counters to the state of the base RRG before generating a new 3D RRG"""
+
+        self.max_node_id = self.rrg_max_node_id
+
+        self.ptc_allocator.reset()
+
+    def finalize_chan_nodes(self):
+        """
+        Build the channel node table columns and index once all nodes are parsed, and derive the device size from it
+        """
+
+        self.chan_nodes.finalize()
+
+        if self.chan_nodes.num_rows == 0:
+            return
+
+        self.device_max_layer = max(self.device_max_layer, int(self.chan_nodes.layer.max()))
+        chanx_rows = self.chan_nodes.type == CHANX
+        chany_rows = self.chan_nodes.type == CHANY
+        if chanx_rows.any():
+            self.device_max_x = max(self.device_max_x, int(self.chan_nodes.xhigh[chanx_rows].max()))
+        if chany_rows.any():
+            self.device_max_y = max(self.device_max_y, int(self.chan_nodes.yhigh[chany_rows].max()))
+
+    def extract_nodes_streaming(self, parser):
+        """
+        Streaming version of extract_nodes that processes one node at a time
+        """
+        print_verbose("Extracting Nodes")
+        start_time = time.time()
+
+
+        in_rr_nodes = False
+        nodes_processed = 0
+
+        for event, elem in parser:
+            # Check if we're entering rr_nodes section
+            if event == 'start' and elem.tag == 'rr_nodes':
+                in_rr_nodes = True
+                continue
+
+            # Check if we're leaving rr_nodes section
+            if event == 'end' and elem.tag == 'rr_nodes':
+                in_rr_nodes = False
+                # Clear the rr_nodes element to free memory
+                elem.clear()
+                break
+
+            # Process node elements within rr_nodes
+            if event == 'end' and elem.tag == 'node' and in_rr_nodes:
+                node_id = elem.get("id")
+
+                if node_id:
+                    # Update max_node_id
+                    self.max_node_id = max(self.max_node_id, int(node_id))
+
+                    nodes_processed += 1
+                    if nodes_processed % 100000 == 0:
+                        print_verbose(f"\tProcessed {nodes_processed} nodes")
+
+                    type_attr = elem.get("type")
+
+                    # Only process CHANX and CHANY nodes
+                    if type_attr in ["CHANX", "CHANY"]:
+                        # Extract location data
+                        loc = elem.find("loc")
+                        if loc is not None:
+                            # Get segment info
+                            segment = elem.find("segment")
+                            id_segment = 0
+                            if segment is not None:
+                                id_segment = segment.get("segment_id", 0)
+
+                            self.add_node(node_id, type_attr, loc.get("layer"), loc.get("xhigh"), loc.get("xlow"), loc.get("yhigh"), loc.get("ylow"), elem.get("direction", ""), loc.get("ptc"), id_segment)
+
+                # IMPORTANT: Clear the element to free memory
+                elem.clear()
+                # Also remove preceding siblings that are already processed
+                parent = elem.getparent()
+                if parent is not None:
+                    # Remove all previous siblings to free memory
+                    while elem.getprevious() is not None:
+                        del parent[0]
+
+        self.finalize_chan_nodes()
+
+        end_time = time.time()
+        print_verbose(f"max_node_id: {self.max_node_id}")
+        print_verbose(f"Total nodes processed: {nodes_processed}")
+        print_verbose(f"Channel node table: {self.chan_nodes.num_rows} nodes, {self.chan_nodes.nbytes() / (1024 * 1024):0.2f} MiB")
+        print_verbose(f"Extracting all nodes took {((end_time - start_time) * 1000):0.2f} ms")
+
+    def extract_nodes_scanning(self, sections):
+        """
+        Faster version of extract_nodes_streaming reading the rr_nodes section with scan_rr_nodes. Returns the offset of
+        </rr_nodes>, or -1 without reading anything if the nodes can't be scanned and have to be parsed with lxml instead
+        """
+        print_verbose("Scanning Nodes")
+        start_time = time.time()
+
+        scanned = scan_rr_nodes(sections)
+        if scanned is None:
+            print_verbose("Nodes are not in the layout written by VPR, parsing them instead")
+            return -1
+
+        columns, max_node_id, nodes_processed, rr_nodes_tag_offset = scanned
+        self.chan_nodes.extend(columns)
+        self.max_node_id = max(self.max_node_id, max_node_id)
+
+        self.finalize_chan_nodes()
+
+        end_time = time.time()
+        print_verbose(f"max_node_id: {self.max_node_id}")
+        print_verbose(f"Total nodes processed: {nodes_processed}")
+        print_verbose(f"Channel node table: {self.chan_nodes.num_rows} nodes, {self.chan_nodes.nbytes() / (1024 * 1024):0.2f} MiB")
+        print_verbose(f"Scanning all nodes took {((end_time - start_time) * 1000):0.2f} ms")
+
+        return rr_nodes_tag_offset
+
+    def format_nodes(self, nodes):
+        """
+        Format an array of new nodes (rows of id, layer, x, y, ptc) as RRG XML without creating etree elements, returned as bytes.
+        Every new node is a NONE CHANX node of the 3D SB segment
+        """
+        columns = np.column_stack((nodes[:, [0, 1, 4, 2, 2, 3, 3]], np.full(len(nodes), self.segment_id, dtype=np.int64)))
+
+        blocks = []
+        for i in range(0, len(columns), FORMAT_BATCH_SIZE):
+            batch = columns[i:i + FORMAT_BATCH_SIZE]
+            blocks.append(((NODE_XML_FORMAT * len(batch)) % tuple(batch.ravel().tolist())).encode('utf-8'))
+
+        return b"".join(blocks)
+
+    def build_pattern_matrix(self):
+        """
+        Turn the segment connection patterns in pattern_dict (keyed by segment id once the RRG segments are read) into
+        a padded boolean matrix indexed by [segment id, pattern index] so the patterns can be looked up for many nodes at once
+        """
+
+        segment_ids = [key for key in self.pattern_dict if isinstance(key, int)]
+        num_segments = max(segment_ids) + 1 if segment_ids else 0
+        max_pattern_len = max((len(self.pattern_dict[key]) for key in segment_ids), default=0)
+
+        self.pattern_matrix = np.zeros((num_segments, max_pattern_len), dtype=bool)
+        self.pattern_lengths = np.zeros(num_segments, dtype=np.int32)
+
+        for key in segment_ids:
+            pattern = self.pattern_dict[key]
+            self.pattern_matrix[key, :len(pattern)] = pattern
+            self.pattern_lengths[key] = len(pattern)
+
+    def do_nodes_connect_to_sb(self, rows, x, y):
+        """
+        Return a boolean mask over the given channel node table rows that is True for the nodes whose segment
+        connection pattern allows them to connect to the SB at location (x, y). x and y can also be arrays with one
+        location per row
+        """
+        if self.pattern_matrix is None:
+            self.build_pattern_matrix()
+
+        node_segments = self.chan_nodes.segment[rows]
+
+        known_segment = (node_segments >= 0) & (node_segments < len(self.pattern_lengths))
+        known_segment[known_segment] = self.pattern_lengths[node_segments[known_segment]] > 0
+        if not known_segment.all():
+            print(f"ERROR: Segment {node_segments[~known_segment][0]} does not have a connection pattern")
+            exit(1)
+
+        pattern_index = np.where(self.chan_nodes.type[rows] == CHANX, x - self.chan_nodes.xlow[rows], y - self.chan_nodes.ylow[rows]) + 1
+        out_of_bounds = (pattern_index < 0) | (pattern_index >= self.pattern_lengths[node_segments])
+        if out_of_bounds.any():
+            bad_row = rows[out_of_bounds][0]
+            print(f"ERROR: Pattern index {pattern_index[out_of_bounds][0]} out of bounds for node {self.chan_nodes.id[bad_row]} with pattern {self.pattern_dict[int(self.chan_nodes.segment[bad_row])]}")
+            exit(1)
+
+        return self.pattern_matrix[node_segments, pattern_index]
+
+    def build_sb_index(self):
+        '''
+            Build the SB connectivity index once the RRG is loaded. For every SB location (x, y) and layer it holds the
+            channel nodes that connect to the SB, split into inputs and outputs and into the four sides of the SB
+            (chanx at (x, y), chany at (x, y), chanx at (x + 1, y), chany at (x, y + 1)), each list ordered by ptc.
+            Creating a SB is then only lookups (see sb_side_lists).
+
+            The index is a CSR layout, `sb_index_rows[sb_index_offsets[k]:sb_index_offsets[k + 1]]` are the rows of list k,
+            with k = ((x * num_y + y) * num_layers + layer) * 8 + side * 2 + is_output
+        '''
+        start_time = time.time()
+
+        table = self.chan_nodes
+        num_types, num_layers, num_x, num_y = table.index_shape
+
+        # Location of every entry of the channel node location index
+        entry_keys = np.repeat(np.arange(len(table.index_offsets) - 1, dtype=np.int64), np.diff(table.index_offsets))
+        entry_types, _, entry_x, entry_y = np.unravel_index(entry_keys, table.index_shape)
+
+        # A node at (x, y) is on the near side of the SB at (x, y) and on the far side of the SB before it
+        # (x - 1 for CHANX, y - 1 for CHANY)
+        sb_x = np.concatenate((entry_x, entry_x - (entry_types == CHANX)))
+        sb_y = np.concatenate((entry_y, entry_y - (entry_types == CHANY)))
+        rows = np.concatenate((table.index_rows, table.index_rows)).astype(np.int64)
+
+        on_fabric = (sb_x >= 0) & (sb_y >= 0)
+
+        # remove duplicates, long wires are indexed at every location they span
+        pair_keys = np.sort((sb_x[on_fabric] * num_y + sb_y[on_fabric]) * table.num_rows + rows[on_fabric])
+        pair_keys = pair_keys[np.concatenate(([True], pair_keys[1:] != pair_keys[:-1]))]
+        rows = pair_keys % table.num_rows
+        sb_x, sb_y = np.divmod(pair_keys // table.num_rows, num_y)
+
+        connects = self.do_nodes_connect_to_sb(rows, sb_x, sb_y)
+        rows = rows[connects]
+        sb_x = sb_x[connects]
+        sb_y = sb_y[connects]
+
+        xlow = table.xlow[rows]
+        xhigh = table.xhigh[rows]
+        ylow = table.ylow[rows]
+        yhigh = table.yhigh[rows]
+        direction = table.direction[rows]
+
+        inc_nodes = direction == INC_DIR
+        dec_nodes = direction == DEC_DIR
+
+        # The only time a INC node is at location x plus 1 (CHANX) or y plus 1 (CHANY) is when it's being driven,
+        # The only time a DEC node is at location x (CHANX) or y (CHANY) is when it's being driven
+        inc_outputs = inc_nodes & (((xlow == sb_x + 1) & (ylow == sb_y)) | ((xlow == sb_x) & (ylow == sb_y + 1)))
+        inc_inputs = inc_nodes & ~inc_outputs & (xhigh >= sb_x) & (yhigh >= sb_y)
+
+        dec_outputs = dec_nodes & (xhigh == sb_x) & (yhigh == sb_y)
+        dec_inputs = dec_nodes & ~dec_outputs & (((xlow <= sb_x + 1) & (ylow == sb_y)) | ((xlow == sb_x) & (ylow <= sb_y + 1)))
+
+        outputs = inc_outputs | dec_outputs
+        inputs = inc_inputs | dec_inputs
+
+        unclassified = ~(inputs | outputs)
+        if unclassified.any():
+            print_verbose(f"ERROR: node {table.id[rows[unclassified][0]]} can't be classified as input or output at location X: {sb_x[unclassified][0]} Y: {sb_y[unclassified][0]}")
+            exit(1)
+
+        far_side = inc_outputs | (dec_nodes & ~dec_outputs)
+        side = np.where(far_side, 2, 0) + (table.type[rows] == CHANY)
+
+        self.sb_index_shape = (int(sb_x.max()) + 1 if len(rows) else 0, num_y, num_layers)
+        list_keys = ((sb_x * num_y + sb_y) * num_layers + table.layer[rows]) * 8 + side * 2 + outputs
+
+        # Group by list, each list ordered by ptc. The pairs are already ordered by row within each location and the sort
+        # is stable, so nodes with the same ptc keep the order of the node table
+        ptcs = table.ptc[rows].astype(np.int64)
+        order = np.argsort(list_keys * (int(ptcs.max()) + 1 if len(rows) else 1) + ptcs, kind="stable")
+        self.sb_index_rows = rows[order].astype(np.int32)
+        self.sb_index_offsets = np.zeros(np.prod(self.sb_index_shape) * 8 + 1, dtype=np.int64)
+        np.cumsum(np.bincount(list_keys, minlength=np.prod(self.sb_index_shape) * 8), out=self.sb_index_offsets[1:])
+
+        end_time = time.time()
+        print_verbose(f"Building the SB index ({len(self.sb_index_rows)} entries) took {((end_time - start_time) * 1000):0.2f} ms")
+
+    def sb_side_lists(self, x, y, layer, is_output):
+        '''
+            Look up the SB inputs (or outputs) on the given layers at the locations (x, y), given as arrays of the same length.
+
+            Returns the start in sb_index_rows and the length of the ptc ordered list of each of the four sides, as arrays of
+            shape (len(x), 4). Locations outside of the index have empty lists.
+        '''
+        num_x, num_y, num_layers = self.sb_index_shape
+        if num_x * num_y * num_layers == 0:
+            return np.zeros((len(x), 4), dtype=np.int64), np.zeros((len(x), 4), dtype=np.int64)
+
+        on_index = (x >= 0) & (x < num_x) & (y >= 0) & (y < num_y) & (layer >= 0) & (layer < num_layers)
+        keys = np.where(on_index, ((x * num_y + y) * num_layers + layer) * 8 + int(is_output), 0)[:, None] + np.arange(4) * 2
+
+        starts = self.sb_index_offsets[keys]
+        lengths = np.where(on_index[:, None], self.sb_index_offsets[keys + 1] - starts, 0)
+        return starts, lengths
+
+    def layer_pairs(self, variant):
+        '''
+            Function to list the (lower, upper) layer pairs joined by the variant's 3D SBs: every pair of adjacent layers from
+            the bottom up, then the variant's bypass pairs in the order they are given. A bypass pair connects two layers
+            directly, without going through a mux on the layers between them.
+        '''
+        pairs = [(n - 1, n) for n in range(1, self.device_max_layer + 1)]
+        pairs += list(variant.sb_bypass_pairs or ())
+        return np.array(pairs, dtype=np.int64).reshape(-1, 2)
+
+    def plan_sb_connections(self, variant, sb_locations):
+        '''
+            Function to work out the connections of the given SB locations without creating them.
+
+            There is one unit per location, layer pair (see layer_pairs) and direction (lower to upper layer first, then
+            upper to lower), in the order they are created. The channel node lists of every layer come from the SB index,
+            so a layer shared by several pairs is only looked up, never classified again, and all the pairs of a batch of
+            locations are planned and created together. Each unit makes max_output_len connections, the longest of its four
+            lists of outputs scaled by vertical_connectivity_percentage.
+        '''
+        locations = np.array(sb_locations, dtype=np.int64).reshape(-1, 2)
+        pairs = self.layer_pairs(variant)
+        num_pairs = len(pairs)
+
+        unit_x = np.repeat(locations[:, 0], 2 * num_pairs)
+        unit_y = np.repeat(locations[:, 1], 2 * num_pairs)
+        unit_pair = np.tile(np.repeat(np.arange(num_pairs), 2), len(locations))
+        unit_reversed = np.tile([False, True], len(locations) * num_pairs)
+
+        input_layer = np.where(unit_reversed, pairs[unit_pair, 1], pairs[unit_pair, 0])
+        output_layer = np.where(unit_reversed, pairs[unit_pair, 0], pairs[unit_pair, 1])
+
+        input_starts, input_lens = self.sb_side_lists(unit_x, unit_y, input_layer, False)
+        output_starts, output_lens = self.sb_side_lists(unit_x, unit_y, output_layer, True)
+
+        num_connections = (output_lens.max(axis=1, initial=0) * variant.vertical_connectivity_percentage).astype(np.int64)
+
+        return SBConnectionPlan(unit_x, unit_y, input_layer, output_layer, input_starts, input_lens, output_starts, output_lens, num_connections)
+
+    def connection_sides(self, variant, plan):
+        '''
+            Function to work out the number of inputs and outputs every connection of a unit of the plan takes from each of
+            its sides, and the wide input sides (see create_sb_connections). Returns (wide_sides, inputs_per_side,
+            outputs_per_side), arrays of shape (number of units, 4)
+        '''
+        max_output_len = plan.num_connections[:, None]
+        wide_sides = (variant.max_number_of_crossings == -1) & (plan.input_lens > max_output_len)
+        inputs_per_side = np.where(wide_sides, plan.input_lens // np.maximum(max_output_len, 1), (plan.input_lens > 0).astype(np.int64))
+        outputs_per_side = (plan.output_lens > 0).astype(np.int64)
+
+        return wide_sides, inputs_per_side, outputs_per_side
+
+    def profile_sb_locations(self, variant, sb_locations):
+        '''
+            Function to add histograms of the nodes and edges each SB location adds to the profile, worked out from the
+            connection plan of the locations without creating them
+        '''
+        nodes_per_location = []
+        edges_per_location = []
+        units_per_location = 2 * len(self.layer_pairs(variant))
+
+        for start in range(0, len(sb_locations), SB_LOCATIONS_PER_BATCH):
+            plan = self.plan_sb_connections(variant, sb_locations[start:start + SB_LOCATIONS_PER_BATCH])
+            _, inputs_per_side, outputs_per_side = self.connection_sides(variant, plan)
+
+            # Every connection adds two nodes, and an edge per input and output plus the one between its nodes
+            unit_edges = plan.num_connections * (inputs_per_side.sum(axis=1) + outputs_per_side.sum(axis=1) + 1)
+            nodes_per_location.append((2 * plan.num_connections).reshape(-1, units_per_location).sum(axis=1))
+            edges_per_location.append(unit_edges.reshape(-1, units_per_location).sum(axis=1))
+
+        if len(sb_locations) > 0:
+            self.profiler.set_histogram("nodes_per_sb_location", np.concatenate(nodes_per_location))
+            self.profiler.set_histogram("edges_per_sb_location", np.concatenate(edges_per_location))
+
+    def pick_side_rows(self, slots, units, indices, per_side, starts, lengths, pattern, wide_sides):
+        '''
+            Function to find the channel node of each edge slot of a connection. The slots of a connection go through the
+            sides in order, per_side[unit] of them for each side. The node is taken at position index + pattern[side] of the
+            side's list, or slot position + pattern[side] for wide sides, modulo the length of the list.
+        '''
+        side_ends = np.cumsum(per_side, axis=1)[units]
+        side = (slots[:, None] >= side_ends[:, :3]).sum(axis=1)
+        position = slots - side_ends[np.arange(len(slots)), side] + per_side[units, side]
+
+        offset = np.where(wide_sides[units, side], position, indices) + pattern[side]
+        return self.sb_index_rows[starts[units, side] + offset % lengths[units, side]]
+
+    def create_sb_connections(self, variant, sb_locations):
+        '''
+            Function to create the 3D SBs of the given locations, in order, numbering the new nodes from max_node_id.
+
+            A connection is a pair of NONE nodes, one on the input layer and one on the output layer, with edges from its input
+            channel nodes to the input layer node, from there to the output layer node and from that to its output channel
+            nodes. The connections of every location, layer pair and direction are in plan_sb_connections.
+
+            The four sides of a SB are:
+            0: CHANX at location (x,y)
+            1: CHANY at location (x,y)
+            2: CHANX at location (x+1,y)
+            3: CHANY at location (x,y+1)
+
+            and each side is a ptc ordered list of channel nodes (see build_sb_index). Connection number i takes from each
+            side that has nodes:
+
+                Inputs:
+                    i + input_pattern[side]
+                Outputs:
+                    i + output_pattern[side]
+
+            modulo the length of the list. If the number of crossings is not limited (-1) and a side has more inputs than
+            there are connections, every connection takes the first len(inputs) // max_output_len inputs of that side
+            instead, j + input_pattern[side] for each j.
+
+            The patterns of each connection type are in CONNECTION_PATTERNS, custom takes them from the variant.
+            For example a subset connection would be:
+                input_pattern = [0, 0, 0, 0]
+                output_pattern = [0, 0, 0, 0]
+
+            One way to do a wilton is:
+                input_pattern = [0, 0, 0, 0]
+                output_pattern = [1, 2, 3, 4]
+
+            Every node and edge of the batch is made at once with array operations. Returns the new nodes, rows of
+            (id, layer, x, y, ptc) in id order, and the new edges, rows of (src node, sink node, switch id)
+        '''
+        input_pattern, output_pattern = connection_pattern(variant)
+        plan = self.plan_sb_connections(variant, sb_locations)
+        num_connections = plan.num_connections
+
+        wide_sides, inputs_per_side, outputs_per_side = self.connection_sides(variant, plan)
+        no_wide_sides = np.zeros_like(wide_sides)
+
+        num_inputs = inputs_per_side.sum(axis=1)
+        num_outputs = outputs_per_side.sum(axis=1)
+
+        # Connections, with their unit and number i within the unit
+        total_connections = int(num_connections.sum())
+        connection_unit = np.repeat(np.arange(len(num_connections)), num_connections)
+        connection_index = np.arange(total_connections) - np.repeat(np.cumsum(num_connections) - num_connections, num_connections)
+
+        input_node_ids = self.max_node_id + 1 + 2 * np.arange(total_connections, dtype=np.int64)
+        output_node_ids = input_node_ids + 1
+        self.max_node_id += 2 * total_connections
+
+        # The PTCs count up per layer and location, every unit takes num_connections on its input and its output layer
+        unit_ptcs = self.ptc_allocator.allocate(np.stack((plan.input_layer, plan.output_layer), axis=1).ravel(), np.repeat(plan.x, 2), np.repeat(plan.y, 2), np.repeat(num_connections, 2)).reshape(-1, 2)
+
+        nodes = np.empty((2 * total_connections, 5), dtype=np.int64)
+        nodes[0::2, 0] = input_node_ids
+        nodes[1::2, 0] = output_node_ids
+        nodes[0::2, 1] = plan.input_layer[connection_unit]
+        nodes[1::2, 1] = plan.output_layer[connection_unit]
+        nodes[:, 2] = np.repeat(plan.x[connection_unit], 2)
+        nodes[:, 3] = np.repeat(plan.y[connection_unit], 2)
+        nodes[0::2, 4] = unit_ptcs[connection_unit, 0] + connection_index
+        nodes[1::2, 4] = unit_ptcs[connection_unit, 1] + connection_index
+
+        # Edges of a connection, in order: inputs side by side, outputs side by side, then the one between its NONE nodes
+        edge_counts = (num_inputs + num_outputs + 1)[connection_unit]
+        total_edges = int(edge_counts.sum())
+        edge_connection = np.repeat(np.arange(total_connections), edge_counts)
+        slots = np.arange(total_edges) - np.repeat(np.cumsum(edge_counts) - edge_counts, edge_counts)
+        edge_unit = connection_unit[edge_connection]
+
+        is_input = slots < num_inputs[edge_unit]
+        is_output = ~is_input & (slots < (num_inputs + num_outputs)[edge_unit])
+        is_between = ~(is_input | is_output)
+
+        input_rows = self.pick_side_rows(slots[is_input], edge_unit[is_input], connection_index[edge_connection[is_input]], inputs_per_side, plan.input_starts, plan.input_lens, input_pattern, wide_sides)
+        output_rows = self.pick_side_rows(slots[is_output] - num_inputs[edge_unit[is_output]], edge_unit[is_output], connection_index[edge_connection[is_output]], outputs_per_side, plan.output_starts, plan.output_lens, output_pattern, no_wide_sides)
+
+        # need to figure put edge switch based on sink_node segment id
+        segment_switches = np.full(max(int(self.chan_nodes.segment.max(initial=0)), self.segment_id, *(int(segment) for segment in node_switch_id)) + 1, self.switch_id, dtype=np.int64)
+        for segment, switch in node_switch_id.items():
+            segment_switches[int(segment)] = int(switch)
+
+        edges = np.empty((total_edges, 3), dtype=np.int64)
+        edges[is_input, 0] = self.chan_nodes.id[input_rows]
+        edges[is_input, 1] = input_node_ids[edge_connection[is_input]]
+        edges[is_input, 2] = segment_switches[self.segment_id]
+
+        edges[is_output, 0] = output_node_ids[edge_connection[is_output]]
+        edges[is_output, 1] = self.chan_nodes.id[output_rows]
+        edges[is_output, 2] = segment_switches[self.chan_nodes.segment[output_rows]]
+
+        edges[is_between, 0] = input_node_ids[edge_connection[is_between]]
+        edges[is_between, 1] = output_node_ids[edge_connection[is_between]]
+        edges[is_between, 2] = segment_switches[self.segment_id]
+
+        return nodes, edges
+
+    def generate_sb_region(self, variant, sb_locations, number_sbs=0):
+        '''
+            Function to create the SB nodes and edges for the given locations, in order, numbering the new nodes from
+            max_node_id. The locations are done in batches of SB_LOCATIONS_PER_BATCH, if number_sbs is given the progress
+            is printed against it.
+
+            Yields the new nodes and edges of each batch (see create_sb_connections)
+        '''
+        for start in range(0, len(sb_locations), SB_LOCATIONS_PER_BATCH):
+            yield self.create_sb_connections(variant, sb_locations[start:start + SB_LOCATIONS_PER_BATCH])
+
+            if number_sbs > 0:
+                print_verbose(f"Created {round((min(start + SB_LOCATIONS_PER_BATCH, len(sb_locations)) / number_sbs) * 100)}% of 3D SBs")
+
+    def count_sb_region_nodes(self, variant, sb_locations):
+        '''
+            Function to count the nodes generate_sb_region adds for the given locations without creating them.
+            Every connection adds two NONE nodes (see create_sb_connections).
+        '''
+        return 2 * int(self.plan_sb_connections(variant, sb_locations).num_connections.sum())
+
+    def generate_sb_region_text(self, variant, sb_locations, base_node_id, keep_arrays=False, formatted=True):
+        '''
+            Worker of the parallel SB generation. Creates the SBs of one region with the node ids following base_node_id,
+            and returns the new nodes and edges already formatted (or as one array each without formatted, for binary
+            outputs), with their counts. With keep_arrays the batches of new nodes and edges are returned as well (for
+            the validator), otherwise None
+        '''
+        self.reset_sb_state()
+        self.max_node_id = base_node_id
+
+        node_blocks = []
+        edge_blocks = []
+        batches = [] if keep_arrays else None
+        num_nodes = 0
+        num_edges = 0
+        for nodes, edges in self.generate_sb_region(variant, sb_locations):
+            node_blocks.append(self.format_nodes(nodes) if formatted else nodes)
+            edge_blocks.append(format_edges(edges) if formatted else edges)
+            num_nodes += len(nodes)
+            num_edges += len(edges)
+            if keep_arrays:
+                batches.append((nodes, edges))
+
+        if not formatted:
+            return np.concatenate(node_blocks) if num_nodes > 0 else None, np.concatenate(edge_blocks) if num_edges > 0 else None, num_nodes, num_edges, batches
+        return b"".join(node_blocks), b"".join(edge_blocks), num_nodes, num_edges, batches
+
+    def generate_sbs_parallel(self, variant, sb_locations, executor, num_jobs, store, validator=None):
+        '''
+            Function to create the SBs of all locations with the executor's pool of num_jobs processes, into the store.
+
+            The locations are split into contiguous regions (strips of the fabric, in the same order the serial loop visits
+            them). A first pass counts the nodes each region adds, so every region knows the id its nodes start from and
+            gets the same ids as in a serial run. PTCs are counted per location so they don't depend on the other regions.
+            The second pass generates and formats each region, the results are added to the store in region order so the
+            output is the same as the serial one. Only a few regions per job are in flight at a time, so finished regions
+            that wait for an earlier one don't pile up in memory.
+        '''
+        regions = split_sb_locations(sb_locations, num_jobs * SB_REGIONS_PER_JOB)
+
+        # The workers are forked from this generator (see generate), only the variant and the regions are sent to them
+        region_variants = [variant] * len(regions)
+
+        count_start_time = time.time()
+        region_node_counts = list(executor.map(_count_sb_region_nodes, region_variants, regions))
+        count_end_time = time.time()
+        print_verbose(f"Counting nodes of {len(regions)} regions took { ((count_end_time - count_start_time) * 1000):0.2f} ms")
+
+        region_base_ids = (self.rrg_max_node_id + np.concatenate(([0], np.cumsum(region_node_counts)[:-1]))).tolist()
+
+        pending = deque()
+        next_region = 0
+        for region_num in range(len(regions)):
+            while next_region < len(regions) and len(pending) < num_jobs * SB_REGIONS_IN_FLIGHT_PER_JOB:
+                pending.append(executor.submit(_generate_sb_region_text, variant, regions[next_region], region_base_ids[next_region], validator is not None, not is_binary_rrg_path(variant.output_path)))
+                next_region += 1
+
+            node_block, edge_block, region_nodes, region_edges, batches = pending.popleft().result()
+            if region_nodes != region_node_counts[region_num]:
+                print(f"ERROR: Region {region_num} created {region_nodes} nodes but {region_node_counts[region_num]} were counted")
+                exit(1)
+
+            if validator is not None:
+                for nodes, edges in batches:
+                    validator.check_nodes(nodes)
+                    validator.check_edges(edges)
+
+            store.append("nodes", node_block, region_nodes)
+            store.append("edges", edge_block, region_edges)
+
+            print_verbose(f"Created {round(((region_num + 1) / len(regions)) * 100)}% of 3D SBs")
+
+    def create_sb(self, structure, variant, sb_locations, base_rrg_path="", executor=None, num_jobs=1, validator=None):
+        print_verbose("Creating SB connections")
+
+        start_time = time.time()
+
+        self.reset_sb_state()
+
+        if validator is not None:
+            validator.reset(variant.output_path)
+
+        # Spill files go next to the output, where there has to be room for the 3D RRG anyway
+        store = SpillStore(self.memory_budget, temp_dir=os.path.dirname(os.path.abspath(variant.output_path)))
+
+        try:
+            with self.profiler.phase("generate_sbs", sb_locations=len(sb_locations)) as phase:
+                if executor is not None and len(sb_locations) > 1:
+                    self.generate_sbs_parallel(variant, sb_locations, executor, num_jobs, store, validator=validator)
+                else:
+                    number_sbs = self.device_max_x * self.device_max_y * variant.percent_connectivity
+                    for nodes, edges in self.generate_sb_region(variant, sb_locations, number_sbs):
+                        if validator is not None:
+                            validator.check_nodes(nodes)
+                            validator.check_edges(edges)
+                        store.append("nodes", nodes, len(nodes))
+                        store.append("edges", edges, len(edges))
+
+                phase["nodes"] = store.counts["nodes"]
+                phase["edges"] = store.counts["edges"]
+                phase["spilled"] = store.spill_file is not None
+
+            # The whole 3D RRG is checked before anything is written
+            if validator is not None:
+                with self.profiler.phase("validate"):
+                    validator.finish()
+
+            num_nodes = store.counts["nodes"]
+            num_edges = store.counts["edges"]
+            print_verbose(f"\nNumber of new nodes: {num_nodes}")
+            print_verbose(f"Number of new edges: {num_edges}\n")
+
+            # The nodes are created in id order, each chunk is formatted when it's written. Binary outputs are filled
+            # straight from the arrays, the parallel generation doesn't format them
+            nodes_to_write = formatted_chunks(store.chunks("nodes"), self.format_nodes)
+            edges_to_write = formatted_chunks(store.chunks("edges"), format_edges)
+
+            print_verbose("Writing SB Nodes and Edges")
+            writing_start_time = time.time()
+            with self.profiler.phase("write", nodes=num_nodes, edges=num_edges) as phase:
+                if is_binary_rrg_path(variant.output_path):
+                    write_rrg_binary(base_rrg_path, variant.output_path, store.chunks("nodes"), store.chunks("edges"), num_nodes, num_edges, self.rrg_insertion_offsets, self.segment_id, schema_path=self.rrg_schema, memory_budget=self.memory_budget)
+                else:
+                    write_sb_nodes_and_edges_streaming_simple(base_rrg_path, variant.output_path, nodes_to_write, edges_to_write, self.rrg_insertion_offsets)
+                phase["output_bytes"] = os.path.getsize(variant.output_path)
+
+            writing_end_time = time.time()
+            print_verbose(f"Writing SB Nodes and Edges took { ((writing_end_time - writing_start_time) * 1000):0.2f} ms")
+        finally:
+            store.close()
+
+        end_time = time.time()
+        print_verbose(f"Creating SB connections took { ((end_time - start_time) * 1000):0.2f} ms")
+
+        print_verbose(f"Total number of SBs created: {len(sb_locations)}")
+
+    def extract_switches_and_segments_streaming(self, parser):
+        """
+        Extract only the switch and segment tables from the (event, element) stream, return as soon as the segments are read
+        so the same stream can carry on with the nodes
+        """
+
+        self.rrg_switches = []
+        self.rrg_segments = []
+
+        in_switches = False
+        in_segments = False
+
+        for event, elem in parser:
+            # Process switches
+            if event == 'start' and elem.tag == 'switches':
+                in_switches = True
+            elif event == 'end' and elem.tag == 'switches':
+                in_switches = False
+            elif event == 'end' and elem.tag == 'switch' and in_switches:
+                self.rrg_switches.append((int(elem.get('id')), elem.get('name')))
+
+            # Process segments
+            elif event == 'start' and elem.tag == 'segments':
+                in_segments = True
+            elif event == 'end' and elem.tag == 'segments':
+                # Once we've processed both switches and segments, we can stop
+                elem.clear()
+                break
+            elif event == 'end' and elem.tag == 'segment' and in_segments:
+                self.rrg_segments.append((int(elem.get('id')), elem.get('name')))
+
+            # Clean up any other elements we encounter
+            if event == 'end':
+                elem.clear()
+
+    def extract_switches_and_segments_indexed(self, sections):
+        """
+        Version of extract_switches_and_segments_streaming parsing only the <switches> and <segments> sections of the RRG,
+        found with RRGSectionIndex, instead of parsing the RRG from the start until the segments are read
+        """
+
+        self.rrg_switches = []
+        self.rrg_segments = []
+
+        switches = sections.parse("switches")
+        if switches is not None:
+            self.rrg_switches = [(int(elem.get('id')), elem.get('name')) for elem in switches.iter('switch')]
+
+        segments = sections.parse("segments")
+        if segments is not None:
+            self.rrg_segments = [(int(elem.get('id')), elem.get('name')) for elem in segments.iter('segment')]
+
+    def select_switch_and_segment(self, segment_name, switch_name):
+        """
+        Look up the ids of the 3D SB switch and segment in the switch and segment tables of the RRG,
+        and key the segment connection patterns from the architecture by segment id
+        """
+        self.segment_id = 0
+        self.switch_id = 2
+        self.pattern_dict = defaultdict(list, self.arch_patterns)
+        self.pattern_matrix = None
+        self.pattern_lengths = None
+
+        found_switch = False
+        for id_val, name in self.rrg_switches:
+            if name == switch_name:
+                self.switch_id = id_val
+                found_switch = True
+
+        if not found_switch and switch_name != "":
+            print(f"ERROR: Switch {switch_name} not found in architecture file.")
+            exit(1)
+
+        found_segment = False
+        for id_val, name in self.rrg_segments:
+            if name in self.pattern_dict:
+                self.pattern_dict[id_val] = self.pattern_dict.pop(name)
+
+            if name == segment_name:
+                self.segment_id = id_val
+                found_segment = True
+
+        if not found_segment and segment_name != "":
+            print(f"ERROR: Segment {segment_name} not found in architecture file.")
+            exit(1)
+
+    def parse_arch_xml(self, arch_file):
+        '''
+        Function to parse the architecture XML file. It looks for the SB connection pattern of the segments in the architecture.
+        As well as the segment id and the switch id for the 3D SBs (if defined by user), else it uses the first segment and switch it finds.
+        '''
+        print_verbose(f"Reading Architecture File: {arch_file}")
+        parser = etree.XMLParser(
+                remove_blank_text=True,
+                remove_comments=True,
+                collect_ids=False,
+                huge_tree=True,  # Allows for larger trees
+                resolve_entities=False  # Saves some memory
+            )
+
+        arch_tree = etree.parse(arch_file, parser)
+        arch_root = arch_tree.getroot()
+
+        segment_list = arch_root.find("segmentlist")
+
+        for segment in segment_list.findall("segment"):
+            name = segment.get("name")
+            pattern = segment.find("sb").text
+            pattern = pattern.split(" ")
+            self.arch_patterns[name] = [True if x == "1" else False for x in pattern]
@@ -0,0 +1,352 @@
+from lxml import etree
+from collections import namedtuple
+import itertools
+import os
+import time
+import numpy as np
+from printing import print_verbose
+from rrg_compression import open_rrg
+
+# A routing segment of a synthetic RRG. Segments with freq 0 are only in the segment table (like the 3D SB segment),
+# the others share the channel tracks in proportion to their freq
+SyntheticSegment = namedtuple("SyntheticSegment", ["name", "length", "freq"])
+
+# The segments and switches of the LaZagna architectures (see arch_files/templates), used when no architecture is given
+DEFAULT_SEGMENTS = [SyntheticSegment("L4", 4, 280), SyntheticSegment("L16", 16, 40), SyntheticSegment("3D_SB_connection", 1, 0)]
+DEFAULT_SWITCHES = ["L4_driver", "L4_inter_layer_driver", "L16_driver", "L16_inter_layer_driver", "ipin_cblock", "ipin_inter_layer_cblock", "3D_SB_switch"]
+
+# VPR always adds its delayless switch as switch 0
+DELAYLESS_SWITCH = "__vpr_delayless_switch__"
+
+# Node and edge rows are formatted with one string formatting call per batch of this many
+SYNTHETIC_BATCH_SIZE = 10000
+
+# Channel nodes are laid out the way VPR writes them, so the 3D SB creator's rr_nodes scanner reads them
+CHAN_NODE_XML_FORMAT = (
+    '    <node capacity="1" direction="%s" id="%d" type="%s">\n'
+    '      <loc layer="%d" ptc="%d" xhigh="%d" xlow="%d" yhigh="%d" ylow="%d"/>\n'
+    '      <timing C="0" R="0"/>\n'
+    '      <segment segment_id="%d"/>\n'
+    '    </node>\n'
+)
+PIN_NODE_XML_FORMAT = (
+    '    <node capacity="1" id="%d" type="%s">\n'
+    '      <loc layer="%d" ptc="%d"%s xhigh="%d" xlow="%d" yhigh="%d" ylow="%d"/>\n'
+    '      <timing C="0" R="0"/>\n'
+    '    </node>\n'
+)
+EDGE_XML_FORMAT = '    <edge sink_node="%d" src_node="%d" switch_id="%d"/>\n'
+
+DIRECTION_NAMES = ["INC_DIR", "DEC_DIR"]
+
+def read_arch_segments_and_switches(arch_file):
+    """
+    Read the segments (name, length and freq) and switch names of an architecture XML file, so a synthetic RRG has the
+    same tables as the RRG VPR would make from it
+    """
+    parser = etree.XMLParser(remove_blank_text=True, remove_comments=True)
+    arch_root = etree.parse(arch_file, parser).getroot()
+
+    segments = []
+    for segment in arch_root.find("segmentlist").findall("segment"):
+        segments.append(SyntheticSegment(segment.get("name"), int(segment.get("length", 1)), float(segment.get("freq", 0))))
+
+    switches = [switch.get("name") for switch in arch_root.find("switchlist").findall("switch")]
+
+    return segments, switches
+
+def parse_segment_mix(segment_strings):
+    """Parse segments given as "name:length:freq" strings, e.g. ["L4:4:280", "L16:16:40"]"""
+    segments = []
+    for segment_string in segment_strings:
+        fields = segment_string.split(":")
+        if len(fields) != 3:
+            print(f"ERROR: Segment {segment_string} must be given as name:length:freq")
+            exit(1)
+        try:
+            segments.append(SyntheticSegment(fields[0], int(fields[1]), float(fields[2])))
+        except ValueError:
+            print(f"ERROR: Segment {segment_string} must have an integer length and a numeric freq")
+            exit(1)
+
+    return segments
+
+def track_segments(channel_width, segments):
+    """
+    Split the tracks of a channel between the segments with a freq, in INC_DIR/DEC_DIR pairs like VPR does for
+    unidirectional segments. Returns the index in segments of the segment of every track
+    """
+    routed = [i for i, segment in enumerate(segments) if segment.freq > 0]
+    if len(routed) == 0:
+        print("ERROR: At least one segment needs a freq above 0 to have tracks")
+        exit(1)
+
+    num_pairs = channel_width // 2
+    freqs = np.array([segments[i].freq for i in routed], dtype=np.float64)
+    shares = freqs / freqs.sum() * num_pairs
+
+    # Largest remainder, so the pairs add up to the channel width
+    pairs = np.floor(shares).astype(np.int64)
+    for i in np.argsort(-(shares - pairs), kind="stable")[:num_pairs - pairs.sum()]:
+        pairs[i] += 1
+
+    return np.repeat(np.repeat(routed, pairs), 2)
+
+def channel_wires(channel_width, segments, span_low, span_high):
+    """
+    The wires of every track of a channel spanning span_low to span_high, the same for every channel of a direction.
+    The wires of a track are staggered by the track's pair like VPR staggers the start of its segments. Returns arrays
+    of the track (the ptc), low and high coordinates of every wire
+    """
+    tracks = []
+    lows = []
+    highs = []
+
+    for track, segment_index in enumerate(track_segments(channel_width, segments)):
+        length = max(1, segments[segment_index].length)
+        starts = np.arange(span_low - (track // 2) % length, span_high + 1, length)
+        low = np.maximum(starts, span_low)
+        high = np.minimum(starts + length - 1, span_high)
+        keep = low <= high
+
+        tracks.append(np.full(keep.sum(), track))
+        lows.append(low[keep])
+        highs.append(high[keep])
+
+    return np.concatenate(tracks), np.concatenate(lows), np.concatenate(highs)
+
+def write_batches(outfile, row_format, rows):
+    """Write rows (tuples of the values of row_format) in batches of SYNTHETIC_BATCH_SIZE"""
+    for i in range(0, len(rows), SYNTHETIC_BATCH_SIZE):
+        batch = rows[i:i + SYNTHETIC_BATCH_SIZE]
+        outfile.write(((row_format * len(batch)) % tuple(itertools.chain.from_iterable(batch))).encode("utf-8"))
+
+class SyntheticRRGWriter:
+    """
+    Writes a synthetic VPR RR graph XML for a width x height device with a number of layers, without running VPR, to
+    benchmark the 3D SB creator at sizes where making a real base RRG takes VPR minutes.
+
+    Every layer has, in order:
+        - A SOURCE, SINK and pins_per_tile OPINs and IPINs per tile (x 1 to width - 2, y 1 to height - 2)
+        - CHANX channels (y 0 to height - 2, x 1 to width - 2) and CHANY channels (x 0 to width - 2, y 1 to height - 2)
+          of channel_width tracks, split between the segments by freq in INC_DIR/DEC_DIR pairs, with the ptc of a wire
+          being its track
+
+    The edges connect the SOURCE to the OPINs and the IPINs to the SINK of each tile, each OPIN to opin_fanout wires of
+    any layer, each wire to chan_fanout wires and an IPIN of its layer. Edges take the driver switches of the
+    architecture (<segment>_driver, <segment>_inter_layer_driver, ipin_cblock) when the switch table has them, the
+    delayless switch otherwise. The fanout is picked with a seeded generator, so the same arguments give the same RRG.
+    """
+
+    def __init__(self, width, height, channel_width, layers=2, segments=DEFAULT_SEGMENTS, switches=DEFAULT_SWITCHES, pins_per_tile=4, chan_fanout=6, opin_fanout=4, seed=1):
+        if width < 3 or height < 3:
+            print(f"ERROR: A synthetic RRG needs a device of at least 3x3, not {width}x{height}")
+            exit(1)
+        if channel_width < 2 or channel_width % 2 != 0:
+            print(f"ERROR: The channel width of a synthetic RRG must be even and at least 2, not {channel_width}")
+            exit(1)
+
+        self.width = width
+        self.height = height
+        self.channel_width = channel_width
+        self.layers = layers
+        self.segments = list(segments)
+        self.switches = [DELAYLESS_SWITCH] + [switch for switch in switches if switch != DELAYLESS_SWITCH]
+        self.pins_per_tile = pins_per_tile
+        self.chan_fanout = chan_fanout
+        self.opin_fanout = opin_fanout
+        self.rng = np.random.default_rng(seed)
+
+        switch_ids = {name: i for i, name in enumerate(self.switches)}
+        self.driver_switches = np.array([switch_ids.get(f"{segment.name}_driver", 0) for segment in self.segments])
+        self.inter_layer_switches = np.array([switch_ids.get(f"{segment.name}_inter_layer_driver", 0) for segment in self.segments])
+        self.ipin_switch = switch_ids.get("ipin_cblock", 0)
+
+        self.tiles_x, self.tiles_y = [grid.ravel() for grid in np.meshgrid(np.arange(1, width - 1), np.arange(1, height - 1), indexing="ij")]
+        self.track_segment = track_segments(channel_width, self.segments)
+
+        # Wires of a single channel, the same for every channel of a direction
+        self.chanx_wires = channel_wires(channel_width, self.segments, 1, width - 2)
+        self.chany_wires = channel_wires(channel_width, self.segments, 1, height - 2)
+
+        num_tiles = len(self.tiles_x)
+        self.pins_per_layer = num_tiles * (2 + 2 * pins_per_tile)
+        self.chanx_per_layer = (height - 1) * len(self.chanx_wires[0])
+        self.chany_per_layer = (width - 1) * len(self.chany_wires[0])
+        self.nodes_per_layer = self.pins_per_layer + self.chanx_per_layer + self.chany_per_layer
+
+        self.num_nodes = self.nodes_per_layer * layers
+        self.num_edges = 0
+
+    def layer_base(self, layer):
+        return layer * self.nodes_per_layer
+
+    def pin_ids(self, layer, kind):
+        """Ids of the pins of a layer, kind being 0 (SOURCE), 1 (SINK), 2 (OPIN) or 3 (IPIN). OPINs and IPINs are
+        (tiles, pins_per_tile) arrays"""
+        base = self.layer_base(layer)
+        num_tiles = len(self.tiles_x)
+        pins = self.pins_per_tile
+
+        tile_base = base + np.arange(num_tiles) * (2 + 2 * pins)
+        if kind < 2:
+            return tile_base + kind
+        return tile_base[:, None] + 2 + (kind - 2) * pins + np.arange(pins)[None, :]
+
+    def chan_range(self, layer):
+        """First id and number of the channel wires of a layer"""
+        return self.layer_base(layer) + self.pins_per_layer, self.chanx_per_layer + self.chany_per_layer
+
+    def chan_columns(self, layer):
+        """Columns of the channel wires of a layer, in id order: CHANX then CHANY, channel by channel"""
+        columns = []
+        for chan_type, (tracks, lows, highs), num_channels in (("CHANX", self.chanx_wires, self.height - 1), ("CHANY", self.chany_wires, self.width - 1)):
+            channel = np.repeat(np.arange(num_channels), len(tracks))
+            tracks = np.tile(tracks, num_channels)
+            lows = np.tile(lows, num_channels)
+            highs = np.tile(highs, num_channels)
+            if chan_type == "CHANX":
+                columns.append((chan_type, tracks, lows, highs, channel, channel))
+            else:
+                columns.append((chan_type, tracks, channel, channel, lows, highs))
+        return columns
+
+    def write_header(self, outfile):
+        width, height, channel_width = self.width, self.height, self.channel_width
+
+        outfile.write(b'<rr_graph tool_name="vpr" tool_version="synthetic" tool_comment="Synthetic RR graph written by LaZagna">\n')
+
+        outfile.write(f'  <channels>\n    <channel chan_width_max="{channel_width}" x_max="{channel_width}" x_min="{channel_width}" y_max="{channel_width}" y_min="{channel_width}"/>\n'.encode())
+        write_batches(outfile, '    <x_list index="%d" info="%d"/>\n', [(y, channel_width) for y in range(height)])
+        write_batches(outfile, '    <y_list index="%d" info="%d"/>\n', [(x, channel_width) for x in range(width)])
+        outfile.write(b'  </channels>\n')
+
+        outfile.write(b'  <switches>\n')
+        for switch_id, name in enumerate(self.switches):
+            outfile.write(f'    <switch id="{switch_id}" name="{name}" type="mux">\n      <timing Cin="0" Cinternal="0" Cout="0" R="0" Tdel="0"/>\n      <sizing buf_size="0" mux_trans_size="0"/>\n    </switch>\n'.encode())
+        outfile.write(b'  </switches>\n')
+
+        outfile.write(b'  <segments>\n')
+        for segment_id, segment in enumerate(self.segments):
+            outfile.write(f'    <segment id="{segment_id}" length="{segment.length}" name="{segment.name}" res_type="GENERAL">\n      <timing C_per_meter="0" R_per_meter="0"/>\n    </segment>\n'.encode())
+        outfile.write(b'  </segments>\n')
+
+        # io around the device and clbs inside it
+        outfile.write(b'  <block_types>\n')
+        outfile.write(b'    <block_type height="1" id="0" name="EMPTY" width="1"/>\n')
+        outfile.write(b'    <block_type height="1" id="1" name="io" width="1"/>\n')
+        outfile.write(b'    <block_type height="1" id="2" name="clb" width="1"/>\n')
+        outfile.write(b'  </block_types>\n')
+
+        outfile.write(b'  <grid>\n')
+        grid = []
+        for layer in range(self.layers):
+            for x in range(width):
+                for y in range(height):
+                    corner = x in (0, width - 1) and y in (0, height - 1)
+                    edge = x in (0, width - 1) or y in (0, height - 1)
+                    grid.append((0 if corner else 1 if edge else 2, layer, x, y))
+        write_batches(outfile, '    <grid_loc block_type_id="%d" height_offset="0" layer="%d" width_offset="0" x="%d" y="%d"/>\n', grid)
+        outfile.write(b'  </grid>\n')
+
+    def write_nodes(self, outfile):
+        outfile.write(b'  <rr_nodes>\n')
+        pins = self.pins_per_tile
+
+        for layer in range(self.layers):
+            # Pins, tile by tile
+            node_id = self.layer_base(layer)
+            rows = []
+            for x, y in zip(self.tiles_x.tolist(), self.tiles_y.tolist()):
+                rows.append((node_id, "SOURCE", layer, 0, "", x, x, y, y))
+                rows.append((node_id + 1, "SINK", layer, 1, "", x, x, y, y))
+                node_id += 2
+                for kind in ("OPIN", "IPIN"):
+                    for pin in range(pins):
+                        rows.append((node_id, kind, layer, pin if kind == "OPIN" else pins + pin, ' side="TOP"', x, x, y, y))
+                        node_id += 1
+            write_batches(outfile, PIN_NODE_XML_FORMAT, rows)
+
+            # Channel wires
+            for chan_type, tracks, xlows, xhighs, ylows, yhighs in self.chan_columns(layer):
+                directions = [DIRECTION_NAMES[track % 2] for track in tracks.tolist()]
+                ids = np.arange(node_id, node_id + len(tracks))
+                node_id += len(tracks)
+                rows = list(zip(directions, ids.tolist(), itertools.repeat(chan_type), itertools.repeat(layer), tracks.tolist(), xhighs.tolist(), xlows.tolist(), yhighs.tolist(), ylows.tolist(), self.track_segment[tracks].tolist()))
+                write_batches(outfile, CHAN_NODE_XML_FORMAT, rows)
+
+        outfile.write(b'  </rr_nodes>\n')
+
+    def layer_edges(self, layer):
+        """The edges driven by the nodes of a layer as (src, sink, switch) arrays, ordered by src"""
+        chan_start, num_chan = self.chan_range(layer)
+        chan_tracks = np.concatenate([columns[1] for columns in self.chan_columns(layer)])
+        chan_segments = self.track_segment[chan_tracks]
+
+        sources = self.pin_ids(layer, 0)
+        sinks = self.pin_ids(layer, 1)
+        opins = self.pin_ids(layer, 2)
+        ipins = self.pin_ids(layer, 3)
+        pins = self.pins_per_tile
+
+        edges = []
+
+        # SOURCE -> OPINs and IPINs -> SINK of every tile
+        edges.append((np.repeat(sources, pins), opins.ravel(), np.zeros(opins.size, dtype=np.int64)))
+        edges.append((ipins.ravel(), np.repeat(sinks, pins), np.zeros(ipins.size, dtype=np.int64)))
+
+        # OPINs -> wires of any layer
+        opin_src = np.repeat(opins.ravel(), self.opin_fanout)
+        sink_layers = self.rng.integers(0, self.layers, len(opin_src))
+        sink_offsets = self.rng.integers(0, num_chan, len(opin_src))
+        sink_segments = chan_segments[sink_offsets]
+        opin_switch = np.where(sink_layers == layer, self.driver_switches[sink_segments], self.inter_layer_switches[sink_segments])
+        edges.append((opin_src, sink_layers * self.nodes_per_layer + self.pins_per_layer + sink_offsets, opin_switch))
+
+        # Wires -> wires and an IPIN of the same layer
+        chan_ids = chan_start + np.arange(num_chan)
+        chan_sink_offsets = self.rng.integers(0, num_chan, num_chan * self.chan_fanout)
+        edges.append((np.repeat(chan_ids, self.chan_fanout), chan_start + chan_sink_offsets, self.driver_switches[chan_segments[chan_sink_offsets]]))
+        edges.append((chan_ids, ipins.ravel()[self.rng.integers(0, ipins.size, num_chan)], np.full(num_chan, self.ipin_switch)))
+
+        src = np.concatenate([edge[0] for edge in edges])
+        sink = np.concatenate([edge[1] for edge in edges])
+        switch = np.concatenate([edge[2] for edge in edges])
+
+        order = np.lexsort((sink, src))
+        return np.stack([src[order], sink[order], switch[order]], axis=1)
+
+    def write_edges(self, outfile):
+        outfile.write(b'  <rr_edges>\n')
+
+        for layer in range(self.layers):
+            edges = self.layer_edges(layer)
+            self.num_edges += len(edges)
+            for i in range(0, len(edges), SYNTHETIC_BATCH_SIZE):
+                batch = edges[i:i + SYNTHETIC_BATCH_SIZE]
+                outfile.write(((EDGE_XML_FORMAT * len(batch)) % tuple(batch[:, [1, 0, 2]].ravel().tolist())).encode("utf-8"))
+
+        outfile.write(b'  </rr_edges>\n')
+
+    def write(self, output_path):
+        """Write the RRG to output_path, compressed if it ends in .gz or .zst (see open_rrg)"""
+        start_time = time.time()
+
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open_rrg(output_path, "wb") as outfile:
+            self.write_header(outfile)
+            self.write_nodes(outfile)
+            self.write_edges(outfile)
+            outfile.write(b'</rr_graph>\n')
+
+        end_time = time.time()
+        print_verbose(f"Writing synthetic RRG {output_path} ({self.num_nodes} nodes, {self.num_edges} edges) took {((end_time - start_time) * 1000):0.2f} ms")
+
+def write_synthetic_rrg(output_path, width, height, channel_width, layers=2, segments=DEFAULT_SEGMENTS, switches=DEFAULT_SWITCHES, pins_per_tile=4, chan_fanout=6, opin_fanout=4, seed=1):
+    """
+    Write a synthetic base RRG (see SyntheticRRGWriter) to output_path. Returns the number of nodes and edges written
+    """
+    writer = SyntheticRRGWriter(width, height, channel_width, layers=layers, segments=segments, switches=switches, pins_per_tile=pins_per_tile, chan_fanout=chan_fanout, opin_fanout=opin_fanout, seed=seed)
+    writer.write(output_path)
+
+    return writer.num_nodes, writer.num_edges
@@ -213,7 +213,8 @@ def get_run_params_from_yaml(file_path, verbose=False):
         'sb_switch_name', 'sb_segment_name', 'sb_input_pattern',
         'sb_output_pattern', 'sb_location_pattern', 'sb_grid_csv_path',
         'vertical_delay_ratio', 'base_delay_switch', 'switch_interlayer_pairs',
-        'update_arch_delay', 'linked_params', 'sb_pattern',
+        'update_arch_delay', 'linked_params', 'sb_pattern', 'rrg_format', 'rrg_compression',
+        'sb_location_seed',
     ]
 
     #check there are no extra parameters
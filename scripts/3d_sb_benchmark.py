@@ -0,0 +1,264 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+# The synthetic RRG writer lives with the rest of the flow in lazagna/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lazagna"))
+
+import printing
+from printing import print_verbose
+from artifact_store import atomic_write
+from synthetic_rrg import write_synthetic_rrg, read_arch_segments_and_switches
+from rrg_profile import profile_path
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+original_dir = os.path.dirname(script_dir)
+
+# Version of the benchmark results layout, bump it whenever the metrics change
+BENCHMARK_FORMAT_VERSION = 2
+
+DEFAULT_LADDER = ["10x10:50", "25x25:100", "50x50:200", "100x100:300", "200x200:400"]
+
+# Metrics where larger is better (throughputs), the others (times and memory) are better smaller
+HIGHER_IS_BETTER_SUFFIX = "_per_s"
+
+# Phases shorter than this (in both the results and the baseline) are too noisy to compare, their time and throughputs
+# are left out of the regression check
+MIN_COMPARED_WALL_S = 0.05
+
+PHASES = ("read_rrg", "build_sb_index", "generate_sbs", "write")
+
+args_parser = argparse.ArgumentParser(description="Benchmark the parse, generate and write phases of the 3D SB creator over a ladder of synthetic base RRGs, and check the results against a baseline for throughput and memory regressions")
+
+args_parser.add_argument("--sizes", nargs="+", type=str, metavar="WxH:CW", help=f"The ladder of device sizes and channel widths to benchmark. Default: {' '.join(DEFAULT_LADDER)}", default=DEFAULT_LADDER)
+
+args_parser.add_argument("-l", "--layers", type=int, help="The number of layers of the synthetic RRGs", default=2)
+
+args_parser.add_argument("-a", "--arch_file", type=str, help="The architecture XML file given to the 3D SB creator, the synthetic RRGs take their segments and switches from it", default=original_dir + "/arch_files/templates/dsp_bram/vtr_arch_dsp_bram.xml")
+
+args_parser.add_argument("-c", "--connection_type", choices=["subset", "wilton", "wilton_2", "wilton_3"], help="The connection pattern of the 3D SBs", default="wilton")
+
+args_parser.add_argument("-p", "--percent_connectivity", type=float, help="The percentage of SBs that are 3D", default=0.5)
+
+args_parser.add_argument("--rrg_format", choices=["xml", "bin"], help="The format the 3D RRGs are written in. The binary copy of each synthetic RRG is converted on the first run and kept in the work directory, the best of several runs leaves the conversion out", default="xml")
+
+args_parser.add_argument("--rrg_schema", type=str, help="The file path to VPR's RR Graph Cap'n Proto schema, given to the 3D SB creator for --rrg_format bin", default="")
+
+args_parser.add_argument("-j", "--jobs", type=int, help="The number of processes the 3D SB creator generates the SBs with", default=1)
+
+args_parser.add_argument("-r", "--repeats", type=int, help="The number of runs of every size, the best result of each metric is kept", default=3)
+
+args_parser.add_argument("--work_dir", type=str, help="The directory the synthetic RRGs are kept in (they are reused by later benchmarks) and the 3D RRGs are written to", default=original_dir + "/benchmark_rrg")
+
+args_parser.add_argument("-o", "--output", type=str, help="The file path to write the results JSON to", default=original_dir + "/results/3d_sb_benchmark.json")
+
+args_parser.add_argument("--baseline", type=str, help="The results JSON of an earlier benchmark to compare against. Exits with an error if a size got slower or took more memory than the tolerance allows", default=None)
+
+args_parser.add_argument("--tolerance", type=float, help="The fraction a metric may be worse than the baseline before it is a regression", default=0.2)
+
+args_parser.add_argument("--keep_outputs", help="Keep the 3D RRGs written by the benchmark, they are removed after each run by default", action="store_true")
+
+args_parser.add_argument("-v", "--verbose", help="Whether to print verbose output.", action="store_true")
+
+def parse_size(size_string):
+    """Parse a ladder size given as WxH:CW, e.g. 50x50:200"""
+    try:
+        dimensions, channel_width = size_string.split(":")
+        width, height = dimensions.lower().split("x")
+        return int(width), int(height), int(channel_width)
+    except ValueError:
+        print(f"ERROR: Size {size_string} must be given as WxH:CW, e.g. 50x50:200")
+        exit(1)
+
+def synthetic_rrg_path(work_dir, width, height, channel_width, layers):
+    return os.path.join(work_dir, f"synthetic_{width}x{height}_cw_{channel_width}_l_{layers}.xml")
+
+def get_synthetic_rrg(work_dir, width, height, channel_width, layers, arch_file):
+    """Path of the synthetic RRG of a size, written first if the work directory doesn't have it yet"""
+    rrg_path = synthetic_rrg_path(work_dir, width, height, channel_width, layers)
+    if os.path.exists(rrg_path):
+        return rrg_path
+
+    print(f"Writing synthetic RRG {rrg_path}")
+    segments, switches = read_arch_segments_and_switches(arch_file)
+
+    # Written atomically, so an interrupted benchmark never leaves a partial RRG to reuse
+    with atomic_write(rrg_path) as temp_path:
+        write_synthetic_rrg(temp_path, width, height, channel_width, layers=layers, segments=segments, switches=switches)
+
+    return rrg_path
+
+def run_creator(args, rrg_path, output_path):
+    """Run the 3D SB creator once with --profile and return its profile"""
+    command = [sys.executable, os.path.join(script_dir, "3d_sb_creator.py"),
+               "-f", rrg_path,
+               "-o", output_path,
+               "-a", args.arch_file,
+               "-p", str(args.percent_connectivity),
+               "-c", args.connection_type,
+               "-j", str(args.jobs),
+               "--no_rrg_index",
+               "--profile"]
+    if args.rrg_schema != "":
+        command += ["--rrg_schema", args.rrg_schema]
+
+    print_verbose(f"Running {' '.join(command)}")
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        print(result.stdout)
+        print(f"ERROR: The 3D SB creator failed on {rrg_path}")
+        exit(1)
+
+    with open(profile_path(output_path), "r") as infile:
+        profile = json.load(infile)
+
+    if not args.keep_outputs:
+        for path in (output_path, profile_path(output_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    return profile
+
+def profile_metrics(profile, rrg_bytes):
+    """
+    The metrics of a run: wall time and throughput of each phase, and the peak memory of the creator alone and with its
+    SB workers (with -j > 1 most of the generation runs in the workers)
+    """
+    phases = {phase["name"]: phase for phase in profile["phases"]}
+    metrics = {"total_wall_s": sum(phase["wall_s"] for phase in profile["phases"]), "peak_rss_bytes": profile["peak_rss_bytes"], "total_peak_rss_bytes": profile["total_peak_rss_bytes"]}
+
+    for name in PHASES:
+        if name in phases:
+            metrics[f"{name}_wall_s"] = phases[name]["wall_s"]
+
+    if "read_rrg" in phases and phases["read_rrg"]["wall_s"] > 0:
+        metrics["read_rrg_bytes_per_s"] = rrg_bytes / phases["read_rrg"]["wall_s"]
+    for name in ("generate_sbs", "write"):
+        for count in ("nodes", "edges"):
+            if f"{count}_per_s" in phases.get(name, {}):
+                metrics[f"{name}_{count}_per_s"] = phases[name][f"{count}_per_s"]
+
+    return metrics
+
+def best_metrics(runs):
+    """The best value of every metric over several runs of the same size"""
+    best = {}
+    for name in runs[0]:
+        values = [run[name] for run in runs if name in run]
+        best[name] = max(values) if name.endswith(HIGHER_IS_BETTER_SUFFIX) else min(values)
+    return best
+
+def find_regressions(results, baseline, tolerance):
+    """The metrics of results worse than those of the same size in baseline by more than tolerance"""
+    baseline_sizes = {size["name"]: size for size in baseline["sizes"]}
+    regressions = []
+
+    if baseline.get("format_version") != BENCHMARK_FORMAT_VERSION:
+        print(f"WARNING: The baseline has format version {baseline.get('format_version')}, expected {BENCHMARK_FORMAT_VERSION}. Metrics it doesn't have are not compared")
+
+    for size in results["sizes"]:
+        if size["name"] not in baseline_sizes:
+            print(f"WARNING: Size {size['name']} is not in the baseline, not comparing it")
+            continue
+
+        metrics = size["metrics"]
+        baseline_metrics = baseline_sizes[size["name"]]["metrics"]
+        for name, value in metrics.items():
+            if name not in baseline_metrics or baseline_metrics[name] <= 0:
+                continue
+
+            phase = next((phase for phase in PHASES if name.startswith(phase + "_")), None)
+            if phase is not None and max(metrics.get(f"{phase}_wall_s", 0), baseline_metrics.get(f"{phase}_wall_s", 0)) < MIN_COMPARED_WALL_S:
+                continue
+
+            ratio = value / baseline_metrics[name]
+            if name.endswith(HIGHER_IS_BETTER_SUFFIX) and ratio < 1 - tolerance:
+                regressions.append((size["name"], name, baseline_metrics[name], value, ratio))
+            elif not name.endswith(HIGHER_IS_BETTER_SUFFIX) and ratio > 1 + tolerance:
+                regressions.append((size["name"], name, baseline_metrics[name], value, ratio))
+
+    return regressions
+
+def print_results(results):
+    print(f"{'size':>16} {'base MB':>9} {'read s':>8} {'gen s':>8} {'write s':>8} {'read MB/s':>10} {'gen edges/s':>12} {'write edges/s':>14} {'peak MB':>9}")
+    for size in results["sizes"]:
+        metrics = size["metrics"]
+        print(f"{size['name']:>16} {size['rrg_bytes'] / 1e6:>9.1f} {metrics.get('read_rrg_wall_s', 0):>8.2f} {metrics.get('generate_sbs_wall_s', 0):>8.2f} {metrics.get('write_wall_s', 0):>8.2f} {metrics.get('read_rrg_bytes_per_s', 0) / 1e6:>10.1f} {metrics.get('generate_sbs_edges_per_s', 0):>12.0f} {metrics.get('write_edges_per_s', 0):>14.0f} {metrics['total_peak_rss_bytes'] / 1e6:>9.1f}")
+
+def main():
+    args = args_parser.parse_args()
+
+    start_time = time.time()
+
+    printing.verbose = args.verbose
+
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    results = {
+        "format_version": BENCHMARK_FORMAT_VERSION,
+        "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "arch_file": os.path.abspath(args.arch_file),
+        "layers": args.layers,
+        "connection_type": args.connection_type,
+        "percent_connectivity": args.percent_connectivity,
+        "rrg_format": args.rrg_format,
+        "jobs": args.jobs,
+        "repeats": args.repeats,
+        "sizes": [],
+    }
+
+    for size_string in args.sizes:
+        width, height, channel_width = parse_size(size_string)
+        rrg_path = get_synthetic_rrg(args.work_dir, width, height, channel_width, args.layers, args.arch_file)
+        rrg_bytes = os.path.getsize(rrg_path)
+        output_path = os.path.join(args.work_dir, f"3d_{os.path.splitext(os.path.basename(rrg_path))[0]}.{args.rrg_format}")
+
+        runs = []
+        for repeat in range(args.repeats):
+            profile = run_creator(args, rrg_path, output_path)
+            runs.append(profile_metrics(profile, rrg_bytes))
+            print_verbose(f"Run {repeat + 1} of {size_string}: {runs[-1]}")
+
+        results["sizes"].append({
+            "name": f"{width}x{height}_cw_{channel_width}_l_{args.layers}",
+            "width": width,
+            "height": height,
+            "channel_width": channel_width,
+            "rrg_bytes": rrg_bytes,
+            "metrics": best_metrics(runs),
+        })
+        print(f"Benchmarked {size_string} in {runs[-1]['total_wall_s']:0.2f} s per run")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as outfile:
+        json.dump(results, outfile, indent=2)
+
+    print_results(results)
+    print(f"Wrote the benchmark results to {args.output}")
+
+    end_time = time.time()
+    print(f"Benchmarking took { ((end_time - start_time) * 1000):0.2f} ms")
+
+    if args.baseline is not None:
+        with open(args.baseline, "r") as infile:
+            baseline = json.load(infile)
+
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for size_name, name, baseline_value, value, ratio in regressions:
+            print(f"REGRESSION: {size_name} {name} went from {baseline_value:0.4g} to {value:0.4g} ({ratio:0.2f}x)")
+
+        if len(regressions) > 0:
+            print(f"ERROR: {len(regressions)} metrics regressed by more than {args.tolerance * 100:0.0f}% against {args.baseline}")
+            exit(1)
+
+        print(f"No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 from lxml import etree
 from collections import namedtuple
+import os
 import sys
 from collections import defaultdict
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lazagna"))
+
+from rrg_sections import RRGSectionIndex
+
 node_struct = namedtuple("Node", ["id", "type", "layer", "xhigh", "xlow", "yhigh", "ylow", "side", "direction", "ptc", "segment_id"])
 edge_struct = namedtuple("Edge", ["src_node", "sink_node", "src_layer", "sink_layer", "switch_id"])
 
@@ -376,8 +381,14 @@ def classify_channel_nodes(to_print=False):
 
 def read_structure(file_path):
     try:
-        tree = etree.parse(file_path)
-        root = tree.getroot()
+        # Only the sections the walker uses are parsed, the channels, block types and grid are skipped.
+        # Compressed RRGs (.xml.gz, .xml.zst) are decompressed while they are read
+        root = etree.Element("rr_graph")
+        with RRGSectionIndex(file_path) as sections:
+            for name in ("switches", "segments", "rr_nodes", "rr_edges"):
+                section = sections.parse(name)
+                if section is not None:
+                    root.append(section)
         return root
 
     except Exception as e:
@@ -0,0 +1,66 @@
+import argparse
+import os
+import sys
+import time
+
+# The writer lives with the rest of the flow in lazagna/, this script is a command line wrapper around it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lazagna"))
+
+import printing
+from synthetic_rrg import write_synthetic_rrg, read_arch_segments_and_switches, parse_segment_mix, DEFAULT_SEGMENTS, DEFAULT_SWITCHES, SyntheticSegment
+
+args_parser = argparse.ArgumentParser(description="Write a synthetic VPR RR Graph (without running VPR) to benchmark the 3D SB creator on devices of any size")
+
+args_parser.add_argument("-o", "--output_path", type=str, help="The file path to write the RR Graph XML to, compressed if it ends in `.gz` or `.zst`", required=True)
+
+args_parser.add_argument("-x", "--width", type=int, help="The width of the device, including the I/O ring", required=True)
+
+args_parser.add_argument("-y", "--height", type=int, help="The height of the device, including the I/O ring", required=True)
+
+args_parser.add_argument("-w", "--channel_width", type=int, help="The number of tracks of every channel, must be even", required=True)
+
+args_parser.add_argument("-l", "--layers", type=int, help="The number of layers of the device", default=2)
+
+args_parser.add_argument("-a", "--arch_file", type=str, help="Take the segments (names, lengths and freqs) and switches from this VPR architecture XML file. By default the segments and switches of the LaZagna architectures are used (L4 and L16 wires, 3D_SB_connection and 3D_SB_switch)", default=None)
+
+args_parser.add_argument("--segments", nargs="+", type=str, metavar="NAME:LENGTH:FREQ", help="The segments to split the tracks between, e.g. `--segments L4:4:280 L16:16:40`. Overrides the segments of `--arch_file`. The 3D SB segment (`--sb_3d_segment`) is added if it isn't given", default=None)
+
+args_parser.add_argument("--sb_3d_segment", type=str, help="The name of the 3D SB segment, added to the segment table (without tracks) if it isn't there", default="3D_SB_connection")
+
+args_parser.add_argument("--sb_3d_switch", type=str, help="The name of the 3D SB switch, added to the switch table if it isn't there", default="3D_SB_switch")
+
+args_parser.add_argument("--pins_per_tile", type=int, help="The number of OPINs and of IPINs of every tile", default=4)
+
+args_parser.add_argument("--chan_fanout", type=int, help="The number of wires every wire drives", default=6)
+
+args_parser.add_argument("--opin_fanout", type=int, help="The number of wires every OPIN drives", default=4)
+
+args_parser.add_argument("--seed", type=int, help="The seed of the fanout of the edges, the same seed and options always give the same RR Graph", default=1)
+
+args_parser.add_argument("-v", "--verbose", help="Whether to print verbose output.", action="store_true")
+
+def main():
+    args = args_parser.parse_args()
+
+    start_time = time.time()
+
+    printing.verbose = args.verbose
+
+    segments, switches = DEFAULT_SEGMENTS, DEFAULT_SWITCHES
+    if args.arch_file is not None:
+        segments, switches = read_arch_segments_and_switches(args.arch_file)
+    if args.segments is not None:
+        segments = parse_segment_mix(args.segments)
+
+    if args.sb_3d_segment not in [segment.name for segment in segments]:
+        segments = segments + [SyntheticSegment(args.sb_3d_segment, 1, 0)]
+    if args.sb_3d_switch not in switches:
+        switches = switches + [args.sb_3d_switch]
+
+    num_nodes, num_edges = write_synthetic_rrg(args.output_path, args.width, args.height, args.channel_width, layers=args.layers, segments=segments, switches=switches, pins_per_tile=args.pins_per_tile, chan_fanout=args.chan_fanout, opin_fanout=args.opin_fanout, seed=args.seed)
+
+    end_time = time.time()
+    print(f"Writing {args.output_path} with {num_nodes} nodes and {num_edges} edges took { ((end_time - start_time) * 1000):0.2f} ms")
+
+if __name__ == "__main__":
+    main()